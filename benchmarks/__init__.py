@@ -0,0 +1 @@
+# Benchmarks and local Azure stand-ins; run a benchmark with `python -m benchmarks.<name>`
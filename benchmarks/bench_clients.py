@@ -0,0 +1,60 @@
+"""
+Compares per-request latency of building a new BlobServiceClient for every upload
+(the old behaviour) against reusing the shared client from `modules.clients`.
+
+Usage: python -m benchmarks.bench_clients [--requests N]
+"""
+from azure.storage.blob import BlobServiceClient
+from benchmarks.stubs import StubServer
+from modules.clients import get_client, reset_clients
+import argparse
+import base64
+import statistics
+import time
+
+ACCOUNT_NAME = "devstoreaccount1"
+ACCOUNT_KEY = base64.b64encode(b"benchmark-key").decode()
+PAYLOAD = b"%PDF-1.4 small invoice" * 100
+
+
+def _upload(blob_service_client, index):
+    blob_client = blob_service_client.get_blob_client(container="bench", blob=f"invoice_{index}.pdf")
+    blob_client.upload_blob(PAYLOAD, overwrite=True)
+
+
+def _measure(label, requests, build_client):
+    latencies = []
+    for index in range(requests):
+        start = time.perf_counter()
+        _upload(build_client(), index)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:<24} mean {statistics.mean(latencies):7.2f} ms   p50 {statistics.median(latencies):7.2f} ms   p95 {p95:7.2f} ms")
+    return statistics.mean(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    with StubServer() as server:
+        account_url = f"{server.url}/{ACCOUNT_NAME}"
+        reset_clients()
+
+        fresh = _measure(
+            "new client per request",
+            args.requests,
+            lambda: BlobServiceClient(account_url=account_url, credential=ACCOUNT_KEY),
+        )
+        shared = _measure(
+            "shared client registry",
+            args.requests,
+            lambda: get_client(BlobServiceClient, account_url=account_url, credential=ACCOUNT_KEY),
+        )
+        print(f"Per-request latency reduced by {(1 - shared / fresh) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+Measures latency and throughput of the upload, analysis and pipeline functions against the local
+Azure stand-ins in benchmarks.stubs, with configurable service latency, errors and 429 throttling.
+
+Every scenario runs `--documents` operations at each `--concurrency` level and reports the mean,
+p50, p95 and p99 latency of the operations (failed ones included), the error rate and documents
+per second. Results can be written as JSON with `--output` and compared with an earlier run with
+`--compare`, which exits with status 1 when a p95 latency or throughput regressed by more than
+`--threshold` percent.
+
+Usage: python -m benchmarks.bench_end_to_end [--documents N] [--concurrency 1 4 16] [--latency-ms MS]
+           [--error-rate R] [--throttle-rate R] [--output results.json] [--compare previous.json]
+"""
+from azure.ai.formrecognizer import AnalyzeResult
+from azure.ai.formrecognizer._generated.v2023_07_31.models import AnalyzeResult as _GeneratedAnalyzeResult
+from benchmarks.stubs import BlobStubHandler, DocumentIntelligenceStubHandler, FileStubHandler, StubServer
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from modules.azure_blob import upload_blob_with_http, upload_blob_with_sdk
+from modules.azure_file import upload_file_with_http
+from modules.document_intelligence import analyze_invoice_with_sdk, extract_invoice_insights
+from modules.pipeline import analyze_file, run_batch
+from modules.storage import BlobSdkBackend
+import argparse
+import base64
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+
+SCENARIOS = (
+    "upload_blob_with_sdk", "upload_blob_with_http", "upload_file_with_http", "analyze_invoice_with_sdk",
+    "extract_invoice_insights", "analyze_file", "run_batch",
+)
+DEFAULT_CONCURRENCY = (1, 4, 16)
+
+
+def _element(text):
+    region = {"pageNumber": 1, "polygon": [1.0, 1.0, 2.0, 1.0, 2.0, 1.2, 1.0, 1.2]}
+    return {"content": text, "boundingRegions": [region], "spans": [{"offset": 0, "length": len(text)}]}
+
+
+def make_analyze_result(fields=20, table_rows=30, table_columns=6):
+    """Builds the JSON of an analyzed invoice with key-value pairs, a line-item table and document fields."""
+    cells = [
+        {"rowIndex": row, "columnIndex": column, **_element(f"r{row}c{column}")}
+        for row in range(table_rows)
+        for column in range(table_columns)
+    ]
+    return {
+        "pages": [{"pageNumber": 1, "angle": 0, "width": 8.5, "height": 11, "unit": "inch", "spans": []}],
+        "keyValuePairs": [
+            {"key": _element(f"Field {index}"), "value": _element(f"Value {index}"), "confidence": 0.9}
+            for index in range(fields)
+        ],
+        "tables": [{"rowCount": table_rows, "columnCount": table_columns, "cells": cells, **_element("")}],
+        "documents": [{
+            "docType": "invoice", "confidence": 0.9, **_element("invoice"),
+            "fields": {
+                f"Field{index}": {"type": "string", "valueString": f"Value {index}", "confidence": 0.9,
+                                  **_element(f"Value {index}")}
+                for index in range(fields)
+            },
+        }],
+    }
+
+
+def percentile(sorted_values, fraction):
+    """Returns the nearest-rank percentile of an already sorted list, or None when it is empty."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def summarize(scenario, concurrency, latencies, errors, wall_seconds, documents=None):
+    """Builds the result row of one scenario at one concurrency level; latencies are in seconds."""
+    latencies = sorted(latencies)
+    documents = len(latencies) if documents is None else documents
+
+    def milliseconds(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "documents": documents,
+        "errors": errors,
+        "error_rate": round(errors / documents, 4) if documents else 0.0,
+        "wall_seconds": round(wall_seconds, 4),
+        "docs_per_second": round((documents - errors) / wall_seconds, 3) if wall_seconds > 0 else None,
+        "mean_ms": milliseconds(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": milliseconds(percentile(latencies, 0.50)),
+        "p95_ms": milliseconds(percentile(latencies, 0.95)),
+        "p99_ms": milliseconds(percentile(latencies, 0.99)),
+    }
+
+
+def run_level(operation, documents, concurrency):
+    """Runs `operation(index)` for every document on `concurrency` threads; returns (latencies, errors, wall)."""
+    def timed(index):
+        started = time.perf_counter()
+        try:
+            operation(index)
+            failed = False
+        except Exception:
+            failed = True
+        return time.perf_counter() - started, failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(timed, range(documents)))
+    wall_seconds = time.perf_counter() - started
+    return [latency for latency, _ in outcomes], sum(failed for _, failed in outcomes), wall_seconds
+
+
+def build_operations(paths, analysis_result):
+    """Returns the single-document operation of each scenario except run_batch."""
+    storage = BlobSdkBackend()
+
+    def path(index):
+        return paths[index % len(paths)]
+
+    return {
+        "upload_blob_with_sdk": lambda index: upload_blob_with_sdk(path(index)),
+        "upload_blob_with_http": lambda index: upload_blob_with_http(path(index)),
+        "upload_file_with_http": lambda index: upload_file_with_http(path(index)),
+        "analyze_invoice_with_sdk": lambda index: analyze_invoice_with_sdk(
+            f"https://example.invalid/invoices/{os.path.basename(path(index))}"
+        ),
+        "extract_invoice_insights": lambda index: extract_invoice_insights(analysis_result),
+        "analyze_file": lambda index: analyze_file(path(index), use_cache=False, direct_max_bytes=0, storage=storage),
+    }
+
+
+def run_pipeline(paths, documents, concurrency, work_dir):
+    """Runs `documents` files through run_batch with `concurrency` workers in every stage."""
+    batch = [paths[index % len(paths)] for index in range(documents)]
+    output_path = os.path.join(work_dir, f"run_batch_{concurrency}.jsonl")
+    started = time.perf_counter()
+    counts = run_batch(batch, output_path, upload_workers=concurrency, sas_workers=concurrency,
+                       analysis_workers=concurrency, use_cache=False, direct_max_bytes=0, storage=BlobSdkBackend())
+    wall_seconds = time.perf_counter() - started
+    # The pipeline reports no per-document timings, only its throughput
+    return summarize("run_batch", concurrency, [], documents - counts.get("analyzed", 0), wall_seconds, documents)
+
+
+def run_suite(args):
+    """Starts the stand-ins, points the modules at them and runs every selected scenario."""
+    stub_options = dict(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, error_rate=args.error_rate,
+                        throttle_rate=args.throttle_rate, retry_after=args.retry_after, seed=args.seed)
+    results = []
+    with StubServer(BlobStubHandler, **stub_options) as blob_stub, \
+            StubServer(FileStubHandler, **stub_options) as file_stub, \
+            StubServer(DocumentIntelligenceStubHandler, **stub_options) as analysis_stub, \
+            tempfile.TemporaryDirectory() as work_dir:
+        analyze_result = make_analyze_result()
+        analysis_stub.httpd.analysis_polls = args.polls
+        analysis_stub.httpd.poll_interval = args.poll_interval_ms / 1000
+        analysis_stub.httpd.analyze_result = analyze_result
+        os.environ.update({
+            "AZURE_STORAGE_ACCOUNT_NAME": "benchaccount",
+            "AZURE_STORAGE_ACCOUNT_KEY": base64.b64encode(b"benchmark-key").decode(),
+            "AZURE_STORAGE_BLOB_ENDPOINT": f"{blob_stub.url}/benchaccount",
+            "AZURE_STORAGE_BLOB_CONTAINER_NAME": "invoices",
+            "AZURE_STORAGE_FILE_ENDPOINT": f"{file_stub.url}/benchaccount",
+            "AZURE_STORAGE_SHARE_NAME": "invoices",
+            "AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT": analysis_stub.url,
+            "AZURE_DOCUMENT_INTELLIGENCE_KEY": "benchmark-key",
+        })
+
+        paths = []
+        for index in range(min(args.documents, 100)):
+            file_path = os.path.join(work_dir, f"invoice_{index}.pdf")
+            with open(file_path, "wb") as file_data:
+                file_data.write(b"%PDF-1.7\n" + os.urandom(args.document_kb * 1024))
+            paths.append(file_path)
+        analysis_result = AnalyzeResult._from_generated(_GeneratedAnalyzeResult.deserialize(
+            {"apiVersion": "2023-07-31", "modelId": "prebuilt-document", "content": "", **analyze_result}
+        ))
+        operations = build_operations(paths, analysis_result)
+
+        for scenario in args.scenarios:
+            with open(os.devnull, "w") as devnull:
+                for concurrency in args.concurrency:
+                    with redirect_stdout(devnull):
+                        if scenario == "run_batch":
+                            result = run_pipeline(paths, args.documents, concurrency, work_dir)
+                        else:
+                            try:
+                                operations[scenario](0)  # Warm up clients, connections and containers
+                            except Exception:
+                                pass
+                            latencies, errors, wall_seconds = run_level(
+                                operations[scenario], args.documents, concurrency
+                            )
+                            result = summarize(scenario, concurrency, latencies, errors, wall_seconds)
+                    results.append(result)
+                    print_row(result)
+
+        served = {}
+        for stub in (blob_stub, file_stub, analysis_stub):
+            for status, count in stub.failures_served.items():
+                served[str(status)] = served.get(str(status), 0) + count
+    return results, served
+
+
+def compare_results(previous, current, threshold=10.0):
+    """
+    Matches the rows of two runs by scenario and concurrency. Returns a list of
+    (scenario, concurrency, p95 change %, throughput change %, regressed) tuples, where a row regressed
+    when its p95 latency grew or its throughput fell by more than `threshold` percent.
+    """
+    def change(before, after):
+        if before in (None, 0) or after is None:
+            return None
+        return (after - before) / before * 100
+
+    earlier = {(row["scenario"], row["concurrency"]): row for row in previous["results"]}
+    comparison = []
+    for row in current["results"]:
+        before = earlier.get((row["scenario"], row["concurrency"]))
+        if before is None:
+            continue
+        p95_change = change(before["p95_ms"], row["p95_ms"])
+        throughput_change = change(before["docs_per_second"], row["docs_per_second"])
+        regressed = (p95_change is not None and p95_change > threshold) or \
+                    (throughput_change is not None and throughput_change < -threshold)
+        comparison.append((row["scenario"], row["concurrency"], p95_change, throughput_change, regressed))
+    return comparison
+
+
+def _format(value, width, sign=""):
+    return "-".rjust(width) if value is None else format(value, f"{sign}{width}.1f")
+
+
+def print_row(result):
+    print(f"{result['scenario']:<26} {result['concurrency']:>4} {_format(result['p50_ms'], 10)} "
+          f"{_format(result['p95_ms'], 10)} {_format(result['p99_ms'], 10)} "
+          f"{_format(result['docs_per_second'], 10)} {result['error_rate']:>7.1%}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documents", type=int, default=50, help="Operations per scenario and concurrency level.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=list(DEFAULT_CONCURRENCY))
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--document-kb", type=int, default=256, help="Size of each synthetic document.")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Latency added to every stand-in request.")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Random extra latency of up to this much.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 500.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with 429.")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After seconds of the 429 responses.")
+    parser.add_argument("--polls", type=int, default=1, help="Status requests answered 'running' per analysis.")
+    parser.add_argument("--poll-interval-ms", type=float, default=50.0, help="Poll delay suggested by the stand-in.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the injected latency and failures.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against.")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent.")
+    args = parser.parse_args()
+
+    print(f"{'scenario':<26} {'conc':>4} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10} "
+          f"{'docs/s':>10} {'errors':>7}")
+    results, served = run_suite(args)
+    if served:
+        print(f"Injected failures served: {served}")
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "failures_served": served,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as previous_file:
+            previous = json.load(previous_file)
+        comparison = compare_results(previous, report, args.threshold)
+        print(f"\nCompared with {args.compare} (threshold {args.threshold:g}%)")
+        print(f"{'scenario':<26} {'conc':>4} {'p95 change':>11} {'docs/s change':>14}")
+        for scenario, concurrency, p95_change, throughput_change, regressed in comparison:
+            print(f"{scenario:<26} {concurrency:>4} {_format(p95_change, 10, '+')}% "
+                  f"{_format(throughput_change, 13, '+')}%{'  REGRESSION' if regressed else ''}")
+        if any(row[-1] for row in comparison):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
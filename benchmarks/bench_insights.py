@@ -0,0 +1,66 @@
+"""
+Compares the memory retained by the compact InvoiceInsights with the nested dictionaries of the
+same insights (`to_dict()`, the previous return value of `extract_invoice_insights`) for a
+synthetic many-page analysis result.
+
+Usage: python -m benchmarks.bench_insights [--pages N]
+"""
+from azure.ai.formrecognizer import AnalyzeResult
+from azure.ai.formrecognizer._generated.v2023_07_31.models import AnalyzeResult as _GeneratedAnalyzeResult
+from benchmarks.bench_end_to_end import make_analyze_result
+from modules.document_intelligence import extract_invoice_insights
+import argparse
+import gc
+import time
+import tracemalloc
+
+
+def make_result(pages):
+    """Builds an AnalyzeResult with one page's worth of fields and a line-item table per page."""
+    page = make_analyze_result(fields=40, table_rows=30, table_columns=6)
+    for index, pair in enumerate(page["keyValuePairs"]):
+        pair["key"]["content"] = f"Field {index}"
+    payload = {
+        "apiVersion": "2023-07-31", "modelId": "prebuilt-document", "content": "",
+        "pages": [{**page["pages"][0], "pageNumber": number} for number in range(1, pages + 1)],
+        "keyValuePairs": [
+            {**pair, "key": {**pair["key"], "content": f"Page {number} {pair['key']['content']}"}}
+            for number in range(1, pages + 1) for pair in page["keyValuePairs"]
+        ],
+        "tables": page["tables"] * pages,
+        "documents": page["documents"],
+    }
+    return AnalyzeResult._from_generated(_GeneratedAnalyzeResult.deserialize(payload))
+
+
+def retained(build):
+    """Returns (object, bytes still allocated after building it, seconds)."""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    value = build()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=300)
+    args = parser.parse_args()
+
+    analysis_result = make_result(args.pages)
+    insights, compact_size, compact_time = retained(lambda: extract_invoice_insights(analysis_result))
+    _, dict_size, dict_time = retained(insights.to_dict)
+
+    print(f"{args.pages} pages, {len(analysis_result.key_value_pairs)} key-value pairs, "
+          f"{len(analysis_result.tables)} tables")
+    print(f"  compact insights:    {compact_size / 2 ** 20:7.1f} MiB retained, built in {compact_time * 1000:8.1f} ms")
+    print(f"  nested dictionaries: {dict_size / 2 ** 20:7.1f} MiB retained, built in {dict_time * 1000:8.1f} ms "
+          f"({dict_size / compact_size:.1f}x the memory)")
+
+
+if __name__ == "__main__":
+    main()
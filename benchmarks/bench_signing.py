@@ -0,0 +1,66 @@
+"""
+Compares generating SAS URLs one SDK call at a time (decoding the key and reading the
+environment for every blob) with the batched, cached `generate_blob_urls`.
+
+Usage: python -m benchmarks.bench_signing [--blobs N]
+"""
+from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+from datetime import datetime, timedelta, timezone
+from modules.azure_blob import generate_blob_urls
+from modules.signing import reset_signing
+import argparse
+import base64
+import os
+import time
+
+
+def legacy_blob_url(blob_name):
+    """The per-call SAS generation used before the signing cache."""
+    account_name = os.environ["AZURE_STORAGE_ACCOUNT_NAME"]
+    account_key = os.environ["AZURE_STORAGE_ACCOUNT_KEY"]
+    container_name = os.environ["AZURE_STORAGE_BLOB_CONTAINER_NAME"]
+    sas_token = generate_blob_sas(
+        account_name=account_name,
+        container_name=container_name,
+        blob_name=blob_name,
+        account_key=account_key,
+        permission=BlobSasPermissions(read=True),
+        start=datetime.now(timezone.utc) - timedelta(hours=10),
+        expiry=datetime.now(timezone.utc) + timedelta(hours=10),
+        resource="b"
+    )
+    return f"https://{account_name}.blob.core.windows.net/{container_name}/{blob_name}?{sas_token}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--blobs", type=int, default=10000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AZURE_STORAGE_ACCOUNT_NAME", "benchaccount")
+    os.environ.setdefault("AZURE_STORAGE_ACCOUNT_KEY", base64.b64encode(b"benchmark-key").decode())
+    os.environ.setdefault("AZURE_STORAGE_BLOB_CONTAINER_NAME", "invoices")
+    names = [f"invoice_{index}.pdf" for index in range(args.blobs)]
+
+    started = time.perf_counter()
+    for name in names:
+        legacy_blob_url(name)
+    legacy = time.perf_counter() - started
+
+    reset_signing()
+    started = time.perf_counter()
+    generate_blob_urls(names)
+    batched = time.perf_counter() - started
+
+    started = time.perf_counter()
+    generate_blob_urls(names)
+    cached = time.perf_counter() - started
+
+    print(f"{args.blobs} blobs")
+    print(f"  one SDK call per blob: {legacy * 1000:9.1f} ms")
+    print(f"  batched, first call:   {batched * 1000:9.1f} ms ({legacy / batched:.1f}x)")
+    print(f"  batched, cached:       {cached * 1000:9.1f} ms ({legacy / cached:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Measures the cold-start time of each entry point from `python -X importtime`.
+
+Every entry point is imported `--runs` times, each time in a fresh interpreter, and the median,
+minimum and maximum total import time are reported, along with the packages that took longest to
+import in the median run. Results can be written as JSON with `--output` and compared with an
+earlier run with `--compare`, which exits with status 1 when the median import time of an entry
+point grew by more than `--threshold` percent.
+
+Usage: python -m benchmarks.bench_startup [--runs N] [--entry-points main web.app] [--top 8]
+           [--output startup.json] [--compare previous.json]
+"""
+from datetime import datetime, timezone
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+
+ENTRY_POINTS = ("main", "web.app", "modules.pipeline")
+DEFAULT_RUNS = 7
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def parse_importtime(output):
+    """
+    Parses the `-X importtime` report into (module, self microseconds, cumulative microseconds, depth)
+    rows, in the order the imports finished.
+    """
+    rows = []
+    for line in output.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return rows
+
+
+def slowest_packages(rows, top):
+    """Adds up the self time of every module by top-level package; returns the `top` slowest as (package, ms)."""
+    totals = {}
+    for module, self_us, _, _ in rows:
+        package = module.split(".")[0]
+        totals[package] = totals.get(package, 0) + self_us
+    return [(package, us / 1000) for package, us in sorted(totals.items(), key=lambda item: -item[1])[:top]]
+
+
+def measure(entry_point, python=sys.executable):
+    """Imports `entry_point` in a fresh interpreter; returns its total import time in ms and the report rows."""
+    completed = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {entry_point}"],
+        cwd=REPOSITORY_ROOT, capture_output=True, text=True, check=True,
+    )
+    rows = parse_importtime(completed.stderr)
+    total_us = next(cumulative for module, _, cumulative, depth in reversed(rows) if module == entry_point and depth == 0)
+    return total_us / 1000, rows
+
+
+def run_suite(entry_points, runs, top):
+    results = []
+    for entry_point in entry_points:
+        measurements = sorted((measure(entry_point) for _ in range(runs)), key=lambda measurement: measurement[0])
+        totals = [total for total, _ in measurements]
+        median_rows = measurements[len(measurements) // 2][1]
+        results.append({
+            "entry_point": entry_point,
+            "runs": runs,
+            "median_ms": statistics.median(totals),
+            "min_ms": totals[0],
+            "max_ms": totals[-1],
+            "modules": len(median_rows),
+            "slowest_packages": slowest_packages(median_rows, top),
+        })
+    return results
+
+
+def compare_results(previous, current, threshold=10.0):
+    """
+    Matches the entry points of two runs. Returns a list of (entry point, median change %, regressed)
+    tuples, where an entry point regressed when its median import time grew by more than `threshold` percent.
+    """
+    earlier = {row["entry_point"]: row for row in previous["results"]}
+    comparison = []
+    for row in current["results"]:
+        before = earlier.get(row["entry_point"])
+        if before is None or not before["median_ms"]:
+            continue
+        change = (row["median_ms"] - before["median_ms"]) / before["median_ms"] * 100
+        comparison.append((row["entry_point"], change, change > threshold))
+    return comparison
+
+
+def print_result(result):
+    print(f"{result['entry_point']:<20} {result['median_ms']:>10.1f} {result['min_ms']:>10.1f} "
+          f"{result['max_ms']:>10.1f} {result['modules']:>8}")
+    print("    slowest: " + ", ".join(f"{package} {ms:.1f} ms" for package, ms in result["slowest_packages"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="Fresh interpreters per entry point.")
+    parser.add_argument("--entry-points", nargs="+", default=list(ENTRY_POINTS), help="Modules to import.")
+    parser.add_argument("--top", type=int, default=8, help="Slowest packages listed per entry point.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against.")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent.")
+    args = parser.parse_args()
+
+    print(f"{'entry point':<20} {'median ms':>10} {'min ms':>10} {'max ms':>10} {'modules':>8}")
+    results = run_suite(args.entry_points, args.runs, args.top)
+    for result in results:
+        print_result(result)
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "settings": {"runs": args.runs},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as previous_file:
+            previous = json.load(previous_file)
+        comparison = compare_results(previous, report, args.threshold)
+        print(f"\nCompared with {args.compare} (threshold {args.threshold:g}%)")
+        for entry_point, change, regressed in comparison:
+            print(f"{entry_point:<20} {change:>+9.1f}%{'  REGRESSION' if regressed else ''}")
+        if any(row[-1] for row in comparison):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
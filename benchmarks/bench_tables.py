@@ -0,0 +1,51 @@
+"""
+Compares the previous row-by-row table reconstruction (one scan of every cell per row)
+with the single-pass `build_table_grid` on synthetic tables of increasing size.
+
+Usage: python -m benchmarks.bench_tables [--columns N]
+"""
+from modules.document_intelligence import build_table_grid
+from types import SimpleNamespace
+import argparse
+import timeit
+
+
+def make_table(row_count, column_count):
+    cells = [
+        SimpleNamespace(row_index=row, column_index=column, row_span=1, column_span=1, content=f"r{row}c{column}")
+        for row in range(row_count)
+        for column in range(column_count)
+    ]
+    return SimpleNamespace(row_count=row_count, column_count=column_count, cells=cells)
+
+
+def legacy_table_data(table):
+    """The reconstruction used before `build_table_grid`: O(rows x cells)."""
+    table_data = []
+    num_columns = max(cell.column_index for cell in table.cells) + 1
+    for row_index in range(table.row_count):
+        row_data = [""] * num_columns
+        for cell in table.cells:
+            if cell.row_index == row_index:
+                row_data[cell.column_index] = cell.content
+        table_data.append(row_data)
+    return table_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--columns", type=int, default=6)
+    args = parser.parse_args()
+
+    print(f"{'rows':>6} {'legacy (ms)':>12} {'single pass (ms)':>17} {'speed-up':>9}")
+    for row_count in (50, 200, 500, 1000, 2000):
+        table = make_table(row_count, args.columns)
+        assert legacy_table_data(table) == build_table_grid(table)
+        repeats = max(1, 2000 // row_count)
+        legacy = min(timeit.repeat(lambda: legacy_table_data(table), number=1, repeat=repeats)) * 1000
+        single = min(timeit.repeat(lambda: build_table_grid(table), number=1, repeat=repeats)) * 1000
+        print(f"{row_count:>6} {legacy:>12.2f} {single:>17.2f} {legacy / single:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
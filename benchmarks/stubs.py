@@ -0,0 +1,349 @@
+"""
+Local stand-ins for the Azure REST endpoints used by the modules, for benchmarks and tests.
+Nothing is authenticated or persisted; the servers only speak enough of each protocol
+for the SDK clients and the HTTP helpers to complete their calls. Every stand-in can add
+latency and answer a share of the requests with 500 errors or 429 throttling responses.
+"""
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def parse_request(self):
+        # Injected failures are answered before the real handler sees the request
+        if not super().parse_request():
+            return False
+        self.server.requests.append((self.command, self.path))
+        self.server.delay()
+        failure = self.server.take_failure(self.path) or self.server.random_failure()
+        if failure is not None:
+            status, headers = failure
+            self.server.count_failure(status)
+            self._read_body()
+            self._send(status, headers={"x-ms-error-code": "InjectedFailure", **headers})
+            return False
+        return True
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        self.send_header("x-ms-request-id", str(uuid.uuid4()))
+        self.send_header("x-ms-version", self.headers.get("x-ms-version", "2021-08-06"))
+        self.send_header("Date", formatdate(usegmt=True))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+
+class BlobStubHandler(_StubHandler):
+    """Serves container creation and Put/Get/Head/Delete Blob requests from an in-memory store."""
+
+    def _split(self):
+        parsed = urlparse(self.path)
+        return parsed.path.strip("/").split("/"), parse_qs(parsed.query)
+
+    def _blob_key(self, segments):
+        # Requests arrive either host-style (/container/blob) or emulator-style (/account/container/blob)
+        if len(segments) >= 3:
+            segments = segments[1:]
+        return "/".join(segments)
+
+    def do_PUT(self):
+        segments, query = self._split()
+        body = self._read_body()
+        if query.get("restype") in (["container"], ["share"]):
+            self._send(201, headers={"ETag": '"0x1"', "Last-Modified": formatdate(usegmt=True)})
+            return
+        key = self._blob_key(segments)
+        if query.get("comp") == ["block"]:
+            self.server.staged_blocks.setdefault(key, {})[query["blockid"][0]] = body
+            self._send(201)
+            return
+        if query.get("comp") == ["blocklist"]:
+            staged = self.server.staged_blocks.pop(key, {})
+            block_ids = re.findall(r"<(?:Latest|Uncommitted|Committed)>([^<]+)</", body.decode("utf-8"))
+            if any(block_id not in staged for block_id in block_ids):
+                self._send(400, headers={"x-ms-error-code": "InvalidBlockList"})
+                return
+            body = b"".join(staged[block_id] for block_id in block_ids)
+            content_md5 = self.headers.get("x-ms-blob-content-md5")
+        else:
+            # Like the real service, Put Blob records an MD5 of the body when none is given
+            content_md5 = self.headers.get("x-ms-blob-content-md5") or base64.b64encode(hashlib.md5(body).digest()).decode()
+        self.server.blobs[key] = body
+        self.server.content_md5[key] = content_md5
+        self._send(201, headers={"ETag": f'"0x{uuid.uuid4().hex[:16]}"', "Last-Modified": formatdate(usegmt=True)})
+
+    def _properties(self, key):
+        headers = {"Content-Type": "application/octet-stream", "x-ms-blob-type": "BlockBlob"}
+        if self.server.content_md5.get(key):
+            headers["Content-MD5"] = self.server.content_md5[key]
+        return headers
+
+    def do_GET(self):
+        segments, _ = self._split()
+        key = self._blob_key(segments)
+        data = self.server.blobs.get(key)
+        if data is None:
+            self._send(404, headers={"x-ms-error-code": "BlobNotFound"})
+            return
+        self._send(200, data, headers=self._properties(key))
+
+    do_HEAD = do_GET
+
+    def do_DELETE(self):
+        segments, _ = self._split()
+        key = self._blob_key(segments)
+        if self.server.blobs.pop(key, None) is None:
+            self._send(404, headers={"x-ms-error-code": "BlobNotFound"})
+            return
+        self.server.content_md5.pop(key, None)
+        self._send(202)
+
+
+class FileStubHandler(BlobStubHandler):
+    """Serves share creation, Create File and Put Range requests from an in-memory store."""
+
+    def do_PUT(self):
+        segments, query = self._split()
+        body = self._read_body()
+        if query.get("restype") == ["share"]:
+            self._send(201, headers={"ETag": '"0x1"', "Last-Modified": formatdate(usegmt=True)})
+            return
+        key = self._blob_key(segments)
+        if query.get("comp") == ["range"]:
+            data = self.server.files.get(key)
+            start, end = (int(bound) for bound in self.headers["x-ms-range"].split("=")[1].split("-"))
+            if data is None or end >= len(data) or end - start + 1 != len(body):
+                self._send(416, headers={"x-ms-error-code": "InvalidRange"})
+                return
+            data[start:end + 1] = body
+            self.server.range_writes.append((key, start, end))
+            self._send(201, headers={"ETag": f'"0x{uuid.uuid4().hex[:16]}"', "Last-Modified": formatdate(usegmt=True)})
+            return
+        self.server.files[key] = bytearray(int(self.headers.get("x-ms-content-length", 0)))
+        self.server.content_md5[key] = self.headers.get("x-ms-content-md5")
+        self._send(201, headers={"ETag": f'"0x{uuid.uuid4().hex[:16]}"', "Last-Modified": formatdate(usegmt=True)})
+
+    def do_GET(self):
+        segments, _ = self._split()
+        key = self._blob_key(segments)
+        data = self.server.files.get(key)
+        if data is None:
+            self._send(404, headers={"x-ms-error-code": "ResourceNotFound"})
+            return
+        headers = {"Content-Type": "application/octet-stream"}
+        if self.server.content_md5.get(key):
+            headers["Content-MD5"] = self.server.content_md5[key]
+        self._send(200, bytes(data), headers=headers)
+
+    do_HEAD = do_GET
+
+    def do_DELETE(self):
+        segments, _ = self._split()
+        key = self._blob_key(segments)
+        if self.server.files.pop(key, None) is None:
+            self._send(404, headers={"x-ms-error-code": "ResourceNotFound"})
+            return
+        self.server.content_md5.pop(key, None)
+        self._send(202)
+
+
+class DocumentIntelligenceStubHandler(_StubHandler):
+    """
+    Serves Analyze Document requests as long-running operations.
+    Each operation answers `server.analysis_polls` status requests with "running" (suggesting
+    `server.poll_interval` seconds between polls, when set) before it succeeds. The result is
+    `server.analyze_result` with its content set to the submitted URL or document bytes.
+    """
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        match = re.fullmatch(r"/formrecognizer/documentModels/([^/:]+):analyze", parsed.path)
+        body = self._read_body()
+        if match is None:
+            self._send(404)
+            return
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            content = json.loads(body)["urlSource"]
+        else:
+            content = body.decode("latin-1")
+        operation_id = uuid.uuid4().hex
+        with self.server.operations_lock:
+            self.server.operations[operation_id] = {
+                "model_id": match.group(1), "content": content, "polls_left": self.server.analysis_polls,
+            }
+            self.server.running += 1
+            self.server.peak_running = max(self.server.peak_running, self.server.running)
+        host, port = self.server.server_address
+        location = (f"http://{host}:{port}/formrecognizer/documentModels/{match.group(1)}"
+                    f"/analyzeResults/{operation_id}?{parsed.query}")
+        self._send(202, headers={"Operation-Location": location})
+
+    def do_GET(self):
+        operation_id = urlparse(self.path).path.rsplit("/", 1)[-1]
+        with self.server.operations_lock:
+            operation = self.server.operations.get(operation_id)
+            if operation is not None and operation["polls_left"] > 0:
+                operation["polls_left"] -= 1
+                status = "running"
+            elif operation is not None:
+                if operation["polls_left"] == 0:
+                    operation["polls_left"] = -1
+                    self.server.running -= 1
+                status = "succeeded"
+        if operation is None:
+            self._send(404)
+            return
+        result = {"status": status}
+        headers = {"Content-Type": "application/json"}
+        if status == "succeeded":
+            result["analyzeResult"] = {
+                "pages": [{"pageNumber": 1, "spans": []}],
+                **self.server.analyze_result,
+                "apiVersion": "2023-07-31", "modelId": operation["model_id"], "content": operation["content"],
+            }
+        elif self.server.poll_interval is not None:
+            headers["retry-after-ms"] = str(int(self.server.poll_interval * 1000))
+        self._send(200, json.dumps(result).encode("utf-8"), headers=headers)
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler_class, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1.0,
+                 seed=None):
+        super().__init__(("127.0.0.1", 0), handler_class)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.blobs = {}
+        self.staged_blocks = {}
+        self.files = {}
+        self.content_md5 = {}
+        self.range_writes = []
+        self.operations = {}
+        self.operations_lock = threading.Lock()
+        self.analysis_polls = 1
+        self.poll_interval = None
+        self.analyze_result = {}
+        self.running = 0
+        self.peak_running = 0
+        self.requests = []
+        self.failures_served = {}
+        self._failures = []
+        self._failures_lock = threading.Lock()
+
+    def take_failure(self, path):
+        """Returns the status and headers of a pending injected failure matching `path`, consuming it."""
+        with self._failures_lock:
+            for failure in self._failures:
+                if failure[0] in path and failure[1] > 0:
+                    failure[1] -= 1
+                    return failure[2], failure[3]
+        return None
+
+    def count_failure(self, status):
+        with self._failures_lock:
+            self.failures_served[status] = self.failures_served.get(status, 0) + 1
+
+    def delay(self):
+        """Sleeps for the configured latency plus a random share of the jitter."""
+        if self.latency or self.jitter:
+            with self._random_lock:
+                extra = self._random.uniform(0, self.jitter) if self.jitter else 0.0
+            time.sleep(self.latency + extra)
+
+    def random_failure(self):
+        """Draws a random 429 (with Retry-After) or 500 failure at the configured rates, or None."""
+        if not self.error_rate and not self.throttle_rate:
+            return None
+        with self._random_lock:
+            draw = self._random.random()
+        if draw < self.throttle_rate:
+            return 429, {"Retry-After": f"{self.retry_after:g}"}
+        if draw < self.throttle_rate + self.error_rate:
+            return 500, {}
+        return None
+
+
+class StubServer:
+    """
+    Runs a stub handler on a free localhost port in a background thread.
+    Every request is delayed by `latency` seconds plus up to `jitter` more; a share `throttle_rate`
+    of the requests is answered with 429 and `Retry-After: retry_after`, and a share `error_rate`
+    with 500. `seed` makes the random draws repeatable.
+    """
+
+    def __init__(self, handler_class=BlobStubHandler, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0,
+                 retry_after=1.0, seed=None):
+        self.httpd = _StubHTTPServer(handler_class, latency, jitter, error_rate, throttle_rate, retry_after, seed)
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def fail(self, match, times=1, status=500, headers=None):
+        """Makes the next `times` requests whose path contains `match` fail with `status` (and `headers`)."""
+        with self.httpd._failures_lock:
+            self.httpd._failures.append([match, times, status, headers or {}])
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def blobs(self):
+        return self.httpd.blobs
+
+    @property
+    def files(self):
+        return self.httpd.files
+
+    @property
+    def range_writes(self):
+        return self.httpd.range_writes
+
+    @property
+    def failures_served(self):
+        """How many injected failures were answered, by status code."""
+        return self.httpd.failures_served
+
+    @property
+    def peak_running(self):
+        """The largest number of analysis operations that were running at once."""
+        return self.httpd.peak_running
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
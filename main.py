@@ -1,8 +1,29 @@
-from modules.azure_blob import upload_blob_with_sdk, generate_blob_url
-from modules.document_intelligence import analyze_invoice_with_sdk, extract_invoice_insights
-from tabulate import tabulate
+from modules.analysis_scheduler import get_analysis_scheduler
+from modules.document_intelligence import DEFAULT_MODEL_ID
+from modules.export import InsightsExporter, document_name, get_exporter
+from modules.figures import crop_figures
+from modules.insights import iter_insight_events
+from modules.manifest import DEFAULT_MANIFEST_PATH, BatchManifest
+from modules.metrics import enable_metrics, metrics_enabled, summary_rows
+from modules.pipeline import (
+    DEFAULT_ANALYSIS_WORKERS, DEFAULT_QUEUE_SIZE, DEFAULT_SAS_WORKERS, DEFAULT_UPLOAD_WORKERS, collect_files,
+    process_file, run_batch
+)
+from modules.storage import STORAGE_BACKENDS, get_storage_backend
+from modules.utils import LazyImport
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import hashlib
+import importlib.util
 import os
 
+# Only loaded when something is printed as a table
+tabulate = LazyImport("tabulate", "tabulate")
+
+DEFAULT_RENDER_WORKERS = min(4, os.cpu_count() or 1)
+# Fewer renders than this are done in this process, where they cost less than starting a pool
+RENDER_POOL_MIN_ITEMS = 16
+
 
 def print_section(title, data):
     """
@@ -29,41 +50,116 @@ def print_section(title, data):
         print(data)
 
 
-def save_barcode(barcode_data, output_dir="barcodes"):
+def content_addressed_path(output_dir, prefix, value):
+    """
+    Names an output file after a hash of the value it renders, so identical values share one file.
+    """
+    digest = hashlib.sha256(str(value).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(output_dir, f"{prefix}_{digest}.png")
+
+
+def _write_atomically(path, write):
+    # A file that exists is always complete, so it can be trusted as already rendered
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as output:
+        write(output)
+    os.replace(temporary_path, path)
+
+
+def _render_barcode(value, path):
+    """Renders a Code128 barcode PNG (runs in the render pool, importing python-barcode there)."""
+    from barcode import Code128
+    from barcode.writer import ImageWriter
+
+    _write_atomically(path, Code128(value, writer=ImageWriter()).write)
+    return path
+
+
+def _render_image_placeholder(caption, path):
+    # Placeholder: Save bounding box or dummy data as image
+    # In a real application, you'd extract actual image content
+    _write_atomically(path, lambda output: output.write(f"Placeholder for image: {caption}".encode("utf-8")))
+    return path
+
+
+def render_outputs(render, jobs, workers=DEFAULT_RENDER_WORKERS):
     """
-    Save barcode as an image if available.
+    Calls `render(value, path)` for every (value, path) job whose file does not exist yet, once per path,
+    in a process pool when there are enough of them. Returns the paths that were rendered.
     """
-    try:
-        from barcode import Code128
-        from barcode.writer import ImageWriter
+    pending = {path: value for value, path in jobs if not os.path.exists(path)}
+    if not pending:
+        return []
+    if workers <= 1 or len(pending) < RENDER_POOL_MIN_ITEMS:
+        return [render(value, path) for path, value in pending.items()]
+    with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+        return list(pool.map(render, pending.values(), pending.keys(), chunksize=8))
+
 
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
+def save_barcode(barcode_data, output_dir="barcodes", workers=DEFAULT_RENDER_WORKERS):
+    """
+    Save barcode as an image if available. Each value is rendered once, to a file named after it,
+    and values rendered by an earlier run are not rendered again.
+    """
+    if not barcode_data:
+        return
+    os.makedirs(output_dir, exist_ok=True)
+    values = [str(barcode.get("value", "unknown")) for barcode in barcode_data]
+    jobs = [(value, content_addressed_path(output_dir, "barcode", value)) for value in values]
+    rendered = set()
+    if any(not os.path.exists(path) for _, path in jobs):
+        if importlib.util.find_spec("barcode") is None:
+            print("Error: Barcode generation requires 'python-barcode'. Install it using 'pip install python-barcode[images]'.")
+            return
+        rendered.update(render_outputs(_render_barcode, jobs, workers))
 
-        for idx, barcode in enumerate(barcode_data):
-            barcode_value = barcode.get("value", "unknown")
-            barcode_image = Code128(barcode_value, writer=ImageWriter())
-            filename = os.path.join(output_dir, f"barcode_{idx + 1}.png")
-            barcode_image.save(filename)
-            print(f"Barcode saved: {filename}")
-    except ImportError:
-        print("Error: Barcode generation requires 'python-barcode'. Install it using 'pip install python-barcode[images]'.")
+    for _, filename in jobs:
+        print(f"Barcode saved: {filename}" if filename in rendered else f"Barcode already rendered: {filename}")
 
 
-def save_images(image_data, output_dir="images"):
+def save_images(image_data, output_dir="images", workers=DEFAULT_RENDER_WORKERS, document_path=None,
+                document_id=None):
     """
-    Save extracted images to disk.
+    Save extracted images to disk, once per distinct image, skipping images rendered by an earlier run.
+    Given the PDF they come from, figures are cropped from their pages (requires 'pymupdf' and 'numpy');
+    otherwise a placeholder is written for each. `document_id` (e.g. the file hash) tells apart
+    figures of different documents in the same place.
     """
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    if not image_data:
+        return
+    os.makedirs(output_dir, exist_ok=True)
+    figures = []
+    for image in image_data:
+        # Fresh and cached insights hold the same box as points or as lists; hash plain coordinates
+        box = [[float(coordinate) for coordinate in point] for point in image.get("bounding_box") or []]
+        key = (document_id or document_path, image.get("page"), image.get("caption"), box)
+        figures.append((image, box, content_addressed_path(output_dir, "image", key)))
+
+    rendered = set()
+    pending = {path: (image, box) for image, box, path in figures if not os.path.exists(path)}
+    if pending and document_path and document_path.lower().endswith(".pdf"):
+        try:
+            crops = crop_figures(document_path, [(image.get("page"), box) for image, box in pending.values()])
+        except ImportError as e:
+            print(f"Error: {e} Saving placeholders instead.")
+        else:
+            for path, content in zip(pending, crops):
+                if content is not None:
+                    _write_atomically(path, lambda output: output.write(content))
+                    rendered.add(path)
 
-    for idx, image in enumerate(image_data):
-        filename = os.path.join(output_dir, f"image_{idx + 1}.png")
-        # Placeholder: Save bounding box or dummy data as image
-        # In a real application, you'd extract actual image content
-        with open(filename, "w") as f:
-            f.write(f"Placeholder for image {idx + 1}")
-        print(f"Image saved: {filename}")
+    # Figures that could not be cropped get a placeholder, named apart from real crops
+    placeholders = {
+        path: content_addressed_path(output_dir, "image_placeholder", path) for path in pending if path not in rendered
+    }
+    rendered.update(render_outputs(
+        _render_image_placeholder,
+        [(pending[path][0].get("caption"), placeholder) for path, placeholder in placeholders.items()],
+        workers,
+    ))
+    for _, _, path in figures:
+        filename = placeholders.get(path, path)
+        print(f"Image saved: {filename}" if filename in rendered else f"Image already rendered: {filename}")
 
 
 def print_tables(tables):
@@ -85,46 +181,205 @@ def print_tables(tables):
             print("Unexpected table format.")
 
 
+def print_event(event):
+    """
+    Prints one insight event from `iter_insight_events` on a line of its own, prefixed with its page.
+    """
+    page = f"[page {event['page']}]" if event["page"] is not None else "[no page]"
+    kind = event["event"]
+    if kind == "standard_field":
+        print(f"{page} {event['key']}: {event['value']} (Confidence: {event['confidence']})")
+    elif kind == "custom_field":
+        print(f"{page} {event['name']}: {event['value']} (Confidence: {event['confidence']})")
+    elif kind == "table":
+        print(f"{page} Table {event['table'] + 1} ({event['row_count']} rows x {event['column_count']} columns)")
+    elif kind == "table_row":
+        print(f"{page}   | " + " | ".join(event["cells"]) + " |")
+    elif kind == "image":
+        print(f"{page} Image: {event['caption']}")
+    elif kind == "barcode":
+        print(f"{page} Barcode ({event['type']}): {event['value']}")
+
+
+def print_metrics_summary():
+    """
+    Prints the time spent per stage and the transfer, retry and cache counters recorded during the run.
+    """
+    stage_rows, counter_rows = summary_rows()
+    print(f"\n{'=' * 140}\nMetrics Summary\n{'=' * 140}")
+    if stage_rows:
+        print(tabulate(stage_rows, headers=["Stage", "Count", "Total (s)", "Mean (ms)", "Max (ms)"], tablefmt="grid"))
+    if counter_rows:
+        print(tabulate(counter_rows, headers=["Counter", "Value"], tablefmt="grid"))
+    if not stage_rows and not counter_rows:
+        print("Nothing was recorded.")
+
+
+def open_exporter(args):
+    """
+    Returns the exporter writing to `--export` (or EXPORT_DIR), or None when results are not exported.
+    """
+    if args.export:
+        return InsightsExporter(args.export, columnar=args.columnar)
+    return get_exporter()
+
+
+def parse_args():
+    """
+    Parses the command line: a single file by default, or `--batch` with directories and glob patterns.
+    """
+    parser = argparse.ArgumentParser(description="Analyze documents with Azure Document Intelligence.")
+    parser.add_argument("file_path", nargs="?", default="./resources/Invoice2.pdf",
+                        help="Document to analyze in single-file mode")
+    parser.add_argument("--batch", nargs="+", metavar="PATH",
+                        help="Directories or glob patterns to process concurrently")
+    parser.add_argument("--output", default="results.jsonl", help="JSON Lines file the batch results are appended to")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH,
+                        help="Progress manifest of batch runs: documents unchanged since they were last analyzed "
+                             "are skipped, so an interrupted run resumes where it stopped")
+    parser.add_argument("--no-manifest", action="store_true",
+                        help="Process every document, without reading or updating the manifest")
+    parser.add_argument("--upload-workers", type=int, default=DEFAULT_UPLOAD_WORKERS)
+    parser.add_argument("--sas-workers", type=int, default=DEFAULT_SAS_WORKERS)
+    parser.add_argument("--analysis-workers", type=int, default=DEFAULT_ANALYSIS_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="Maximum number of documents waiting between two stages")
+    parser.add_argument("--direct-max-bytes", type=int, default=None,
+                        help="Send documents up to this size directly for analysis instead of staging them in "
+                             "Blob Storage (default: DIRECT_ANALYSIS_MAX_BYTES or 4 MiB; 0 always stages)")
+    parser.add_argument("--scheduler", action="store_true",
+                        help="Rate-limit analyses and poll them on a shared timer (see ANALYSIS_SUBMIT_RATE and "
+                             "ANALYSIS_MAX_IN_FLIGHT); raise --analysis-workers to keep more of them in flight")
+    parser.add_argument("--storage", choices=STORAGE_BACKENDS, default=None,
+                        help="Where documents are staged before analysis (default: STORAGE_BACKEND or blob)")
+    parser.add_argument("--shard-pages", type=int, default=None,
+                        help="Analyze PDFs longer than this many pages as concurrent page ranges "
+                             "(default: ANALYSIS_SHARD_PAGES or 0, never)")
+    parser.add_argument("--shard-workers", type=int, default=None,
+                        help="Page ranges of one document analyzed at once (default: ANALYSIS_SHARD_WORKERS or 4)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Print the insights page by page as they are extracted (single-file mode; cached "
+                             "analyses are printed by section)")
+    parser.add_argument("--export", metavar="DIR", default=None,
+                        help="Append the insights to DIR as JSON Lines, plus one CSV per table (default: EXPORT_DIR)")
+    parser.add_argument("--columnar", action="store_true",
+                        help="Also export the fields as Parquet files under DIR/fields (requires pyarrow)")
+    parser.add_argument("--render-workers", type=int, default=DEFAULT_RENDER_WORKERS,
+                        help="Processes rendering barcode and image files (1 renders them in this process)")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Time each stage and count bytes, retries and cache hits, printing a summary at the "
+                             "end (also enabled by METRICS_ENABLED=1)")
+    return parser.parse_args()
+
+
+def run_batch_mode(args):
+    """
+    Runs the concurrent upload/SAS/analysis pipeline over every file matched by `--batch`.
+    """
+    file_paths = collect_files(args.batch)
+    if not file_paths:
+        print(f"Error: No files found - {' '.join(args.batch)}")
+        exit(1)
+
+    print(f"\nProcessing {len(file_paths)} documents...")
+    manifest = None if args.no_manifest else BatchManifest(args.manifest)
+    exporter = open_exporter(args)
+    counts = run_batch(
+        file_paths,
+        args.output,
+        upload_workers=args.upload_workers,
+        sas_workers=args.sas_workers,
+        analysis_workers=args.analysis_workers,
+        queue_size=args.queue_size,
+        direct_max_bytes=args.direct_max_bytes,
+        scheduler=get_analysis_scheduler() if args.scheduler else None,
+        storage=get_storage_backend(args.storage),
+        exporter=exporter,
+        pages_per_shard=args.shard_pages,
+        shard_workers=args.shard_workers,
+        manifest=manifest,
+    )
+    summary = {**counts, "Results": args.output}
+    if manifest is not None:
+        manifest.close()
+        summary["Manifest"] = args.manifest
+    if exporter is not None:
+        exporter.close()
+        summary["Export"] = exporter.output_dir
+    print_section("Batch Summary", summary)
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.metrics:
+        enable_metrics()
+    if args.batch:
+        run_batch_mode(args)
+        if metrics_enabled():
+            print_metrics_summary()
+        exit(0)
+
     # Example file
-    file_path = "./resources/Invoice2.pdf"
+    file_path = args.file_path
 
     # Ensure the file exists
     if not os.path.exists(file_path):
         print(f"Error: File not found - {file_path}")
         exit(1)
 
-    # Upload the file to Azure Blob Storage using SDK
-    print("\nUploading blob with SDK...")
-    upload_blob_with_sdk(file_path)
-    blob_url = generate_blob_url(file_path)
-    print(f"Blob uploaded successfully. URL: {blob_url}")
-
-    # Analyze the document with Azure SDK
+    # Reuses a cached analysis of the same content; otherwise small documents are sent directly and
+    # larger ones staged in the configured storage backend (Azure Blob Storage by default) first
     print("\nAnalyzing document with Azure SDK...")
-    analysis_result = analyze_invoice_with_sdk(blob_url)
-    insights = extract_invoice_insights(analysis_result)
+    storage = get_storage_backend(args.storage)
+    result = process_file(file_path, direct_max_bytes=args.direct_max_bytes, storage=storage,
+                          pages_per_shard=args.shard_pages, workers=args.shard_workers)
+    file_hash = result["file_hash"]
+    insights = result["insights"]
+    analysis_result = result.get("analysis_result")
+    file_name = os.path.basename(file_path)
+
+    if result["status"] == "cached":
+        print("Cached analysis found, skipping upload and analysis.")
+        blob_url = "Not uploaded (cached analysis reused)"
+    elif result.get("direct"):
+        blob_url = "Not uploaded (sent directly for analysis)"
+    else:
+        blob_url = storage.url(result["blob_name"])
+        print(f"Document uploaded to {type(storage).__name__}. URL: {blob_url}")
+
+    # Keep the results for loading elsewhere, without analyzing again
+    exporter = open_exporter(args)
+    if exporter is not None:
+        exporter.write(document_name(file_path, file_hash), insights, file=file_path, model_id=DEFAULT_MODEL_ID)
+        exporter.close()
+        print(f"\nInsights exported to {exporter.output_dir}")
 
     # Print organized results
     print_section("File Information", {
-        "File Name": os.path.basename(file_path),
+        "File Name": file_name,
         "File URL": blob_url,
         "Document Type": "Invoice"
     })
 
-    print_section("Standard Fields", insights.get("standard_fields", {}))
+    if args.stream and analysis_result is not None:
+        # Print every insight as soon as it is extracted, page by page
+        print_section("Insights by Page", [])
+        for event in iter_insight_events(analysis_result):
+            print_event(event)
+    else:
+        print_section("Standard Fields", insights.get("standard_fields", {}))
 
-    # Handle and print tables
-    tables = insights.get("tables", [])
-    print_tables(tables)
+        # Handle and print tables
+        tables = insights.get("tables", [])
+        print_tables(tables)
 
     # Handle and save images
     images = insights.get("images", [])
-    save_images(images)
+    save_images(images, workers=args.render_workers, document_path=file_path, document_id=file_hash)
 
     # Handle and save barcodes
     barcodes = insights.get("barcodes", [])
-    save_barcode(barcodes)
+    save_barcode(barcodes, workers=args.render_workers)
     print_section("Barcodes", [f"Saved barcode {idx + 1}" for idx in range(len(barcodes))])
 
     print("\nThe features below are only available when using apiVersion=2024-07-31.\nThis version is currently in preview and only accessible via Azure AI Document Intelligence Studio.")
@@ -132,6 +387,9 @@ if __name__ == "__main__":
     print_section("Custom Query Fields", insights.get("query_fields", {}))
     print_section("Images", [f"Saved image {idx + 1}" for idx in range(len(images))])
 
+    if metrics_enabled():
+        print_metrics_summary()
+
 
     # # Blob operations with HTTP
     # print("\nUploading blob with HTTP...")
@@ -0,0 +1,134 @@
+from collections import OrderedDict
+from modules.insights import json_default
+from modules.metrics import increment
+from modules.utils import get_optional_env_variable
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "analysis_cache.sqlite")
+DEFAULT_MAX_ENTRIES = 256
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def hash_file(file_path, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Computes the SHA-256 of a file, reading it in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file_data:
+        for chunk in iter(lambda: file_data.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """
+    Caches analysis insights by content hash and model id.
+    Entries are persisted in SQLite and fronted by an in-memory LRU limited to `max_entries`;
+    entries older than `ttl_seconds` (when set) are treated as missing on both layers.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            "file_hash TEXT NOT NULL, model_id TEXT NOT NULL, created_at REAL NOT NULL, payload TEXT NOT NULL, "
+            "PRIMARY KEY (file_hash, model_id))"
+        )
+        self._connection.commit()
+
+    def _expired(self, created_at):
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+
+    def _remember(self, key, created_at, value):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, file_hash, model_id):
+        """Returns the cached insights for the document, or None on a miss."""
+        key = (file_hash, model_id)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._memory.move_to_end(key)
+                    increment("cache_hits", cache="analysis")
+                    return entry[1]
+                del self._memory[key]
+
+            row = self._connection.execute(
+                "SELECT created_at, payload FROM analyses WHERE file_hash = ? AND model_id = ?", key
+            ).fetchone()
+            if row is None:
+                increment("cache_misses", cache="analysis")
+                return None
+            if self._expired(row[0]):
+                self._connection.execute("DELETE FROM analyses WHERE file_hash = ? AND model_id = ?", key)
+                self._connection.commit()
+                increment("cache_misses", cache="analysis")
+                return None
+
+            value = json.loads(row[1])
+            self._remember(key, row[0], value)
+            increment("cache_hits", cache="analysis")
+            return value
+
+    def set(self, file_hash, model_id, insights):
+        """Stores the insights (an InvoiceInsights or any JSON-serializable value) for the document."""
+        key = (file_hash, model_id)
+        created_at = time.time()
+        payload = json.dumps(insights, default=json_default)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO analyses (file_hash, model_id, created_at, payload) VALUES (?, ?, ?, ?)",
+                (file_hash, model_id, created_at, payload),
+            )
+            self._connection.commit()
+            # Keep the in-memory copy identical to what a disk hit would return
+            self._remember(key, created_at, json.loads(payload))
+
+    def clear(self):
+        """Removes every entry from both layers."""
+        with self._lock:
+            self._memory.clear()
+            self._connection.execute("DELETE FROM analyses")
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def get_analysis_cache():
+    """
+    Returns the process-wide analysis cache, configured from ANALYSIS_CACHE_PATH,
+    ANALYSIS_CACHE_MAX_ENTRIES and ANALYSIS_CACHE_TTL_SECONDS when set.
+    """
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                ttl_seconds = get_optional_env_variable("ANALYSIS_CACHE_TTL_SECONDS")
+                _default_cache = AnalysisCache(
+                    path=get_optional_env_variable("ANALYSIS_CACHE_PATH", DEFAULT_CACHE_PATH),
+                    max_entries=int(get_optional_env_variable("ANALYSIS_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+                    ttl_seconds=float(ttl_seconds) if ttl_seconds else None,
+                )
+    return _default_cache
@@ -0,0 +1,352 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from modules.clients import get_http_session
+from modules.document_intelligence import DEFAULT_MODEL_ID
+from modules.metrics import increment, observe, span
+from modules.utils import get_env_variable, get_optional_env_variable
+import heapq
+import itertools
+import threading
+import time
+
+API_VERSION = "2023-07-31"
+DEFAULT_SUBMIT_RATE = 15.0
+DEFAULT_SUBMIT_BURST = 15
+DEFAULT_MAX_IN_FLIGHT = 64
+DEFAULT_MIN_POLL_INTERVAL = 0.5
+DEFAULT_MAX_POLL_INTERVAL = 5.0
+DEFAULT_POLL_WORKERS = 4
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_OPERATION_TIMEOUT = 30 * 60
+RETRY_BACKOFF_SECONDS = 1.0
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+_lock = threading.Lock()
+_scheduler = None
+
+
+class SchedulerFullError(Exception):
+    """Raised when no in-flight slot frees up before the submission timeout."""
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average, with bursts of up to `capacity`.
+    `pause(seconds)` empties the bucket and holds every caller back for at least that long.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """Takes a token if one is available, otherwise returns how long to wait for the next one."""
+        now = self._clock()
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Blocks until a token is available and takes it."""
+        while True:
+            with self._lock:
+                wait = self._take()
+            if wait <= 0:
+                return
+            self._sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+            # Tokens start refilling only once the pause is over
+            self._tokens = 0
+            self._updated = self._paused_until
+
+
+def retry_after(response):
+    """
+    Returns the delay in seconds requested by a response's retry-after-ms, x-ms-retry-after-ms or
+    Retry-After header (in seconds or as an HTTP date), or None when there is none.
+    """
+    for header in ("retry-after-ms", "x-ms-retry-after-ms"):
+        value = response.headers.get(header)
+        if value:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        from email.utils import parsedate_to_datetime
+
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+
+def _transient_errors():
+    """Connection failures and timeouts, which are retried like the retryable status codes."""
+    from requests import ConnectionError, Timeout
+
+    return ConnectionError, Timeout
+
+
+class _Operation:
+    __slots__ = ("url", "future", "interval", "started", "deadline", "retries")
+
+    def __init__(self, url, future, interval, timeout=None):
+        self.url = url
+        self.future = future
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        # Consecutive failed polls
+        self.retries = 0
+
+
+class AnalysisScheduler:
+    """
+    Submits Document Intelligence analyses and tracks all of their long-running operations together.
+
+    Submissions are limited by a token bucket (`rate` per second, bursts of `burst`); a 429 response
+    pauses every submission for its Retry-After. At most `max_in_flight` operations run at once:
+    `submit` blocks the caller until one finishes. Operations are polled from a single timer thread,
+    each starting at `min_poll_interval` and backing off to `max_poll_interval` while it keeps running,
+    unless the service asks for a specific delay.
+
+    Submissions and polls that fail with a retryable status, a connection error or a timeout are retried
+    up to `max_retries` times in a row, after the delay the service asks for or an exponential backoff
+    from `retry_backoff` seconds. An operation still running `operation_timeout` seconds after it was
+    submitted fails with a TimeoutError (it never does when that is None).
+    """
+
+    def __init__(self, endpoint=None, key=None, rate=DEFAULT_SUBMIT_RATE, burst=DEFAULT_SUBMIT_BURST,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, min_poll_interval=DEFAULT_MIN_POLL_INTERVAL,
+                 max_poll_interval=DEFAULT_MAX_POLL_INTERVAL, poll_workers=DEFAULT_POLL_WORKERS,
+                 max_retries=DEFAULT_MAX_RETRIES, operation_timeout=DEFAULT_OPERATION_TIMEOUT,
+                 retry_backoff=RETRY_BACKOFF_SECONDS, session=None):
+        self.endpoint = (endpoint or get_env_variable("AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT")).rstrip("/")
+        self._key = key or get_env_variable("AZURE_DOCUMENT_INTELLIGENCE_KEY")
+        self._session = session or get_http_session()
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.max_retries = max_retries
+        self.operation_timeout = operation_timeout
+        self.retry_backoff = retry_backoff
+        self.throttled = 0
+        self._bucket = TokenBucket(rate, burst)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._operations = []  # Heap of (next poll time, sequence, operation)
+        self._sequence = itertools.count()
+        self._pending = set()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._poll_executor = ThreadPoolExecutor(max_workers=poll_workers, thread_name_prefix="analysis-poll")
+        self._timer = threading.Thread(target=self._run_timer, name="analysis-timer", daemon=True)
+        self._timer.start()
+
+    def _headers(self, content_type=None):
+        headers = {"Ocp-Apim-Subscription-Key": self._key}
+        if content_type:
+            headers["Content-Type"] = content_type
+        return headers
+
+    def submit(self, url=None, document=None, model_id=DEFAULT_MODEL_ID, timeout=None, pages=None):
+        """
+        Starts analyzing a document given by `url` or as `document` bytes (only the `pages` given, e.g.
+        "1-50", when set) and returns a Future of its AnalyzeResult. Blocks while the in-flight budget is
+        used up; raises SchedulerFullError when `timeout` seconds pass without a slot freeing up.
+        """
+        if (url is None) == (document is None):
+            raise ValueError("Pass either a document URL or the document bytes.")
+        if not self._slots.acquire(timeout=timeout):
+            raise SchedulerFullError("Too many analyses in flight, please try again later.")
+        try:
+            with span("analysis_submit"):
+                operation_url = self._start(model_id, url, document, pages)
+        except Exception:
+            self._slots.release()
+            raise
+
+        future = Future()
+        with self._condition:
+            self._pending.add(future)
+        operation = _Operation(operation_url, future, self.min_poll_interval, self.operation_timeout)
+        self._schedule(operation, self.min_poll_interval)
+        return future
+
+    def analyze(self, url=None, document=None, model_id=DEFAULT_MODEL_ID, pages=None):
+        """Analyzes a document and waits for its AnalyzeResult."""
+        return self.submit(url=url, document=document, model_id=model_id, pages=pages).result()
+
+    def _start(self, model_id, url, document, pages=None):
+        """Sends the Analyze Document request, retrying throttled and failed attempts; returns the operation URL."""
+        request_url = (f"{self.endpoint}/formrecognizer/documentModels/{model_id}:analyze"
+                       f"?api-version={API_VERSION}&stringIndexType=unicodeCodePoint")
+        if pages:
+            request_url += f"&pages={pages}"
+        for attempt in range(self.max_retries + 1):
+            self._bucket.acquire()
+            try:
+                if url is not None:
+                    response = self._session.post(request_url, json={"urlSource": url}, headers=self._headers())
+                else:
+                    response = self._session.post(
+                        request_url, data=document, headers=self._headers("application/octet-stream")
+                    )
+            except _transient_errors():
+                if attempt == self.max_retries:
+                    raise
+                increment("retries", operation="analysis_submit")
+                time.sleep(self._retry_delay(None, attempt))
+                continue
+            if response.ok:
+                return response.headers["Operation-Location"]
+            if response.status_code not in RETRYABLE_STATUS_CODES or attempt == self.max_retries:
+                response.raise_for_status()
+            increment("retries", operation="analysis_submit")
+            delay = self._retry_delay(response, attempt)
+            if response.status_code == 429:
+                # Over the quota: hold back every submission, not just this one
+                self.throttled += 1
+                self._bucket.pause(delay)
+            else:
+                time.sleep(delay)
+
+    def _retry_delay(self, response, attempt):
+        """The delay a retryable response asks for, or an exponential backoff for the `attempt`-th retry."""
+        delay = retry_after(response) if response is not None else None
+        return self.retry_backoff * (2 ** attempt) if delay is None else delay
+
+    def _schedule(self, operation, delay):
+        with self._condition:
+            heapq.heappush(self._operations, (time.monotonic() + delay, next(self._sequence), operation))
+            self._condition.notify()
+
+    def _run_timer(self):
+        while True:
+            with self._condition:
+                while not self._closed and (not self._operations or self._operations[0][0] > time.monotonic()):
+                    timeout = self._operations[0][0] - time.monotonic() if self._operations else None
+                    self._condition.wait(timeout)
+                if self._closed:
+                    return
+                now = time.monotonic()
+                due = []
+                while self._operations and self._operations[0][0] <= now:
+                    due.append(heapq.heappop(self._operations)[2])
+            for operation in due:
+                self._poll_executor.submit(self._poll, operation)
+
+    def _poll(self, operation):
+        from azure.ai.formrecognizer import AnalyzeResult
+        from azure.ai.formrecognizer._generated.v2023_07_31.models import AnalyzeResult as _GeneratedAnalyzeResult
+        from azure.core.exceptions import HttpResponseError
+
+        try:
+            if operation.deadline is not None and time.monotonic() > operation.deadline:
+                raise TimeoutError(f"Analysis did not finish within {self.operation_timeout} seconds.")
+            try:
+                response = self._session.get(operation.url, headers=self._headers())
+            except _transient_errors():
+                if operation.retries == self.max_retries:
+                    raise
+                self._retry_poll(operation, None)
+                return
+            if response.status_code in RETRYABLE_STATUS_CODES and operation.retries < self.max_retries:
+                self._retry_poll(operation, response)
+                return
+            operation.retries = 0
+            response.raise_for_status()
+            body = response.json()
+            status = body.get("status")
+            if status == "succeeded":
+                # Same conversion the SDK applies to the REST payload. It relies on private SDK modules,
+                # which is why requirements.txt pins azure-ai-formrecognizer to the tested version
+                result = AnalyzeResult._from_generated(_GeneratedAnalyzeResult.deserialize(body["analyzeResult"]))
+                self._finish(operation, result=result)
+            elif status in ("failed", "canceled"):
+                message = (body.get("error") or {}).get("message", "unknown error")
+                self._finish(operation, error=HttpResponseError(message=f"Analysis {status}: {message}"))
+            else:
+                delay = retry_after(response)
+                self._schedule(operation, operation.interval if delay is None else delay)
+                operation.interval = min(operation.interval * 2, self.max_poll_interval)
+        except Exception as e:
+            self._finish(operation, error=e)
+
+    def _retry_poll(self, operation, response):
+        increment("retries", operation="analysis_poll")
+        delay = self._retry_delay(response, operation.retries)
+        operation.retries += 1
+        self._schedule(operation, delay)
+
+    def _finish(self, operation, result=None, error=None):
+        # Time from the accepted submission to the final status, as the SDK poller's result() is timed
+        observe("analysis_poll", time.perf_counter() - operation.started)
+        with self._condition:
+            self._pending.discard(operation.future)
+        self._slots.release()
+        if error is not None:
+            operation.future.set_exception(error)
+        else:
+            operation.future.set_result(result)
+
+    def close(self, wait=True):
+        """Stops the poller, first waiting for the outstanding operations when `wait` is True."""
+        if wait:
+            with self._condition:
+                pending = list(self._pending)
+            for future in pending:
+                try:
+                    future.result()
+                except Exception:
+                    pass
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._timer.join()
+        self._poll_executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def get_analysis_scheduler():
+    """
+    Returns the process-wide analysis scheduler, configured on first use from ANALYSIS_SUBMIT_RATE,
+    ANALYSIS_SUBMIT_BURST, ANALYSIS_MAX_IN_FLIGHT, ANALYSIS_MIN_POLL_INTERVAL and ANALYSIS_MAX_POLL_INTERVAL.
+    """
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = AnalysisScheduler(
+                rate=float(get_optional_env_variable("ANALYSIS_SUBMIT_RATE", DEFAULT_SUBMIT_RATE)),
+                burst=int(get_optional_env_variable("ANALYSIS_SUBMIT_BURST", DEFAULT_SUBMIT_BURST)),
+                max_in_flight=int(get_optional_env_variable("ANALYSIS_MAX_IN_FLIGHT", DEFAULT_MAX_IN_FLIGHT)),
+                min_poll_interval=float(
+                    get_optional_env_variable("ANALYSIS_MIN_POLL_INTERVAL", DEFAULT_MIN_POLL_INTERVAL)
+                ),
+                max_poll_interval=float(
+                    get_optional_env_variable("ANALYSIS_MAX_POLL_INTERVAL", DEFAULT_MAX_POLL_INTERVAL)
+                ),
+            )
+        return _scheduler
@@ -0,0 +1,155 @@
+from azure.ai.formrecognizer.aio import DocumentAnalysisClient
+from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.storage.blob import ContentSettings
+from azure.storage.blob.aio import BlobServiceClient
+from modules.azure_blob import _account_url, _container_key
+from modules.clients import DEFAULT_POOL_MAXSIZE, client_key, pool_setting
+from modules.document_intelligence import DEFAULT_MODEL_ID
+from modules.provisioning import run_with_ensured_async
+from modules.utils import compute_md5, get_env_variable
+import aiohttp
+import asyncio
+import os
+import threading
+
+# Size of the reads handed to a worker thread while a file is uploaded
+UPLOAD_READ_SIZE = 4 * 1024 * 1024
+
+_lock = threading.Lock()
+_sessions = {}
+_clients = {}
+
+
+def get_async_http_session():
+    """
+    Returns the aiohttp session shared by the async clients of the running event loop.
+    The connection pool holds up to AZURE_HTTP_POOL_MAXSIZE connections per host.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        session = _sessions.get(loop)
+        if session is None or session.closed:
+            limit = pool_setting("AZURE_HTTP_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE)
+            session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=limit, limit_per_host=limit))
+            _sessions[loop] = session
+        return session
+
+
+def get_async_client(client_class, **config):
+    """
+    Returns the shared async `client_class` instance for the given configuration and the running
+    event loop, building it on first use on top of the loop's shared aiohttp session.
+    """
+    loop = asyncio.get_running_loop()
+    key = (loop, client_key(client_class, config))
+    session = get_async_http_session()
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            transport = AioHttpTransport(session=session, session_owner=False)
+            client = client_class(transport=transport, **config)
+            _clients[key] = client
+        return client
+
+
+async def close_async_clients():
+    """
+    Closes the async clients and the shared session of the running event loop.
+    Call it before the loop shuts down.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = [_clients.pop(key) for key in [key for key in _clients if key[0] is loop]]
+        session = _sessions.pop(loop, None)
+    for client in clients:
+        await client.close()
+    if session is not None:
+        await session.close()
+
+
+async def upload_blob(file_path, skip_if_unchanged=False, max_concurrency=1, timeout=None):
+    """
+    Uploads a file to Azure Blob Storage using the async Azure SDK.
+    Behaves like `upload_blob_with_sdk`; raises asyncio.TimeoutError when `timeout` seconds elapse
+    and can be cancelled like any other task. Returns True when the file was uploaded.
+    """
+    return await asyncio.wait_for(_upload_blob(file_path, skip_if_unchanged, max_concurrency), timeout)
+
+
+async def _upload_blob(file_path, skip_if_unchanged, max_concurrency):
+    account_name = get_env_variable("AZURE_STORAGE_ACCOUNT_NAME")
+    account_key = get_env_variable("AZURE_STORAGE_ACCOUNT_KEY")
+    container_name = get_env_variable("AZURE_STORAGE_BLOB_CONTAINER_NAME")
+
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File not found: {file_path}")
+
+    blob_service_client = get_async_client(
+        BlobServiceClient,
+        account_url=_account_url(account_name),
+        credential=account_key
+    )
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=os.path.basename(file_path))
+
+    upload_options = {}
+    if skip_if_unchanged:
+        # Hashing reads the whole file, so it runs in a worker thread instead of blocking the loop
+        content_md5 = await asyncio.to_thread(compute_md5, file_path)
+        try:
+            existing_md5 = (await blob_client.get_blob_properties()).content_settings.content_md5
+        except ResourceNotFoundError:
+            existing_md5 = None
+        if existing_md5 is not None and bytes(existing_md5) == content_md5:
+            print(f"File '{os.path.basename(file_path)}' is unchanged in container '{container_name}', skipping upload.")
+            return False
+        upload_options["content_settings"] = ContentSettings(content_md5=bytearray(content_md5))
+
+    container_client = blob_service_client.get_container_client(container_name)
+
+    async def create_container():
+        if not await container_client.exists():
+            try:
+                await container_client.create_container(public_access="blob")  # Make the container public
+            except ResourceExistsError:
+                pass
+
+    async def upload():
+        await blob_client.upload_blob(
+            _read_chunks(file_path), length=os.path.getsize(file_path), overwrite=True,
+            max_concurrency=max_concurrency, **upload_options
+        )
+
+    await run_with_ensured_async(_container_key(account_name, container_name), create_container, upload)
+    print(f"File uploaded successfully to container '{container_name}'.")
+    return True
+
+
+async def _read_chunks(file_path, chunk_size=UPLOAD_READ_SIZE):
+    """Yields the contents of a file, reading every chunk in a worker thread so the event loop keeps running."""
+    file_data = await asyncio.to_thread(open, file_path, "rb")
+    try:
+        while True:
+            chunk = await asyncio.to_thread(file_data.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        file_data.close()
+
+
+async def analyze_document(document_url, model_id=DEFAULT_MODEL_ID, timeout=None):
+    """
+    Analyzes a document by URL using the async Azure SDK, awaiting the operation without blocking a thread.
+    Raises asyncio.TimeoutError when `timeout` seconds elapse; cancelling the task stops polling.
+    """
+    endpoint = get_env_variable("AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT")
+    key = get_env_variable("AZURE_DOCUMENT_INTELLIGENCE_KEY")
+    client = get_async_client(DocumentAnalysisClient, endpoint=endpoint, credential=AzureKeyCredential(key))
+
+    async def analyze():
+        poller = await client.begin_analyze_document_from_url(model_id, document_url)
+        return await poller.result()
+
+    return await asyncio.wait_for(analyze(), timeout)
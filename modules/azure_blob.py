@@ -1,12 +1,46 @@
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from modules.utils import get_env_variable
+from modules.clients import get_client, get_http_session
+from modules.metrics import increment, timed
+from modules.provisioning import ensure_once, forget, is_not_found, run_with_ensured
+from modules.signing import get_sas_cache, get_signer
+from modules.utils import LazyImport, compute_md5, get_env_variable, get_optional_env_variable, read_file_range
+from urllib.parse import quote
+import base64
+import hashlib
 import os
-import requests
+import threading
+import time
 
+# The SDK is imported the first time it is used
+BlobServiceClient = LazyImport("azure.storage.blob", "BlobServiceClient")
+ContentSettings = LazyImport("azure.storage.blob", "ContentSettings")
 
-def upload_blob_with_sdk(file_path):
-    """Uploads a file to Azure Blob Storage using the Azure SDK."""
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.5
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+SAS_LIFETIME = timedelta(hours=10)
+SAS_START_SKEW = timedelta(hours=10)  # Start slightly earlier to avoid clock discrepancies
+
+
+def _account_url(account_name):
+    """
+    Returns the Blob service endpoint, honouring AZURE_STORAGE_BLOB_ENDPOINT (e.g. a local emulator).
+    """
+    return get_optional_env_variable(
+        "AZURE_STORAGE_BLOB_ENDPOINT", f"https://{account_name}.blob.core.windows.net"
+    ).rstrip("/")
+
+
+@timed("upload")
+def upload_blob_with_sdk(file_path, skip_if_unchanged=False, blob_name=None):
+    """
+    Uploads a file to Azure Blob Storage using the Azure SDK, as `blob_name` (default: the file's base name).
+    With `skip_if_unchanged`, the upload is skipped when the existing blob has the same Content-MD5.
+    Returns True when the file was uploaded.
+    """
     account_name = get_env_variable("AZURE_STORAGE_ACCOUNT_NAME")
     account_key = get_env_variable("AZURE_STORAGE_ACCOUNT_KEY")
     container_name = get_env_variable("AZURE_STORAGE_BLOB_CONTAINER_NAME")
@@ -14,24 +48,52 @@ def upload_blob_with_sdk(file_path):
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"File not found: {file_path}")
 
-    blob_service_client = BlobServiceClient(
-        account_url=f"https://{account_name}.blob.core.windows.net",
+    blob_service_client = get_client(
+        BlobServiceClient,
+        account_url=_account_url(account_name),
         credential=account_key
     )
 
+    blob_client = blob_service_client.get_blob_client(
+        container=container_name, blob=os.path.basename(blob_name or file_path)
+    )
+
+    upload_options = {}
+    if skip_if_unchanged:
+        from azure.core.exceptions import ResourceNotFoundError
+
+        content_md5 = compute_md5(file_path)
+        try:
+            existing_md5 = blob_client.get_blob_properties().content_settings.content_md5
+        except ResourceNotFoundError:
+            existing_md5 = None
+        if existing_md5 is not None and bytes(existing_md5) == content_md5:
+            print(f"File '{os.path.basename(file_path)}' is unchanged in container '{container_name}', skipping upload.")
+            return False
+        # Block uploads don't get a Content-MD5 from the service, so always record it
+        upload_options["content_settings"] = ContentSettings(content_md5=bytearray(content_md5))
+
     container_client = blob_service_client.get_container_client(container_name)
-    if not container_client.exists():
-        container_client.create_container(public_access="blob")  # Make the container public
 
-    blob_client = blob_service_client.get_blob_client(container=container_name, blob=os.path.basename(file_path))
+    def upload():
+        with open(file_path, "rb") as file_data:
+            blob_client.upload_blob(file_data, overwrite=True, **upload_options)
 
-    with open(file_path, "rb") as file_data:
-        blob_client.upload_blob(file_data, overwrite=True)
+    # The container is only checked the first time it is used by this process
+    run_with_ensured(
+        _container_key(account_name, container_name), lambda: _create_container_with_sdk(container_client), upload
+    )
     print(f"File uploaded successfully to container '{container_name}'.")
+    return True
 
 
-def upload_blob_with_http(file_path):
-    """Uploads a file to Azure Blob Storage using HTTP requests."""
+@timed("upload")
+def upload_blob_with_http(file_path, skip_if_unchanged=False, blob_name=None):
+    """
+    Uploads a file to Azure Blob Storage using HTTP requests, as `blob_name` (default: the file's base name).
+    With `skip_if_unchanged`, the upload is skipped when the existing blob has the same Content-MD5.
+    Returns True when the file was uploaded.
+    """
     account_name = get_env_variable("AZURE_STORAGE_ACCOUNT_NAME")
     account_key = get_env_variable("AZURE_STORAGE_ACCOUNT_KEY")
     container_name = get_env_variable("AZURE_STORAGE_BLOB_CONTAINER_NAME")
@@ -39,114 +101,302 @@ def upload_blob_with_http(file_path):
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"File not found: {file_path}")
 
-    # Create or ensure the container is public
-    container_url = f"https://{account_name}.blob.core.windows.net/{container_name}?restype=container"
-    headers = {
-        "x-ms-version": "2020-08-04",
-        "x-ms-date": datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT"),  # UTC
-        "x-ms-blob-public-access": "blob",
-    }
-    headers["Authorization"] = _generate_authorization_header(account_name, account_key, container_url, "PUT", headers)
-    response = requests.put(container_url, headers=headers)
-    if response.status_code not in [201, 409]:
-        response.raise_for_status()
+    blob_url = f"{_account_url(account_name)}/{container_name}/{os.path.basename(blob_name or file_path)}"
+    md5_headers = {}
+    if skip_if_unchanged:
+        content_md5 = base64.b64encode(compute_md5(file_path)).decode()
+        if _get_content_md5_with_http(account_name, account_key, blob_url) == content_md5:
+            print(f"File '{os.path.basename(file_path)}' is unchanged in container '{container_name}', skipping upload.")
+            return False
+        md5_headers["x-ms-blob-content-md5"] = content_md5
 
     # Upload the file
-    blob_url = f"https://{account_name}.blob.core.windows.net/{container_name}/{os.path.basename(file_path)}"
     file_size = os.path.getsize(file_path)
+
+    def upload():
+        headers = {
+            "x-ms-version": "2020-08-04",
+            "x-ms-date": datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT"),  # UTC
+            "x-ms-blob-type": "BlockBlob",
+            "Content-Length": str(file_size),
+            **md5_headers,
+        }
+        headers["Authorization"] = get_signer(account_name, account_key).authorization_header(blob_url, "PUT", headers)
+
+        with open(file_path, "rb") as file_data:
+            response = get_http_session().put(blob_url, headers=headers, data=file_data)
+            response.raise_for_status()
+
+    # Create or ensure the container is public, once per process
+    run_with_ensured(
+        _container_key(account_name, container_name),
+        lambda: _create_container_with_http(account_name, account_key, container_name),
+        upload,
+    )
+
+    print(f"File '{os.path.basename(file_path)}' uploaded successfully to container '{container_name}'.")
+    return True
+
+
+@timed("upload")
+def upload_blob_in_blocks(file_path, block_size=DEFAULT_BLOCK_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                          max_retries=DEFAULT_MAX_RETRIES, progress_callback=None, skip_if_unchanged=False,
+                          blob_name=None):
+    """
+    Uploads a file to Azure Blob Storage in blocks using HTTP requests, as `blob_name` (default: the file's base name).
+    Blocks are staged in parallel with Put Block and committed with Put Block List; a failed block is
+    retried on its own instead of restarting the whole upload. `progress_callback(uploaded, total)`
+    is called after every staged block. With `skip_if_unchanged`, the upload is skipped when the
+    existing blob has the same Content-MD5. Returns True when the file was uploaded.
+    """
+    account_name = get_env_variable("AZURE_STORAGE_ACCOUNT_NAME")
+    account_key = get_env_variable("AZURE_STORAGE_ACCOUNT_KEY")
+    container_name = get_env_variable("AZURE_STORAGE_BLOB_CONTAINER_NAME")
+
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File not found: {file_path}")
+    if block_size <= 0 or max_concurrency <= 0:
+        raise ValueError("block_size and max_concurrency must be positive.")
+
+    blob_url = f"{_account_url(account_name)}/{container_name}/{os.path.basename(blob_name or file_path)}"
+    commit_headers = {"Content-Type": "application/xml"}
+    if skip_if_unchanged:
+        content_md5 = base64.b64encode(compute_md5(file_path)).decode()
+        if _get_content_md5_with_http(account_name, account_key, blob_url) == content_md5:
+            print(f"File '{os.path.basename(file_path)}' is unchanged in container '{container_name}', skipping upload.")
+            return False
+        # The service doesn't compute an MD5 for block uploads, so record it on commit
+        commit_headers["x-ms-blob-content-md5"] = content_md5
+
+    file_size = os.path.getsize(file_path)
+    offsets = range(0, file_size, block_size)
+    # Block ids must all have the same length within a blob
+    block_ids = [base64.b64encode(f"{index:08d}".encode()).decode() for index in range(len(offsets))]
+
+    progress_lock = threading.Lock()
+    uploaded = [0]
+
+    def stage_block(index):
+        offset = offsets[index]
+        data = read_file_range(file_path, offset, min(block_size, file_size - offset))
+        block_url = f"{blob_url}?comp=block&blockid={quote(block_ids[index], safe='')}"
+        _put_with_retries(account_name, account_key, block_url, data, {}, max_retries)
+        if progress_callback:
+            with progress_lock:
+                uploaded[0] += len(data)
+                progress_callback(uploaded[0], file_size)
+
+    def upload():
+        uploaded[0] = 0
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            # Consuming the iterator re-raises the first block that ran out of retries
+            list(executor.map(stage_block, range(len(offsets))))
+
+        block_list = "".join(f"<Latest>{block_id}</Latest>" for block_id in block_ids)
+        body = f'<?xml version="1.0" encoding="utf-8"?><BlockList>{block_list}</BlockList>'.encode("utf-8")
+        _put_with_retries(account_name, account_key, f"{blob_url}?comp=blocklist", body, commit_headers, max_retries)
+
+    run_with_ensured(
+        _container_key(account_name, container_name),
+        lambda: _create_container_with_http(account_name, account_key, container_name),
+        upload,
+    )
+
+    print(f"File '{os.path.basename(file_path)}' uploaded in {len(block_ids)} blocks to container '{container_name}'.")
+    return True
+
+
+@timed("upload")
+def upload_blob_from_stream(stream, blob_name, block_size=DEFAULT_BLOCK_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                            max_retries=DEFAULT_MAX_RETRIES):
+    """
+    Uploads data from a file-like object or an iterable of byte chunks as a block blob, without a local copy.
+    Blocks are staged concurrently as they fill up, keeping at most `max_concurrency + 1` blocks in memory.
+    The SHA-256 and MD5 of the content are computed on the fly; the MD5 is stored as the blob's Content-MD5.
+    Returns a dict with the blob name, size, sha256 (hex) and content_md5 (base64).
+    """
+    account_name = get_env_variable("AZURE_STORAGE_ACCOUNT_NAME")
+    account_key = get_env_variable("AZURE_STORAGE_ACCOUNT_KEY")
+    container_name = get_env_variable("AZURE_STORAGE_BLOB_CONTAINER_NAME")
+
+    if block_size <= 0 or max_concurrency <= 0:
+        raise ValueError("block_size and max_concurrency must be positive.")
+
+    blob_name = os.path.basename(blob_name)
+    blob_url = f"{_account_url(account_name)}/{container_name}/{blob_name}"
+    if hasattr(stream, "read"):
+        stream = iter(lambda: stream.read(block_size), b"")
+
+    # The stream can't be replayed, so the container is verified up front instead of retried on a 404
+    key = _container_key(account_name, container_name)
+    ensure_once(key, lambda: _create_container_with_http(account_name, account_key, container_name))
+
+    sha256, md5 = hashlib.sha256(), hashlib.md5()
+    block_ids = []
+    size = 0
+    in_flight = threading.BoundedSemaphore(max_concurrency)
+
+    def stage_block(block_id, data):
+        try:
+            block_url = f"{blob_url}?comp=block&blockid={quote(block_id, safe='')}"
+            _put_with_retries(account_name, account_key, block_url, data, {}, max_retries)
+        finally:
+            in_flight.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = []
+
+            def submit(data):
+                block_id = base64.b64encode(f"{len(block_ids):08d}".encode()).decode()
+                block_ids.append(block_id)
+                # Wait for a free slot so that reading never runs far ahead of the uploads
+                in_flight.acquire()
+                futures.append(executor.submit(stage_block, block_id, bytes(data)))
+
+            buffer = bytearray()
+            for chunk in stream:
+                sha256.update(chunk)
+                md5.update(chunk)
+                size += len(chunk)
+                buffer += chunk
+                while len(buffer) >= block_size:
+                    submit(buffer[:block_size])
+                    del buffer[:block_size]
+            if buffer:
+                submit(buffer)
+
+            for future in futures:
+                future.result()
+
+        content_md5 = base64.b64encode(md5.digest()).decode()
+        block_list = "".join(f"<Latest>{block_id}</Latest>" for block_id in block_ids)
+        body = f'<?xml version="1.0" encoding="utf-8"?><BlockList>{block_list}</BlockList>'.encode("utf-8")
+        _put_with_retries(
+            account_name, account_key, f"{blob_url}?comp=blocklist", body,
+            {"Content-Type": "application/xml", "x-ms-blob-content-md5": content_md5}, max_retries
+        )
+    except Exception as error:
+        if is_not_found(error):
+            forget(key)
+        raise
+
+    print(f"Stream uploaded in {len(block_ids)} blocks to '{blob_name}' in container '{container_name}'.")
+    return {"blob_name": blob_name, "size": size, "sha256": sha256.hexdigest(), "content_md5": content_md5}
+
+
+def _put_with_retries(account_name, account_key, url, data, extra_headers, max_retries):
+    """
+    Sends a signed PUT with `data`, retrying connection errors and transient status codes
+    with exponential backoff.
+    """
+    import requests
+
+    for attempt in range(max_retries + 1):
+        headers = {
+            "x-ms-version": "2020-08-04",
+            "x-ms-date": datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT"),  # UTC
+            "Content-Length": str(len(data)),
+            **extra_headers,
+        }
+        headers["Authorization"] = get_signer(account_name, account_key).authorization_header(url, "PUT", headers)
+        try:
+            response = get_http_session().put(url, headers=headers, data=data)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == max_retries:
+                raise
+        else:
+            if response.status_code not in RETRYABLE_STATUS_CODES or attempt == max_retries:
+                response.raise_for_status()
+                return response
+        increment("retries", operation="blob_put")
+        time.sleep(RETRY_BACKOFF_SECONDS * (2 ** attempt))
+
+
+def _get_content_md5_with_http(account_name, account_key, blob_url):
+    """
+    Returns the base64 Content-MD5 of an existing blob from a single HEAD request, or None.
+    """
     headers = {
         "x-ms-version": "2020-08-04",
         "x-ms-date": datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT"),  # UTC
-        "x-ms-blob-type": "BlockBlob",
-        "Content-Length": str(file_size),
     }
-    headers["Authorization"] = _generate_authorization_header(account_name, account_key, blob_url, "PUT", headers)
-
-    with open(file_path, "rb") as file_data:
-        response = requests.put(blob_url, headers=headers, data=file_data)
-        response.raise_for_status()
-
-    print(f"File '{os.path.basename(file_path)}' uploaded successfully to container '{container_name}'.")
+    headers["Authorization"] = get_signer(account_name, account_key).authorization_header(blob_url, "HEAD", headers)
+    response = get_http_session().head(blob_url, headers=headers)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.headers.get("Content-MD5")
 
 
-def generate_blob_url(blob_name):
+def ensure_container():
     """
-    Generates a SAS URL for a blob using BlobServiceClient.
+    Makes sure the configured container exists, remembering it for the rest of the process.
+    Call it at startup to take the check out of the first upload.
     """
     account_name = get_env_variable("AZURE_STORAGE_ACCOUNT_NAME")
     account_key = get_env_variable("AZURE_STORAGE_ACCOUNT_KEY")
     container_name = get_env_variable("AZURE_STORAGE_BLOB_CONTAINER_NAME")
 
-    filename = os.path.basename(blob_name)
-
-    # Configure start and expiry times
-    start_time = datetime.now(timezone.utc) - timedelta(hours=10)  # Start slightly earlier to avoid discrepancies
-    expiry_time = datetime.now(timezone.utc) + timedelta(hours=10)  # Expiry (e.g., 10 hours)
-
-    # Generate the SAS token
-    sas_token = generate_blob_sas(
-        account_name=account_name,
-        container_name=container_name,
-        blob_name=filename,
-        account_key=account_key,
-        permission=BlobSasPermissions(read=True),  # Read-only
-        start=start_time,
-        expiry=expiry_time,
-        resource="b"  # Specify that it's a blob
+    blob_service_client = get_client(
+        BlobServiceClient,
+        account_url=_account_url(account_name),
+        credential=account_key
     )
+    container_client = blob_service_client.get_container_client(container_name)
+    ensure_once(_container_key(account_name, container_name), lambda: _create_container_with_sdk(container_client))
+
+
+def _container_key(account_name, container_name):
+    return ("container", _account_url(account_name), container_name)
 
-    blob_url = f"https://{account_name}.blob.core.windows.net/{container_name}/{filename}?{sas_token}"
+
+def _create_container_with_sdk(container_client):
+    """
+    Creates the container with public blob access unless it already exists.
+    """
+    if not container_client.exists():
+        container_client.create_container(public_access="blob")  # Make the container public
+
+
+def _create_container_with_http(account_name, account_key, container_name):
+    """
+    Creates the container with public blob access, treating an existing container as success.
+    """
+    container_url = f"{_account_url(account_name)}/{container_name}?restype=container"
+    headers = {
+        "x-ms-version": "2020-08-04",
+        "x-ms-date": datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT"),  # UTC
+        "x-ms-blob-public-access": "blob",
+    }
+    headers["Authorization"] = get_signer(account_name, account_key).authorization_header(container_url, "PUT", headers)
+    response = get_http_session().put(container_url, headers=headers)
+    if response.status_code not in [201, 409]:
+        response.raise_for_status()
+
+
+def generate_blob_url(blob_name):
+    """
+    Generates a read-only SAS URL for a blob, reusing the cached one while it is far from expiring.
+    """
+    blob_url = generate_blob_urls([blob_name])[0]
     print(f"Long-Term SAS URL: {blob_url}")
     return blob_url
 
 
-def _generate_authorization_header(account_name, account_key, url, method, headers=None):
-    """
-    Generates the Authorization header manually for HTTP requests to Azure Blob Storage.
-    """
-    import hmac
-    import hashlib
-    import base64
-    from urllib.parse import urlparse, parse_qs
-
-    if headers is None:
-        headers = {}
-
-    parsed_url = urlparse(url)
-    query = parse_qs(parsed_url.query)
-
-    # Build the string-to-sign
-    string_to_sign = f"{method}\n"
-    string_to_sign += "\n"  # Content-Encoding
-    string_to_sign += "\n"  # Content-Language
-    string_to_sign += f"{headers.get('Content-Length', '')}\n"
-    string_to_sign += "\n"  # Content-MD5
-    string_to_sign += f"{headers.get('Content-Type', '')}\n"
-    string_to_sign += "\n"
-    string_to_sign += "\n"  # If-Modified-Since
-    string_to_sign += "\n"  # If-Match
-    string_to_sign += "\n"  # If-None-Match
-    string_to_sign += "\n"  # If-Unmodified-Since
-    string_to_sign += "\n"  # Range
-
-    # Canonicalized headers
-    x_ms_headers = {k.lower(): v for k, v in headers.items() if k.lower().startswith("x-ms-")}
-    canonicalized_headers = "".join([f"{k}:{v}\n" for k, v in sorted(x_ms_headers.items())])
-    string_to_sign += canonicalized_headers
-
-    # Canonicalized resource
-    canonicalized_resource = f"/{account_name}{parsed_url.path}"
-    if query:
-        canonicalized_resource += "\n" + "\n".join(
-            f"{k}:{','.join(query[k])}" for k in sorted(query)
-        )
-    string_to_sign += canonicalized_resource
+@timed("sas")
+def generate_blob_urls(blob_names):
+    """
+    Generates read-only SAS URLs for many blobs at once, signing only the ones not cached yet
+    (or close to their expiry).
+    """
+    return _sas_cache().urls([os.path.basename(blob_name) for blob_name in blob_names])
+
 
-    # Sign the string
-    signed_hmac_sha256 = hmac.new(
-        base64.b64decode(account_key),
-        string_to_sign.encode("utf-8"),
-        hashlib.sha256
+def _sas_cache():
+    account_name = get_env_variable("AZURE_STORAGE_ACCOUNT_NAME")
+    account_key = get_env_variable("AZURE_STORAGE_ACCOUNT_KEY")
+    container_name = get_env_variable("AZURE_STORAGE_BLOB_CONTAINER_NAME")
+    return get_sas_cache(
+        "blob", account_name, account_key, _account_url(account_name), container_name, SAS_LIFETIME, SAS_START_SKEW
     )
-    signature = base64.b64encode(signed_hmac_sha256.digest()).decode()
-    return f"SharedKey {account_name}:{signature}"
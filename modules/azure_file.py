@@ -1,13 +1,40 @@
-from azure.storage.fileshare import ShareServiceClient, generate_file_sas, FileSasPermissions
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from modules.utils import get_env_variable
+from modules.clients import get_client, get_http_session
+from modules.metrics import timed
+from modules.provisioning import ensure_once, run_with_ensured
+from modules.signing import get_sas_cache, get_signer
+from modules.utils import LazyImport, compute_md5, get_env_variable, get_optional_env_variable, read_file_range
+import base64
 import os
-import requests
+import time
 
+# The SDK is imported the first time it is used
+ShareServiceClient = LazyImport("azure.storage.fileshare", "ShareServiceClient")
+ContentSettings = LazyImport("azure.storage.fileshare", "ContentSettings")
 
-def upload_file_with_sdk(file_path):
+MAX_RANGE_SIZE = 4 * 1024 * 1024  # The File service rejects larger single range writes
+DEFAULT_MAX_CONCURRENCY = 4
+SAS_LIFETIME = timedelta(hours=24)
+SAS_START_SKEW = timedelta(hours=24)
+
+
+def _account_url(account_name):
+    """
+    Returns the File service endpoint, honouring AZURE_STORAGE_FILE_ENDPOINT (e.g. a local emulator).
     """
-    Uploads a file to Azure File Share using the Azure SDK.
+    return get_optional_env_variable(
+        "AZURE_STORAGE_FILE_ENDPOINT", f"https://{account_name}.file.core.windows.net"
+    ).rstrip("/")
+
+
+@timed("upload")
+def upload_file_with_sdk(file_path, max_concurrency=DEFAULT_MAX_CONCURRENCY, skip_if_unchanged=False, file_name=None):
+    """
+    Uploads a file to Azure File Share using the Azure SDK, writing up to `max_concurrency` ranges at once.
+    The file is stored as `file_name` (default: its base name).
+    With `skip_if_unchanged`, the upload is skipped when the existing file has the same Content-MD5.
+    Returns True when the file was uploaded.
     """
     account_name = get_env_variable("AZURE_STORAGE_ACCOUNT_NAME")
     account_key = get_env_variable("AZURE_STORAGE_ACCOUNT_KEY")
@@ -18,28 +45,48 @@ def upload_file_with_sdk(file_path):
         raise FileNotFoundError(f"File not found: {file_path}")
 
     # Create the ShareServiceClient
-    share_service_client = ShareServiceClient(
-        account_url=f"https://{account_name}.file.core.windows.net",
+    share_service_client = get_client(
+        ShareServiceClient,
+        account_url=_account_url(account_name),
         credential=account_key
     )
     share_client = share_service_client.get_share_client(share_name)
-
-    # Ensure the share exists
-    try:
-        share_client.get_share_properties()
-    except Exception:
-        share_client.create_share()
+    file_client = share_client.get_file_client(os.path.basename(file_name or file_path))
+
+    upload_options = {}
+    if skip_if_unchanged:
+        from azure.core.exceptions import ResourceNotFoundError
+
+        content_md5 = compute_md5(file_path)
+        try:
+            existing_md5 = file_client.get_file_properties().content_settings.content_md5
+        except ResourceNotFoundError:
+            existing_md5 = None
+        if existing_md5 is not None and bytes(existing_md5) == content_md5:
+            print(f"File '{os.path.basename(file_path)}' is unchanged in share '{share_name}', skipping upload.")
+            return False
+        # The File service never computes a Content-MD5 itself
+        upload_options["content_settings"] = ContentSettings(content_md5=bytearray(content_md5))
 
     # Upload the file
-    file_client = share_client.get_file_client(os.path.basename(file_path))
-    with open(file_path, "rb") as file_data:
-        file_client.upload_file(file_data)
+    def upload():
+        with open(file_path, "rb") as file_data:
+            file_client.upload_file(file_data, max_concurrency=max_concurrency, **upload_options)
+
+    # The share is only checked the first time it is used by this process
+    run_with_ensured(_share_key(account_name, share_name), lambda: _create_share_with_sdk(share_client), upload)
     print(f"File '{os.path.basename(file_path)}' uploaded successfully to share '{share_name}'.")
+    return True
 
 
-def upload_file_with_http(file_path):
+@timed("upload")
+def upload_file_with_http(file_path, range_size=MAX_RANGE_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                          skip_if_unchanged=False, file_name=None):
     """
-    Uploads a file to Azure File Share using HTTP requests.
+    Uploads a file to Azure File Share using HTTP requests, as `file_name` (default: its base name).
+    The contents are written as ranges of at most `range_size` bytes by a pool of `max_concurrency`
+    workers, each reading only its own range from disk. With `skip_if_unchanged`, the upload is
+    skipped when the existing file has the same Content-MD5. Returns True when the file was uploaded.
     """
     account_name = get_env_variable("AZURE_STORAGE_ACCOUNT_NAME")
     account_key = get_env_variable("AZURE_STORAGE_ACCOUNT_KEY")
@@ -48,145 +95,166 @@ def upload_file_with_http(file_path):
     # Ensure the file exists
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"File not found: {file_path}")
+    if not 0 < range_size <= MAX_RANGE_SIZE or max_concurrency <= 0:
+        raise ValueError(f"range_size must be between 1 and {MAX_RANGE_SIZE} and max_concurrency positive.")
+
+    file_name = os.path.basename(file_name or file_path)
+    file_url = f"{_account_url(account_name)}/{share_name}/{file_name}"
+    md5_headers = {}
+    if skip_if_unchanged:
+        content_md5 = base64.b64encode(compute_md5(file_path)).decode()
+        if _get_content_md5_with_http(account_name, account_key, file_url) == content_md5:
+            print(f"File '{file_name}' is unchanged in share '{share_name}', skipping upload.")
+            return False
+        md5_headers["x-ms-content-md5"] = content_md5
+
+    file_size = os.path.getsize(file_path)
+    start_time = time.perf_counter()
+
+    def upload():
+        # Step 2: Create the file in the Azure File Share
+        create_file_headers = {
+            "x-ms-version": "2020-02-10",
+            "x-ms-date": datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT"),
+            "Content-Type": "application/octet-stream",
+            "x-ms-content-length": str(file_size),
+            "x-ms-type": "file",  # Required for file creation
+            "x-ms-file-permission": "inherit",  # Inherit permissions from the parent directory
+            "x-ms-file-attributes": "None",  # Default value
+            "x-ms-file-creation-time": "now",  # Creation time
+            "x-ms-file-last-write-time": "now",  # Last write time
+            **md5_headers,
+        }
+        create_file_headers["Authorization"] = get_signer(account_name, account_key).authorization_header(file_url, "PUT", create_file_headers)
+
+        response = get_http_session().put(file_url, headers=create_file_headers)
+        if response.status_code == 404:  # The share is gone
+            from requests import HTTPError
+
+            raise HTTPError(f"Error creating file: {response.text}", response=response)
+        if response.status_code != 201:
+            raise Exception(f"Error creating file: {response.text}")
+
+        # Step 3: Upload the file contents as concurrent range writes
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            # Consuming the iterator re-raises the first failed range write
+            list(executor.map(write_range, range(0, file_size, range_size)))
+
+    def write_range(offset):
+        length = min(range_size, file_size - offset)
+        upload_headers = {
+            "x-ms-version": "2020-02-10",
+            "x-ms-date": datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT"),
+            "Content-Type": "application/octet-stream",
+            "Content-Length": str(length),
+            "x-ms-write": "update",  # Required for writing ranges
+            "x-ms-range": f"bytes={offset}-{offset + length - 1}",  # Specify the range
+        }
+        upload_headers["Authorization"] = get_signer(account_name, account_key).authorization_header(
+            f"{file_url}?comp=range", "PUT", upload_headers
+        )
+        data = read_file_range(file_path, offset, length)
+        response = get_http_session().put(f"{file_url}?comp=range", headers=upload_headers, data=data)
+        if response.status_code not in [201, 202]:  # 201 = Created, 202 = Accepted
+            raise Exception(f"Error uploading file contents: {response.text}")
+
+    # Step 1: Create the share if it does not exist, once per process
+    run_with_ensured(
+        _share_key(account_name, share_name),
+        lambda: _create_share_with_http(account_name, account_key, share_name),
+        upload,
+    )
+
+    elapsed = time.perf_counter() - start_time
+    throughput = file_size / elapsed / (1024 * 1024) if elapsed > 0 else 0.0
+    print(f"File '{file_name}' uploaded successfully to share '{share_name}' ({throughput:.2f} MiB/s).")
+    return True
+
+
+def ensure_share():
+    """
+    Makes sure the configured share exists, remembering it for the rest of the process.
+    Call it at startup to take the check out of the first upload.
+    """
+    account_name = get_env_variable("AZURE_STORAGE_ACCOUNT_NAME")
+    account_key = get_env_variable("AZURE_STORAGE_ACCOUNT_KEY")
+    share_name = get_env_variable("AZURE_STORAGE_SHARE_NAME")
+
+    share_service_client = get_client(
+        ShareServiceClient,
+        account_url=_account_url(account_name),
+        credential=account_key
+    )
+    share_client = share_service_client.get_share_client(share_name)
+    ensure_once(_share_key(account_name, share_name), lambda: _create_share_with_sdk(share_client))
+
+
+def _share_key(account_name, share_name):
+    return ("share", _account_url(account_name), share_name)
+
+
+def _create_share_with_sdk(share_client):
+    """
+    Creates the share unless it already exists.
+    """
+    try:
+        share_client.get_share_properties()
+    except Exception:
+        share_client.create_share()
 
-    # Step 1: Create the share if it does not exist
-    share_url = f"https://{account_name}.file.core.windows.net/{share_name}?restype=share"
-    current_time_utc = datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
 
+def _create_share_with_http(account_name, account_key, share_name):
+    """
+    Creates the share, treating an existing share as success.
+    """
+    share_url = f"{_account_url(account_name)}/{share_name}?restype=share"
     headers = {
         "x-ms-version": "2020-02-10",
-        "x-ms-date": current_time_utc,
+        "x-ms-date": datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT"),
     }
-    headers["Authorization"] = _generate_authorization_header(account_name, account_key, share_url, "PUT", headers)
+    headers["Authorization"] = get_signer(account_name, account_key).authorization_header(share_url, "PUT", headers)
 
-    response = requests.put(share_url, headers=headers)
+    response = get_http_session().put(share_url, headers=headers)
     if response.status_code not in [201, 409]:  # 201 = Created, 409 = Conflict (already exists)
         raise Exception(f"Error creating share: {response.text}")
 
-    # Step 2: Create the file in the Azure File Share
-    file_name = os.path.basename(file_path)
-    file_url = f"https://{account_name}.file.core.windows.net/{share_name}/{file_name}"
-    file_size = os.path.getsize(file_path)
 
-    create_file_headers = {
+def _get_content_md5_with_http(account_name, account_key, file_url):
+    """
+    Returns the base64 Content-MD5 of an existing file from a single HEAD request, or None.
+    """
+    headers = {
         "x-ms-version": "2020-02-10",
-        "x-ms-date": current_time_utc,
-        "Content-Type": "application/octet-stream",
-        "x-ms-content-length": str(file_size),
-        "x-ms-type": "file",  # Required for file creation
-        "x-ms-file-permission": "inherit",  # Inherit permissions from the parent directory
-        "x-ms-file-attributes": "None",  # Default value
-        "x-ms-file-creation-time": "now",  # Creation time
-        "x-ms-file-last-write-time": "now",  # Last write time
+        "x-ms-date": datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT"),
     }
-    create_file_headers["Authorization"] = _generate_authorization_header(account_name, account_key, file_url, "PUT", create_file_headers)
+    headers["Authorization"] = get_signer(account_name, account_key).authorization_header(file_url, "HEAD", headers)
+    response = get_http_session().head(file_url, headers=headers)
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise Exception(f"Error reading file properties: {response.status_code}")
+    return response.headers.get("Content-MD5")
 
-    response = requests.put(file_url, headers=create_file_headers)
-    if response.status_code != 201:
-        raise Exception(f"Error creating file: {response.text}")
-
-    # Step 3: Upload the file contents in a single request
-    upload_headers = {
-        "x-ms-version": "2020-02-10",
-        "x-ms-date": current_time_utc,
-        "Content-Type": "application/octet-stream",
-        "Content-Length": str(file_size),
-        "x-ms-write": "update",  # Required for writing ranges
-        "x-ms-range": f"bytes=0-{file_size - 1}",  # Specify the range
-    }
-    upload_headers["Authorization"] = _generate_authorization_header(
-        account_name, account_key, f"{file_url}?comp=range", "PUT", upload_headers
-    )
 
-    with open(file_path, "rb") as file_data:
-        response = requests.put(f"{file_url}?comp=range", headers=upload_headers, data=file_data)
-        if response.status_code not in [201, 202]:  # 201 = Created, 202 = Accepted
-            raise Exception(f"Error uploading file contents: {response.text}")
-
-    print(f"File '{file_name}' uploaded successfully to share '{share_name}'.")
-
-
-def _generate_authorization_header(account_name, account_key, url, method, headers=None):
-    """
-    Generates the Authorization header for HTTP requests to Azure File Share.
-    """
-    import hmac
-    import hashlib
-    import base64
-    from urllib.parse import urlparse, parse_qs
-
-    if headers is None:
-        headers = {}
-
-    # Parse the URL
-    parsed_url = urlparse(url)
-    query = parse_qs(parsed_url.query)
-
-    # Build the string-to-sign
-    string_to_sign = f"{method}\n"  # HTTP method
-    string_to_sign += "\n"  # Content-Encoding
-    string_to_sign += "\n"  # Content-Language
-    string_to_sign += f"{headers.get('Content-Length', '')}\n"  # Content-Length
-    string_to_sign += "\n"  # Content-MD5
-    string_to_sign += f"{headers.get('Content-Type', '')}\n"  # Content-Type
-    string_to_sign += "\n"  # Date (use x-ms-date instead)
-    string_to_sign += "\n"  # If-Modified-Since
-    string_to_sign += "\n"  # If-Match
-    string_to_sign += "\n"  # If-None-Match
-    string_to_sign += "\n"  # If-Unmodified-Since
-    string_to_sign += "\n"  # Range
-
-    # Canonicalized headers
-    x_ms_headers = {k.lower(): v.strip() for k, v in headers.items() if k.lower().startswith("x-ms-")}
-    canonicalized_headers = "".join(f"{k}:{v}\n" for k, v in sorted(x_ms_headers.items()))
-    string_to_sign += canonicalized_headers
-
-    # Canonicalized resource
-    canonicalized_resource = f"/{account_name}{parsed_url.path}"
-    if query:
-        canonicalized_resource += "\n" + "\n".join(f"{k}:{','.join(query[k])}" for k in sorted(query))
-    string_to_sign += canonicalized_resource
-
-    # Compute the HMAC-SHA256 signature
-    signed_hmac_sha256 = hmac.new(
-        base64.b64decode(account_key),
-        string_to_sign.encode("utf-8"),
-        hashlib.sha256
-    )
-    signature = base64.b64encode(signed_hmac_sha256.digest()).decode()
-
-    return f"SharedKey {account_name}:{signature}"
+def generate_file_url(file_path):
+    """
+    Generates a read-only SAS URL for a file in Azure File Share, reusing the cached one while it is far from expiring.
+    """
+    file_url = generate_file_urls([file_path])[0]
+    print(f"Generated SAS URL: {file_url}")
+    return file_url
 
 
-def generate_file_url(file_path):
+@timed("sas")
+def generate_file_urls(file_paths):
     """
-    Generates a SAS URL for a file in Azure File Share using the SDK.
+    Generates read-only SAS URLs for many files at once, signing only the ones not cached yet
+    (or close to their expiry).
     """
     account_name = get_env_variable("AZURE_STORAGE_ACCOUNT_NAME")
     account_key = get_env_variable("AZURE_STORAGE_ACCOUNT_KEY")
     share_name = get_env_variable("AZURE_STORAGE_SHARE_NAME")
-
-    # Extract the file name from the provided file path
-    filename = os.path.basename(file_path)  # Get only the file name
-    file_segments = filename.split(os.sep)  # Split file name into segments (if necessary for Azure File Share)
-
-    # Configure start and expiry times in UTC
-    start_time = datetime.now(timezone.utc) - timedelta(hours=24)  # Start 24 hours earlier
-    expiry_time = datetime.now(timezone.utc) + timedelta(hours=24)  # Expire in 24 hours
-
-    # Generate the SAS token using the SDK
-    sas_token = generate_file_sas(
-        account_name=account_name,
-        share_name=share_name,
-        file_path=file_segments,  # Use the segments to build the file path for Azure File Share
-        account_key=account_key,
-        permission=FileSasPermissions(read=True),  # Grant read permission
-        start=start_time,
-        expiry=expiry_time
+    cache = get_sas_cache(
+        "file", account_name, account_key, _account_url(account_name), share_name, SAS_LIFETIME, SAS_START_SKEW
     )
-
-    # Construct the public URL with the SAS token
-    file_url = f"https://{account_name}.file.core.windows.net/{share_name}/{filename}?{sas_token}"
-    print(f"Generated SAS URL: {file_url}")
-    return file_url
-
+    return cache.urls([os.path.basename(file_path) for file_path in file_paths])
@@ -0,0 +1,113 @@
+from modules.metrics import record_http_response
+from modules.utils import load_environment
+import os
+import threading
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 32
+
+_lock = threading.RLock()
+_session = None
+_clients = {}
+
+
+def pool_setting(key, default):
+    """Reads an optional integer pool setting from the environment."""
+    load_environment()
+    value = os.getenv(key)
+    return int(value) if value else default
+
+
+def get_http_session():
+    """
+    Returns the process-wide requests session shared by the HTTP helpers and the SDK clients.
+    Connections are kept alive and pooled per host; pool sizes come from
+    AZURE_HTTP_POOL_CONNECTIONS and AZURE_HTTP_POOL_MAXSIZE when set.
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _build_session(
+                    pool_setting("AZURE_HTTP_POOL_CONNECTIONS", DEFAULT_POOL_CONNECTIONS),
+                    pool_setting("AZURE_HTTP_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE),
+                )
+    return _session
+
+
+def _build_session(pool_connections, pool_maxsize):
+    """Builds a requests session whose adapters keep a pool of reusable connections."""
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    import requests
+
+    session = requests.Session()
+    session.hooks["response"].append(record_http_response)
+    # Retries are left to the callers (the SDK pipelines have their own retry policy)
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=Retry(total=False, redirect=False, raise_on_status=False),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def configure_pool(pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE):
+    """
+    Replaces the shared session with one using the given pool sizes.
+    Clients built afterwards use the new pool; existing clients are dropped from the registry.
+    """
+    global _session
+    with _lock:
+        old_session = _session
+        _session = _build_session(pool_connections, pool_maxsize)
+        _clients.clear()
+    if old_session is not None:
+        old_session.close()
+
+
+def _freeze(value):
+    """Turns a client configuration value into something usable as a registry key."""
+    from azure.core.credentials import AzureKeyCredential
+
+    if isinstance(value, AzureKeyCredential):
+        return (AzureKeyCredential, value.key)
+    return value
+
+
+def client_key(client_class, config):
+    """Returns the registry key identifying a client class and its configuration."""
+    return (client_class, tuple(sorted((name, _freeze(value)) for name, value in config.items())))
+
+
+def get_client(client_class, **config):
+    """
+    Returns the shared `client_class` instance for the given configuration, building it on first use.
+    Every client built here sends its requests through the shared, pooled HTTP session.
+    `client_class` may be a LazyImport of the SDK class.
+    """
+    key = client_key(client_class, config)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                from azure.core.pipeline.transport import RequestsTransport
+
+                transport = RequestsTransport(session=get_http_session(), session_owner=False)
+                client = client_class(transport=transport, **config)
+                _clients[key] = client
+    return client
+
+
+def reset_clients():
+    """Drops every cached client and the shared session (mainly for tests and reconfiguration)."""
+    global _session
+    with _lock:
+        old_session = _session
+        _session = None
+        _clients.clear()
+    if old_session is not None:
+        old_session.close()
@@ -0,0 +1,184 @@
+from modules.insights import json_default
+from modules.utils import get_optional_env_variable
+import atexit
+import csv
+import json
+import os
+import re
+import threading
+import time
+
+try:
+    import orjson
+except ImportError:  # Optional: the standard json module is used instead
+    orjson = None
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+DEFAULT_COLUMNAR_BATCH_ROWS = 10000
+FIELD_SECTIONS = ("standard_fields", "custom_fields")
+
+_lock = threading.Lock()
+_exporter = None
+
+
+def dumps_line(value):
+    """Encodes a value as one UTF-8 JSON line, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(value, default=json_default, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(value, default=json_default, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def append_jsonl(path, records, buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Appends every record of an iterable (e.g. `iter_insight_events`) to a JSON Lines file through a
+    write buffer, holding one record at a time. Returns the number of records written.
+    """
+    count = 0
+    with open(path, "ab", buffering=buffer_size) as output:
+        for record in records:
+            output.write(dumps_line(record))
+            count += 1
+    return count
+
+
+def document_name(file_name, file_hash=None):
+    """Names a document in the exports after its file, plus the start of its content hash when known."""
+    name = os.path.basename(file_name)
+    return f"{name}-{file_hash[:12]}" if file_hash else name
+
+
+def _safe_name(value):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", value).strip("._") or "document"
+
+
+class InsightsExporter:
+    """
+    Appends the insights of analyzed documents to `output_dir`, for loading into a warehouse:
+
+    - insights.jsonl: one line per document with its name, any metadata and its insights;
+    - tables/<document>-table-<n>.csv: one CSV per extracted table, written once per document;
+    - with `columnar`, fields/part-<timestamp>-<pid>.parquet: the standard and custom fields as
+      document, section, name, value and confidence columns (requires pyarrow).
+
+    Files are only ever appended to or created, never rewritten; writes go through buffers that are
+    flushed on `flush` and `close`. The exporter is safe to share between threads.
+    """
+
+    def __init__(self, output_dir, tables=True, columnar=False, buffer_size=DEFAULT_BUFFER_SIZE,
+                 columnar_batch_rows=DEFAULT_COLUMNAR_BATCH_ROWS):
+        if columnar:
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise ImportError("Columnar export requires 'pyarrow'. Install it using 'pip install pyarrow'.")
+            self._pyarrow = pyarrow
+        self.output_dir = output_dir
+        self.tables = tables
+        self.columnar = columnar
+        self.columnar_batch_rows = columnar_batch_rows
+        self._lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+        self._jsonl = open(os.path.join(output_dir, "insights.jsonl"), "ab", buffering=buffer_size)
+        self._columns = {"document": [], "section": [], "name": [], "value": [], "confidence": []}
+        self._parquet = None
+
+    def write(self, document, insights, **metadata):
+        """
+        Exports one document's insights (an InvoiceInsights or its dictionary form). `document` names
+        the document in every output, e.g. its file name or content hash; `metadata` is added to its
+        JSON line.
+        """
+        data = insights.to_dict() if hasattr(insights, "to_dict") else insights
+        line = dumps_line({"document": document, **metadata, "insights": data})
+        with self._lock:
+            self._jsonl.write(line)
+            if self.tables:
+                self._write_tables(document, data.get("tables") or [])
+            if self.columnar:
+                self._append_fields(document, data)
+
+    def _write_tables(self, document, tables):
+        if not tables:
+            return
+        directory = os.path.join(self.output_dir, "tables")
+        os.makedirs(directory, exist_ok=True)
+        for index, table in enumerate(tables, start=1):
+            path = os.path.join(directory, f"{_safe_name(document)}-table-{index}.csv")
+            try:
+                # A document exported before keeps its files; nothing is overwritten
+                with open(path, "x", newline="", encoding="utf-8") as output:
+                    csv.writer(output).writerows(table.get("data") or [])
+            except FileExistsError:
+                pass
+
+    def _append_fields(self, document, data):
+        columns = self._columns
+        for section in FIELD_SECTIONS:
+            for name, field in (data.get(section) or {}).items():
+                columns["document"].append(document)
+                columns["section"].append(section)
+                columns["name"].append(name)
+                value = field.get("value")
+                columns["value"].append(value if value is None or isinstance(value, str) else str(value))
+                columns["confidence"].append(float(field.get("confidence") or 0))
+        if len(columns["document"]) >= self.columnar_batch_rows:
+            self._flush_fields()
+
+    def _flush_fields(self):
+        # Each batch becomes a row group of this run's part file
+        if not self.columnar or not self._columns["document"]:
+            return
+        pyarrow = self._pyarrow
+        table = pyarrow.table({
+            "document": pyarrow.array(self._columns["document"], pyarrow.string()),
+            "section": pyarrow.array(self._columns["section"], pyarrow.string()),
+            "name": pyarrow.array(self._columns["name"], pyarrow.string()),
+            "value": pyarrow.array(self._columns["value"], pyarrow.string()),
+            "confidence": pyarrow.array(self._columns["confidence"], pyarrow.float64()),
+        })
+        if self._parquet is None:
+            directory = os.path.join(self.output_dir, "fields")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.parquet")
+            self._parquet = pyarrow.parquet.ParquetWriter(path, table.schema)
+        self._parquet.write_table(table)
+        for values in self._columns.values():
+            values.clear()
+
+    def flush(self):
+        """Writes out everything buffered so far."""
+        with self._lock:
+            self._jsonl.flush()
+            self._flush_fields()
+
+    def close(self):
+        with self._lock:
+            self._flush_fields()
+            if self._parquet is not None:
+                self._parquet.close()
+                self._parquet = None
+            self._jsonl.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def get_exporter():
+    """
+    Returns the process-wide exporter writing to EXPORT_DIR (with EXPORT_COLUMNAR=1 for the columnar
+    field files), or None when EXPORT_DIR is not set.
+    """
+    global _exporter
+    output_dir = get_optional_env_variable("EXPORT_DIR")
+    if not output_dir:
+        return None
+    with _lock:
+        if _exporter is None:
+            columnar = get_optional_env_variable("EXPORT_COLUMNAR", "").lower() in ("1", "true", "yes")
+            _exporter = InsightsExporter(output_dir, columnar=columnar)
+            atexit.register(_exporter.close)
+        return _exporter
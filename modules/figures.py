@@ -0,0 +1,88 @@
+import mmap
+
+DEFAULT_DPI = 150
+POINTS_PER_INCH = 72
+
+
+def _load_dependencies():
+    try:
+        import fitz
+        import numpy
+    except ImportError:
+        raise ImportError("Figure cropping requires 'pymupdf' and 'numpy'. Install them using 'pip install pymupdf numpy'.")
+    return fitz, numpy
+
+
+def figure_boxes(polygons, scale, numpy):
+    """
+    Returns the bounding boxes of all polygons at once, as an (n, 4) array of x0, y0, x1, y1 scaled by
+    `scale` and rounded outwards. Polygons are lists of (x, y) points; shorter ones are padded with NaN.
+    """
+    longest = max(len(polygon) for polygon in polygons)
+    points = numpy.full((len(polygons), longest, 2), numpy.nan)
+    for index, polygon in enumerate(polygons):
+        points[index, :len(polygon)] = [tuple(point)[:2] for point in polygon]
+    points *= scale
+    return numpy.concatenate([
+        numpy.floor(numpy.nanmin(points, axis=1)), numpy.ceil(numpy.nanmax(points, axis=1))
+    ], axis=1).astype(numpy.int64)
+
+
+def crop_figures(source, figures, dpi=DEFAULT_DPI):
+    """
+    Crops figures out of a PDF given as a file path (memory-mapped, opened once) or as bytes.
+    `figures` are (page number, polygon) pairs with polygons in inches, as Document Intelligence
+    reports them for PDFs. Only the part of each page covered by its figures is rasterized, at `dpi`,
+    and all the figures of a page are cut from that one raster. Returns the PNG bytes of every
+    figure, in order, or None for figures without a page or polygon. Requires PyMuPDF and numpy.
+    """
+    fitz, numpy = _load_dependencies()
+    results = [None] * len(figures)
+    by_page = {}
+    for index, (page_number, polygon) in enumerate(figures):
+        if page_number and polygon:
+            by_page.setdefault(page_number, []).append(index)
+    if not by_page:
+        return results
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        with fitz.open(stream=bytes(source), filetype="pdf") as document:
+            _crop_pages(fitz, numpy, document, figures, by_page, dpi, results)
+        return results
+
+    with open(source, "rb") as file_data, mmap.mmap(file_data.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)
+        try:
+            with fitz.open(stream=view, filetype="pdf") as document:
+                _crop_pages(fitz, numpy, document, figures, by_page, dpi, results)
+        finally:
+            # The map cannot close while a view of it is still exported
+            view.release()
+    return results
+
+
+def _crop_pages(fitz, numpy, document, figures, by_page, dpi, results):
+    for page_number, indexes in sorted(by_page.items()):
+        if page_number > document.page_count:
+            continue
+        page = document[page_number - 1]
+        boxes = figure_boxes([figures[index][1] for index in indexes], dpi, numpy)
+
+        # Rasterize only the area covering this page's figures
+        scale = dpi / POINTS_PER_INCH
+        area = fitz.Rect(*(boxes[:, :2].min(axis=0) / scale), *(boxes[:, 2:].max(axis=0) / scale)) & page.rect
+        if area.is_empty:
+            continue
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(scale, scale), clip=area, alpha=False)
+        pixels = numpy.frombuffer(pixmap.samples_mv, dtype=numpy.uint8).reshape(
+            pixmap.height, pixmap.width, pixmap.n
+        )
+
+        # Move every box into the raster's coordinates and keep it inside, in one step
+        boxes -= [pixmap.x, pixmap.y, pixmap.x, pixmap.y]
+        numpy.clip(boxes, 0, [pixmap.width, pixmap.height, pixmap.width, pixmap.height], out=boxes)
+        for index, (x0, y0, x1, y1) in zip(indexes, boxes.tolist()):
+            if x1 <= x0 or y1 <= y0:
+                continue
+            crop = numpy.ascontiguousarray(pixels[y0:y1, x0:x1])
+            results[index] = fitz.Pixmap(pixmap.colorspace, x1 - x0, y1 - y0, crop.tobytes(), False).tobytes("png")
@@ -0,0 +1,416 @@
+from array import array
+from collections.abc import Mapping
+import math
+
+SECTIONS = ("standard_fields", "custom_fields", "tables", "images", "barcodes")
+
+
+def fill_table_grid(row_count, column_count, cells, columnar=False):
+    """
+    Places (row, column, row span, column span, content) cells into a preallocated grid in a single pass.
+    A cell spanning several rows or columns fills every position it covers. Returns a list of rows,
+    or a list per column when `columnar` is True.
+    """
+    if columnar:
+        grid = [[""] * row_count for _ in range(column_count)]
+    else:
+        grid = [[""] * column_count for _ in range(row_count)]
+
+    for row_index, column_index, row_span, column_span, content in cells:
+        if row_span == 1 and column_span == 1:
+            if columnar:
+                grid[column_index][row_index] = content
+            else:
+                grid[row_index][column_index] = content
+            continue
+
+        row_end = min(row_index + row_span, row_count)
+        column_end = min(column_index + column_span, column_count)
+        for row in range(row_index, row_end):
+            for column in range(column_index, column_end):
+                if columnar:
+                    grid[column][row] = content
+                else:
+                    grid[row][column] = content
+    return grid
+
+
+def build_table_grid(table, columnar=False):
+    """
+    Places the cells of an analyzed table into a preallocated grid in a single pass over `table.cells`.
+    A cell spanning several rows or columns fills every position it covers. Returns a list of rows,
+    or a list per column when `columnar` is True.
+    """
+    cells = (
+        (cell.row_index, cell.column_index, getattr(cell, "row_span", None) or 1,
+         getattr(cell, "column_span", None) or 1, cell.content)
+        for cell in table.cells
+    )
+    return fill_table_grid(table.row_count, table.column_count, cells, columnar)
+
+
+class _Polygons:
+    """Polygons kept as one flat array of coordinates; a negative length marks a missing polygon."""
+
+    __slots__ = ("coordinates", "starts", "lengths")
+
+    def __init__(self):
+        self.coordinates = array("d")
+        self.starts = array("q")
+        self.lengths = array("l")
+
+    def append(self, polygon):
+        self.starts.append(len(self.coordinates))
+        if polygon is None:
+            self.lengths.append(-1)
+            return
+        for point in polygon:
+            self.coordinates.append(point.x)
+            self.coordinates.append(point.y)
+        self.lengths.append((len(self.coordinates) - self.starts[-1]) // 2)
+
+    def __getitem__(self, index):
+        # Polygons only come from analysis results, so the SDK is loaded by now
+        from azure.ai.formrecognizer import Point
+
+        length = self.lengths[index]
+        if length < 0:
+            return None
+        start = self.starts[index]
+        coordinates = self.coordinates
+        return [Point(x=coordinates[start + 2 * point], y=coordinates[start + 2 * point + 1]) for point in range(length)]
+
+
+class _Confidences:
+    """
+    Confidences kept as an array of doubles. The few that are not floats (a missing confidence, or the
+    integer 0 used when there is none) are stored as NaN and kept as they are on the side, so they
+    come back unchanged instead of as a real 0.0.
+    """
+
+    __slots__ = ("values", "others")
+
+    def __init__(self):
+        self.values = array("d")
+        self.others = {}
+
+    def append(self, confidence):
+        if type(confidence) is not float:
+            self.others[len(self.values)] = confidence
+            confidence = math.nan
+        self.values.append(confidence)
+
+    def __getitem__(self, index):
+        value = self.values[index]
+        return self.others.get(index, value) if value != value else value
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self.values)))
+
+    def __len__(self):
+        return len(self.values)
+
+
+class _Fields:
+    """Named values with their confidence and bounding polygon, one column per attribute."""
+
+    __slots__ = ("names", "values", "confidences", "polygons")
+
+    def __init__(self):
+        self.names = []
+        self.values = []
+        self.confidences = _Confidences()
+        self.polygons = _Polygons()
+
+    def append(self, name, value, confidence, polygon):
+        self.names.append(name)
+        self.values.append(value)
+        self.confidences.append(confidence)
+        self.polygons.append(polygon)
+
+    def to_dict(self):
+        # Later duplicates of a name replace earlier ones, as they did in the nested dictionaries
+        return {
+            name: {"value": self.values[index], "confidence": self.confidences[index],
+                   "bounding_box": self.polygons[index]}
+            for index, name in enumerate(self.names)
+        }
+
+
+class _Table:
+    """An analyzed table as columns of cell coordinates and contents; the grid is built on demand."""
+
+    __slots__ = ("row_count", "column_count", "rows", "columns", "row_spans", "column_spans", "contents")
+
+    def __init__(self, table):
+        self.row_count = table.row_count
+        self.column_count = table.column_count
+        self.rows, self.columns = array("l"), array("l")
+        self.row_spans, self.column_spans = array("l"), array("l")
+        self.contents = []
+        for cell in table.cells:
+            self.rows.append(cell.row_index)
+            self.columns.append(cell.column_index)
+            self.row_spans.append(getattr(cell, "row_span", None) or 1)
+            self.column_spans.append(getattr(cell, "column_span", None) or 1)
+            self.contents.append(cell.content)
+
+    def grid(self, columnar=False):
+        cells = zip(self.rows, self.columns, self.row_spans, self.column_spans, self.contents)
+        return fill_table_grid(self.row_count, self.column_count, cells, columnar)
+
+
+class InvoiceInsights(Mapping):
+    """
+    Insights of an analyzed document in a compact form: fields, barcodes and figures are stored as
+    columns with array-backed confidences and polygons, and tables as arrays of cell positions.
+    Each section ("standard_fields", "custom_fields", "tables", "images", "barcodes") is only built
+    into today's dictionaries and lists the first time it is accessed, by key or attribute, and the
+    built section is kept for later accesses; `to_dict()` builds them all. The analysis result is not
+    referenced once the insights are extracted.
+    """
+
+    __slots__ = ("_standard_fields", "_custom_fields", "_tables", "_columnar_tables", "_figure_captions",
+                 "_figure_polygons", "_figure_pages", "_barcode_kinds", "_barcode_values", "_barcode_confidences",
+                 "_built")
+
+    def __init__(self, columnar_tables=False):
+        self._standard_fields = _Fields()
+        self._custom_fields = _Fields()
+        self._tables = []
+        self._columnar_tables = columnar_tables
+        self._figure_captions = []
+        self._figure_polygons = _Polygons()
+        self._figure_pages = array("l")  # 0 when the page is unknown
+        self._barcode_kinds = []
+        self._barcode_values = []
+        self._barcode_confidences = _Confidences()
+        # Sections built so far, created on the first access
+        self._built = None
+
+    @classmethod
+    def from_analysis_result(cls, analysis_result, columnar_tables=False):
+        """Extracts the insights of an AnalyzeResult in a single pass."""
+        insights = cls(columnar_tables)
+
+        # Standard fields from keyValuePairs
+        if hasattr(analysis_result, "key_value_pairs"):
+            for pair in analysis_result.key_value_pairs:
+                insights._standard_fields.append(
+                    pair.key.content if pair.key else "No key",
+                    pair.value.content if pair.value else "No value",
+                    pair.confidence if pair.confidence else 0,
+                    pair.key.bounding_regions[0].polygon if pair.key and pair.key.bounding_regions else None,
+                )
+
+        # Custom fields from documents
+        if hasattr(analysis_result, "documents"):
+            for document in analysis_result.documents:
+                if hasattr(document, "fields"):
+                    for field_name, field in document.fields.items():
+                        insights._custom_fields.append(
+                            field_name,
+                            field.value_string if hasattr(field, "value_string") else field.content,
+                            field.confidence if hasattr(field, "confidence") else 0,
+                            field.bounding_regions[0].polygon if field.bounding_regions else None,
+                        )
+
+        if hasattr(analysis_result, "tables"):
+            insights._tables = [_Table(table) for table in analysis_result.tables]
+
+        # Images (figures)
+        if hasattr(analysis_result, "figures"):
+            for figure in analysis_result.figures:
+                insights._figure_captions.append(figure.caption if hasattr(figure, "caption") else "No caption")
+                insights._figure_polygons.append(figure.bounding_regions[0].polygon if figure.bounding_regions else None)
+                insights._figure_pages.append(_page_number(figure) or 0)
+
+        # Barcodes are reported on the pages they are found on; results listing them at the top are read too
+        page_barcodes = (barcode for page in getattr(analysis_result, "pages", None) or []
+                         for barcode in getattr(page, "barcodes", None) or [])
+        for barcodes in (page_barcodes, getattr(analysis_result, "barcodes", None) or []):
+            for barcode in barcodes:
+                insights._barcode_kinds.append(barcode.kind if hasattr(barcode, "kind") else "Unknown")
+                insights._barcode_values.append(barcode.value if hasattr(barcode, "value") else "No value")
+                insights._barcode_confidences.append(barcode.confidence if hasattr(barcode, "confidence") else 0)
+        return insights
+
+    def _section(self, section, build):
+        built = self._built
+        if built is None:
+            built = self._built = {}
+        value = built.get(section)
+        if value is None:
+            value = built[section] = build()
+        return value
+
+    @property
+    def standard_fields(self):
+        return self._section("standard_fields", self._standard_fields.to_dict)
+
+    @property
+    def custom_fields(self):
+        return self._section("custom_fields", self._custom_fields.to_dict)
+
+    @property
+    def tables(self):
+        return self._section("tables", self._build_tables)
+
+    @property
+    def images(self):
+        return self._section("images", self._build_images)
+
+    @property
+    def barcodes(self):
+        return self._section("barcodes", self._build_barcodes)
+
+    def _build_tables(self):
+        tables = []
+        for table in self._tables:
+            entry = {"row_count": table.row_count, "column_count": table.column_count, "data": table.grid()}
+            if self._columnar_tables:
+                entry["columns"] = table.grid(columnar=True)
+            tables.append(entry)
+        return tables
+
+    def _build_images(self):
+        return [
+            {"caption": caption, "bounding_box": self._figure_polygons[index], "page": self._figure_pages[index] or None}
+            for index, caption in enumerate(self._figure_captions)
+        ]
+
+    def _build_barcodes(self):
+        return [
+            {"type": kind, "value": value, "confidence": confidence}
+            for kind, value, confidence in zip(self._barcode_kinds, self._barcode_values, self._barcode_confidences)
+        ]
+
+    def __getitem__(self, section):
+        if section not in SECTIONS:
+            raise KeyError(section)
+        return getattr(self, section)
+
+    def __contains__(self, section):
+        return section in SECTIONS
+
+    def __iter__(self):
+        return iter(SECTIONS)
+
+    def __len__(self):
+        return len(SECTIONS)
+
+    def to_dict(self):
+        """Returns the insights as the nested dictionaries and lists `extract_invoice_insights` used to build."""
+        return {section: getattr(self, section) for section in SECTIONS}
+
+
+def _page_number(element):
+    """Returns the page of an element's first bounding region, or None."""
+    regions = getattr(element, "bounding_regions", None) if element is not None else None
+    return regions[0].page_number if regions else None
+
+
+def _standard_field_event(pair, page):
+    return {
+        "event": "standard_field", "page": page,
+        "key": pair.key.content if pair.key else "No key",
+        "value": pair.value.content if pair.value else "No value",
+        "confidence": pair.confidence if pair.confidence else 0,
+        "bounding_box": pair.key.bounding_regions[0].polygon if pair.key and pair.key.bounding_regions else None,
+    }
+
+
+def _custom_field_event(named_field, page):
+    name, field = named_field
+    return {
+        "event": "custom_field", "page": page, "name": name,
+        "value": field.value_string if hasattr(field, "value_string") else field.content,
+        "confidence": field.confidence if hasattr(field, "confidence") else 0,
+        "bounding_box": field.bounding_regions[0].polygon if field.bounding_regions else None,
+    }
+
+
+def _image_event(figure, page):
+    return {
+        "event": "image", "page": page,
+        "caption": figure.caption if hasattr(figure, "caption") else "No caption",
+        "bounding_box": figure.bounding_regions[0].polygon if figure.bounding_regions else None,
+    }
+
+
+def _barcode_event(barcode, page):
+    return {
+        "event": "barcode", "page": page,
+        "type": barcode.kind if hasattr(barcode, "kind") else "Unknown",
+        "value": barcode.value if hasattr(barcode, "value") else "No value",
+        "confidence": barcode.confidence if hasattr(barcode, "confidence") else 0,
+    }
+
+
+def _table_events(numbered_table, page):
+    index, table = numbered_table
+    yield {"event": "table", "page": page, "table": index, "row_count": table.row_count,
+           "column_count": table.column_count}
+    # A row belongs to the first page any of its cells is on; rows of a table spanning pages say so
+    row_pages = [None] * table.row_count
+    for cell in table.cells:
+        cell_page = _page_number(cell)
+        if cell_page is not None and cell.row_index < table.row_count:
+            current = row_pages[cell.row_index]
+            row_pages[cell.row_index] = cell_page if current is None else min(current, cell_page)
+    for row_index, cells in enumerate(build_table_grid(table)):
+        row_page = row_pages[row_index]
+        yield {"event": "table_row", "page": page if row_page is None else row_page, "table": index,
+               "row": row_index, "cells": cells}
+
+
+def iter_insight_events(analysis_result):
+    """
+    Yields the insights of an analysis one at a time, page by page, as dicts tagged with an "event"
+    ("standard_field", "custom_field", "table" followed by its "table_row"s, "image" or "barcode")
+    and the "page" they are on. The other keys match the entries of the corresponding section of
+    `InvoiceInsights.to_dict()`. Within a page, events follow that section order; elements without
+    a bounding region come last with a page of None. Collected, the events hold the same entries as
+    `to_dict()`, with each table's "data" split into its rows.
+
+    Only the positions of the elements are indexed up front, so consumers can print, stream or write
+    each event as it comes without holding the whole set of insights.
+    """
+    by_page = {}
+
+    def add(element_page, build, element):
+        by_page.setdefault(element_page, []).append((build, element))
+
+    for pair in getattr(analysis_result, "key_value_pairs", None) or []:
+        add(_page_number(pair.key) or _page_number(pair.value), _standard_field_event, pair)
+    for document in getattr(analysis_result, "documents", None) or []:
+        for named_field in (getattr(document, "fields", None) or {}).items():
+            add(_page_number(named_field[1]), _custom_field_event, named_field)
+    for numbered_table in enumerate(getattr(analysis_result, "tables", None) or []):
+        add(_page_number(numbered_table[1]), _table_events, numbered_table)
+    for figure in getattr(analysis_result, "figures", None) or []:
+        add(_page_number(figure), _image_event, figure)
+    for page in getattr(analysis_result, "pages", None) or []:
+        for barcode in getattr(page, "barcodes", None) or []:
+            add(page.page_number, _barcode_event, barcode)
+    for barcode in getattr(analysis_result, "barcodes", None) or []:
+        add(_page_number(barcode), _barcode_event, barcode)
+
+    for page in sorted(number for number in by_page if number is not None) + [None]:
+        for build, element in by_page.pop(page, []):
+            if build is _table_events:
+                yield from build(element, page)
+            else:
+                yield build(element, page)
+
+
+def json_default(value):
+    """
+    `default` hook for json.dumps (and orjson) writing insights in their dictionary form, points and
+    other tuples as lists, and anything else as str().
+    """
+    if isinstance(value, InvoiceInsights):
+        return value.to_dict()
+    if isinstance(value, tuple):
+        return list(value)
+    return str(value)
@@ -0,0 +1,327 @@
+from modules.insights import json_default
+from modules.utils import get_optional_env_variable
+import json
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+DEFAULT_JOB_WORKERS = 4
+DEFAULT_MAX_PENDING_JOBS = 100
+DEFAULT_JOB_STORE_PATH = os.path.join(".cache", "jobs.sqlite")
+DEFAULT_JOB_TTL_SECONDS = 24 * 60 * 60
+# How long a claimed job belongs to its worker; after that another process may run it again
+DEFAULT_JOB_LEASE_SECONDS = 15 * 60
+# Finished jobs are expired, and jobs left behind by dead workers queued again, at most this often
+PURGE_INTERVAL_SECONDS = 60
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue already holds its maximum of pending jobs."""
+
+
+class InMemoryJobStore:
+    """Keeps jobs in a dictionary; they are lost when the process exits."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id, payload):
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = {
+                "id": job_id, "status": QUEUED, "payload": payload, "result": None, "error": None,
+                "created_at": now, "updated_at": now, "worker_id": None, "lease_until": None,
+            }
+
+    def claim(self, job_id, worker_id, lease_seconds):
+        """
+        Marks a queued job, or a running one whose lease has expired, as running for `worker_id`.
+        Returns False when the job is finished, gone or held by another worker.
+        """
+        now = time.time()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not (job["status"] == QUEUED or (job["status"] == RUNNING and job["lease_until"] < now)):
+                return False
+            job.update(status=RUNNING, worker_id=worker_id, lease_until=now + lease_seconds, updated_at=now)
+            return True
+
+    def update(self, job_id, status, result=None, error=None, payload=None):
+        """Records a job's status, result and error; `payload`, when given, replaces the stored one."""
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(status=status, result=result, error=error, updated_at=time.time())
+            if payload is not None:
+                job["payload"] = payload
+
+    def purge(self, before):
+        """Deletes the done and failed jobs last updated before the `before` timestamp; returns how many."""
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job["status"] in (DONE, FAILED) and job["updated_at"] < before
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def unfinished(self):
+        """Returns the jobs that were queued or running, oldest first."""
+        with self._lock:
+            jobs = [dict(job) for job in self._jobs.values() if job["status"] in (QUEUED, RUNNING)]
+        return sorted(jobs, key=lambda job: job["created_at"])
+
+
+_JOB_COLUMNS = "id, status, payload, result, error, created_at, updated_at, worker_id, lease_until"
+
+
+class SQLiteJobStore:
+    """
+    Keeps jobs in SQLite so that queued and running jobs survive a restart. Several processes may share
+    the database: each job is claimed atomically, so only one of them runs it.
+    """
+
+    def __init__(self, path=DEFAULT_JOB_STORE_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            if path != ":memory:":
+                self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, result TEXT, error TEXT, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL, worker_id TEXT, lease_until REAL)"
+            )
+            # Stores created before jobs were claimed lack the lease columns
+            columns = {row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (("worker_id", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    self._connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_status_updated ON jobs (status, updated_at)")
+            self._connection.commit()
+
+    def create(self, job_id, payload):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO jobs (id, status, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(payload), now, now),
+            )
+            self._connection.commit()
+
+    def claim(self, job_id, worker_id, lease_seconds):
+        """
+        Marks a queued job, or a running one whose lease has expired, as running for `worker_id`, in one
+        UPDATE so that two processes never both claim it. Returns False when another worker holds it or
+        it is finished or gone.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._connection.execute(
+                "UPDATE jobs SET status = ?, worker_id = ?, lease_until = ?, updated_at = ? WHERE id = ? AND "
+                "(status = ? OR (status = ? AND (lease_until IS NULL OR lease_until < ?)))",
+                (RUNNING, worker_id, now + lease_seconds, now, job_id, QUEUED, RUNNING, now),
+            )
+            self._connection.commit()
+        return cursor.rowcount == 1
+
+    def update(self, job_id, status, result=None, error=None, payload=None):
+        """Records a job's status, result and error; `payload`, when given, replaces the stored one."""
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ?, payload = COALESCE(?, payload) "
+                "WHERE id = ?",
+                (status, json.dumps(result, default=json_default) if result is not None else None, error, time.time(),
+                 json.dumps(payload) if payload is not None else None, job_id),
+            )
+            self._connection.commit()
+
+    def purge(self, before):
+        """Deletes the done and failed jobs last updated before the `before` timestamp; returns how many."""
+        with self._lock:
+            cursor = self._connection.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (DONE, FAILED, before)
+            )
+            self._connection.commit()
+        return cursor.rowcount
+
+    def _row_to_job(self, row):
+        return {
+            "id": row[0], "status": row[1], "payload": json.loads(row[2]),
+            "result": json.loads(row[3]) if row[3] is not None else None, "error": row[4],
+            "created_at": row[5], "updated_at": row[6], "worker_id": row[7], "lease_until": row[8],
+        }
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def unfinished(self):
+        """Returns the jobs that were queued or running, oldest first."""
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT {_JOB_COLUMNS} FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+
+class JobQueue:
+    """
+    Runs `handler(payload)` for submitted jobs on a bounded pool of worker threads, once `start` is called.
+    At most `max_pending` jobs may wait at once; the job's status, result and error are kept in `store`.
+    Jobs left unfinished in the store by a previous process are queued again; a worker claims each job
+    in the store before running it, so when several processes share a store every job runs once, and
+    a job whose worker died is run again after `lease_seconds`: the workers look for such jobs in the
+    store every PURGE_INTERVAL_SECONDS, also while they are idle. Finished jobs are deleted from the
+    store `ttl_seconds` after they finish (never when it is None). The payload fields named in
+    `transient_fields` (e.g. a document sent along with the job) are dropped from the store once the
+    job finishes, so only the rest of the payload is kept with its result.
+    """
+
+    def __init__(self, handler, store=None, workers=DEFAULT_JOB_WORKERS, max_pending=DEFAULT_MAX_PENDING_JOBS,
+                 ttl_seconds=DEFAULT_JOB_TTL_SECONDS, lease_seconds=DEFAULT_JOB_LEASE_SECONDS, transient_fields=()):
+        self.handler = handler
+        self.transient_fields = frozenset(transient_fields)
+        self.store = store if store is not None else InMemoryJobStore()
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._last_purge = 0.0
+        self._state_lock = threading.Lock()
+        self._started = False
+        # Ids of the jobs waiting in this process's queue
+        self._queued = set()
+        # Resumed jobs must always fit, whatever the configured limit
+        unfinished = self.store.unfinished()
+        self._queue = queue.Queue(maxsize=max(max_pending, len(unfinished)))
+        for job in unfinished:
+            self._enqueue(job["id"], job["payload"])
+        self._threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True) for index in range(workers)
+        ]
+
+    def start(self):
+        """Starts the worker threads (once); returns the queue."""
+        with self._state_lock:
+            started, self._started = self._started, True
+        if not started:
+            for thread in self._threads:
+                thread.start()
+        return self
+
+    def submit(self, payload):
+        """Queues a job and returns its id right away; raises QueueFullError when the queue is full."""
+        self._maintain()
+        job_id = uuid.uuid4().hex
+        self.store.create(job_id, payload)
+        try:
+            self._enqueue(job_id, payload)
+        except queue.Full:
+            self.store.update(job_id, FAILED, error="Job queue is full.", payload=self._kept(payload))
+            raise QueueFullError("Too many documents are waiting for analysis, please try again later.")
+        return job_id
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def _kept(self, payload):
+        """The part of a payload stored with a finished job, or None to keep it all."""
+        if not self.transient_fields.intersection(payload):
+            return None
+        return {key: value for key, value in payload.items() if key not in self.transient_fields}
+
+    def _enqueue(self, job_id, payload):
+        """Queues a job unless it is already waiting here; raises queue.Full when the queue is full."""
+        with self._state_lock:
+            if job_id in self._queued:
+                return
+            self._queue.put_nowait((job_id, payload))
+            self._queued.add(job_id)
+
+    def _maintain(self):
+        """
+        Deletes the expired finished jobs and queues again the jobs other workers left behind, at most
+        every PURGE_INTERVAL_SECONDS: jobs running past their lease, and jobs queued for longer than
+        a lease, whose process is probably gone (a claim keeps them from running twice).
+        """
+        now = time.time()
+        with self._state_lock:
+            if now - self._last_purge < PURGE_INTERVAL_SECONDS:
+                return
+            self._last_purge = now
+        if self.ttl_seconds is not None:
+            self.store.purge(now - self.ttl_seconds)
+        for job in self.store.unfinished():
+            expires = (job["lease_until"] or 0) if job["status"] == RUNNING else job["updated_at"] + self.lease_seconds
+            if expires < now:
+                try:
+                    self._enqueue(job["id"], job["payload"])
+                except queue.Full:
+                    break
+
+    def _work(self):
+        while True:
+            try:
+                job_id, payload = self._queue.get(timeout=PURGE_INTERVAL_SECONDS)
+            except queue.Empty:
+                job_id = None
+            if job_id is not None:
+                with self._state_lock:
+                    self._queued.discard(job_id)
+                try:
+                    self._run(job_id, payload)
+                except Exception as e:
+                    # A store error (e.g. a locked database) must not end the worker; a job it left
+                    # claimed is run again once its lease expires
+                    print(f"Warning: job {job_id} could not be recorded in the job store: {e}")
+                finally:
+                    self._queue.task_done()
+            try:
+                self._maintain()
+            except Exception as e:
+                print(f"Warning: the job store could not be checked for abandoned jobs: {e}")
+
+    def _run(self, job_id, payload):
+        # Another process sharing the store may already have taken the job
+        if not self.store.claim(job_id, self.worker_id, self.lease_seconds):
+            return
+        try:
+            self.store.update(job_id, DONE, result=self.handler(payload), payload=self._kept(payload))
+        except Exception as e:
+            self.store.update(job_id, FAILED, error=str(e), payload=self._kept(payload))
+
+    def join(self):
+        """Blocks until every queued job has been processed (mainly for tests)."""
+        self._queue.join()
+
+
+def get_job_store():
+    """
+    Builds the job store selected by JOB_STORE ("memory", the default, or "sqlite" at JOB_STORE_PATH).
+    """
+    backend = get_optional_env_variable("JOB_STORE", "memory").lower()
+    if backend == "memory":
+        return InMemoryJobStore()
+    if backend == "sqlite":
+        return SQLiteJobStore(get_optional_env_variable("JOB_STORE_PATH", DEFAULT_JOB_STORE_PATH))
+    raise ValueError(f"Unknown job store: {backend}")
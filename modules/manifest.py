@@ -0,0 +1,112 @@
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_MANIFEST_PATH = os.path.join(".cache", "manifest.sqlite")
+# Statuses of documents that a later run does not need to process again while they are unchanged
+COMPLETED_STATUSES = ("analyzed", "cached")
+
+
+class BatchManifest:
+    """
+    Records the progress of batch runs in SQLite: for every document, its path, size, modification
+    time, content hash, blob name, model id, final status and where its result line was written.
+    Each document is recorded in its own transaction as it finishes, so an interrupted run leaves a
+    consistent manifest behind and the next run can resume from it.
+    """
+
+    def __init__(self, path=DEFAULT_MANIFEST_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        # Stat of each planned document, taken before it is hashed and recorded once it finishes
+        self._planned = {}
+        with self._lock:
+            if path != ":memory:":
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, file_hash TEXT, "
+                "blob_name TEXT, model_id TEXT NOT NULL, status TEXT NOT NULL, output_path TEXT, "
+                "output_offset INTEGER, error TEXT, updated_at REAL NOT NULL)"
+            )
+            self._connection.commit()
+
+    def plan(self, file_paths, model_id):
+        """
+        Compares the files with the manifest using only their size and modification time, without
+        reading them. Returns (items to process, number of unchanged documents skipped): new, changed
+        and unfinished documents are processed, and the ones whose stat still matches keep their
+        recorded content hash instead of being hashed again.
+        """
+        with self._lock:
+            known = {
+                row[0]: row[1:]
+                for row in self._connection.execute(
+                    "SELECT path, size, mtime_ns, file_hash, model_id, status FROM documents"
+                )
+            }
+
+        items = []
+        unchanged = 0
+        for file_path in file_paths:
+            path = os.path.abspath(file_path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Reported as a read failure by the pipeline
+                items.append({"file": file_path})
+                continue
+            item = {"file": file_path}
+            entry = known.get(path)
+            if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+                if entry[3] == model_id and entry[4] in COMPLETED_STATUSES:
+                    unchanged += 1
+                    continue
+                if entry[2]:
+                    item["file_hash"] = entry[2]
+            self._planned[path] = (stat.st_size, stat.st_mtime_ns)
+            items.append(item)
+        return items, unchanged
+
+    def record(self, item, output_path=None, output_offset=None):
+        """Records a finished document (a pipeline result) and where its result line was written."""
+        path = os.path.abspath(item["file"])
+        stat = self._planned.pop(path, None)
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return
+            stat = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO documents (path, size, mtime_ns, file_hash, blob_name, model_id, status, "
+                "output_path, output_offset, error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, stat[0], stat[1], item.get("file_hash"), item.get("blob_name"), item["model_id"], item["status"],
+                 output_path, output_offset, item.get("error"), time.time()),
+            )
+            self._connection.commit()
+
+    def get(self, file_path):
+        """Returns the manifest entry of a document as a dictionary, or None when it was never recorded."""
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT * FROM documents WHERE path = ?", (os.path.abspath(file_path),)
+            )
+            row = cursor.fetchone()
+            columns = [description[0] for description in cursor.description]
+        return dict(zip(columns, row)) if row else None
+
+    def counts(self):
+        """Returns the number of recorded documents per status."""
+        with self._lock:
+            return dict(self._connection.execute("SELECT status, COUNT(*) FROM documents GROUP BY status"))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,188 @@
+from modules.utils import get_optional_env_variable
+import functools
+import threading
+import time
+
+METRICS_PREFIX = "docanalyzer"
+# Upper bounds (seconds) of the stage duration histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Status codes the HTTP helpers, the scheduler and the SDK pipelines retry
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+_enabled = None  # Read from METRICS_ENABLED on first use
+_lock = threading.Lock()
+_stages = {}  # stage -> [count, total seconds, max seconds, bucket counts]
+_counters = {}  # (name, labels) -> value
+
+
+def metrics_enabled():
+    global _enabled
+    if _enabled is None:
+        _enabled = get_optional_env_variable("METRICS_ENABLED", "").lower() in ("1", "true", "yes")
+    return _enabled
+
+
+def enable_metrics(enabled=True):
+    """
+    Turns collection on or off for the whole process, overriding METRICS_ENABLED, which is otherwise
+    read the first time `metrics_enabled()` is called.
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def reset_metrics():
+    """Forgets every recorded timing and counter (mainly for tests)."""
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+
+class _NullSpan:
+    """The span handed out while metrics are disabled: entering and leaving it does nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+def span(stage):
+    """Returns a context manager timing the block it wraps as `stage`; a shared no-op when disabled."""
+    return _Span(stage) if metrics_enabled() else _NULL_SPAN
+
+
+def timed(stage):
+    """Decorator timing every call of a function as `stage`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics_enabled():
+                return func(*args, **kwargs)
+            with _Span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe(stage, seconds):
+    """Records one `stage` duration measured elsewhere."""
+    if not metrics_enabled():
+        return
+    with _lock:
+        entry = _stages.get(stage)
+        if entry is None:
+            entry = _stages[stage] = [0, 0.0, 0.0, [0] * len(DEFAULT_BUCKETS)]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        for index, bound in enumerate(DEFAULT_BUCKETS):
+            if seconds <= bound:
+                entry[3][index] += 1
+                break
+
+
+def increment(name, value=1, **labels):
+    """Adds `value` to the counter `name` with the given labels."""
+    if not metrics_enabled():
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def record_http_response(response, *args, **kwargs):
+    """
+    requests response hook counting the bytes sent and received and the retryable responses of every
+    request made through the shared session, by the HTTP helpers and the SDK clients alike.
+    """
+    if not metrics_enabled():
+        return
+    request = response.request
+    increment("bytes_sent", int(request.headers.get("Content-Length") or 0))
+    if request.method != "HEAD":
+        increment("bytes_received", int(response.headers.get("Content-Length") or 0))
+    if response.status_code in RETRYABLE_STATUS_CODES:
+        increment("retryable_responses", status=str(response.status_code))
+
+
+def snapshot():
+    """
+    Returns the recorded metrics as {"stages": {stage: {"count", "total_seconds", "max_seconds"}},
+    "counters": {(name, labels): value}}.
+    """
+    with _lock:
+        stages = {
+            stage: {"count": entry[0], "total_seconds": entry[1], "max_seconds": entry[2]}
+            for stage, entry in _stages.items()
+        }
+        return {"stages": stages, "counters": dict(_counters)}
+
+
+def summary_rows():
+    """Returns ([stage, count, total s, mean ms, max ms] rows, [counter, value] rows) for a summary table."""
+    recorded = snapshot()
+    stage_rows = [
+        [stage, entry["count"], round(entry["total_seconds"], 3),
+         round(entry["total_seconds"] / entry["count"] * 1000, 1), round(entry["max_seconds"] * 1000, 1)]
+        for stage, entry in sorted(recorded["stages"].items())
+    ]
+    counter_rows = [
+        [name + "".join(f" {label}={value}" for label, value in labels), value]
+        for (name, labels), value in sorted(recorded["counters"].items())
+    ]
+    return stage_rows, counter_rows
+
+
+def _labels(pairs):
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}" if pairs else ""
+
+
+def render_prometheus():
+    """Renders the recorded metrics in the Prometheus text exposition format."""
+    with _lock:
+        stages = {stage: (entry[0], entry[1], list(entry[3])) for stage, entry in _stages.items()}
+        counters = dict(_counters)
+
+    lines = []
+    if stages:
+        name = f"{METRICS_PREFIX}_stage_duration_seconds"
+        lines += [f"# HELP {name} Time spent in each processing stage.", f"# TYPE {name} histogram"]
+        for stage, (count, total, buckets) in sorted(stages.items()):
+            cumulative = 0
+            for bound, bucket in zip(DEFAULT_BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{_labels([('stage', stage), ('le', f'{bound:g}')])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels([('stage', stage), ('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_labels([('stage', stage)])} {total:.6f}")
+            lines.append(f"{name}_count{_labels([('stage', stage)])} {count}")
+
+    names = sorted({name for name, _ in counters})
+    for counter in names:
+        name = f"{METRICS_PREFIX}_{counter}_total"
+        lines.append(f"# TYPE {name} counter")
+        for (counter_name, labels), value in sorted(counters.items()):
+            if counter_name == counter:
+                lines.append(f"{name}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
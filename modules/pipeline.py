@@ -0,0 +1,324 @@
+from modules.analysis_cache import get_analysis_cache, hash_file
+from modules.document_intelligence import (
+    DEFAULT_MODEL_ID, analyze_invoice_bytes_with_sdk, analyze_invoice_with_sdk, direct_analysis_max_bytes,
+    extract_invoice_insights
+)
+from modules.export import DEFAULT_BUFFER_SIZE, document_name, dumps_line
+from modules.sharding import analyze_sharded, count_pdf_pages, shard_pages
+from modules.storage import content_name, get_storage_backend
+import functools
+import glob
+import os
+import queue
+import threading
+
+DEFAULT_UPLOAD_WORKERS = 4
+DEFAULT_SAS_WORKERS = 2
+DEFAULT_ANALYSIS_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 32
+
+_STOP = object()
+
+
+def collect_files(patterns):
+    """
+    Expands directories (recursively) and glob patterns into a sorted list of unique file paths.
+    """
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, names in os.walk(pattern):
+                files.update(os.path.join(root, name) for name in names)
+        else:
+            files.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+    return sorted(files)
+
+
+def analyze_file(file_path, model_id=DEFAULT_MODEL_ID, use_cache=True, direct_max_bytes=None, storage=None,
+                 pages_per_shard=None, workers=None):
+    """
+    Analyzes a single document, returning its insights.
+    Documents up to `direct_max_bytes` (default: `direct_analysis_max_bytes()`) are sent directly to the
+    service; larger ones are staged in `storage` (default: `get_storage_backend()`) first, named after
+    their content hash (see `content_name`). A cached
+    analysis of the same content is returned without uploading or analyzing again. PDFs longer than
+    `pages_per_shard` pages (default: `shard_pages()`) are analyzed in page ranges by up to `workers`
+    concurrent requests (see modules.sharding).
+    """
+    return process_file(file_path, model_id, use_cache, direct_max_bytes, storage, pages_per_shard, workers)["insights"]
+
+
+def process_file(file_path, model_id=DEFAULT_MODEL_ID, use_cache=True, direct_max_bytes=None, storage=None,
+                 pages_per_shard=None, workers=None):
+    """
+    Analyzes a single document like `analyze_file`, returning a result shaped like the batch pipeline's:
+    file, model_id, file_hash, status ("cached" or "analyzed") and insights. Analyzed documents also
+    carry their AnalyzeResult ("analysis_result") and either "direct" or the "blob_name" they were
+    staged under; cached ones were neither uploaded nor analyzed.
+    """
+    item = {"file": file_path, "model_id": model_id, "file_hash": None}
+    cache = get_analysis_cache() if use_cache else None
+    if cache is not None:
+        item["file_hash"] = hash_file(file_path)
+        insights = cache.get(item["file_hash"], model_id)
+        if insights is not None:
+            item.update(status="cached", insights=insights)
+            return item
+
+    if direct_max_bytes is None:
+        direct_max_bytes = direct_analysis_max_bytes()
+    if pages_per_shard is None:
+        pages_per_shard = shard_pages()
+    if os.path.getsize(file_path) <= direct_max_bytes:
+        with open(file_path, "rb") as file_data:
+            analysis_result = _analyze_content(file_data.read(), model_id, pages_per_shard, workers)
+        item["direct"] = True
+    else:
+        storage = storage or get_storage_backend()
+        item["blob_name"] = content_name(item["file_hash"] or hash_file(file_path), file_path)
+        storage.upload(file_path, skip_if_unchanged=True, name=item["blob_name"])
+        page_count = count_pdf_pages(file_path) if pages_per_shard else None
+        analysis_result = analyze_stored(item["blob_name"], model_id, storage, pages_per_shard, workers, page_count)
+
+    item.update(status="analyzed", analysis_result=analysis_result,
+                insights=extract_invoice_insights(analysis_result))
+    if cache is not None:
+        cache.set(item["file_hash"], model_id, item["insights"])
+    return item
+
+
+def _analyze_content(content, model_id, pages_per_shard, workers):
+    if pages_per_shard:
+        return analyze_sharded(document=content, model_id=model_id, pages_per_shard=pages_per_shard,
+                               workers=workers)
+    return analyze_invoice_bytes_with_sdk(content, model_id)
+
+
+def analyze_bytes(content, file_hash=None, model_id=DEFAULT_MODEL_ID, pages_per_shard=0, workers=None):
+    """
+    Analyzes a document sent directly in the request, returning its insights.
+    When `file_hash` is given the insights are stored in the analysis cache under it. With
+    `pages_per_shard`, longer PDFs are analyzed as concurrent page ranges (see modules.sharding).
+    """
+    insights = extract_invoice_insights(_analyze_content(content, model_id, pages_per_shard, workers))
+    if file_hash is not None:
+        get_analysis_cache().set(file_hash, model_id, insights)
+    return insights
+
+
+def analyze_stored(blob_name, model_id=DEFAULT_MODEL_ID, storage=None, pages_per_shard=0, workers=None,
+                   page_count=None):
+    """
+    Analyzes a document that is already staged in `storage` (default: `get_storage_backend()`), returning
+    the AnalyzeResult: remote backends are analyzed from the document's URL, the others from its bytes.
+    With `pages_per_shard`, PDFs longer than that are analyzed as concurrent page ranges; documents
+    analyzed from a URL are only sharded when their `page_count` is given.
+    """
+    storage = storage or get_storage_backend()
+    if storage.remote:
+        url = storage.url(os.path.basename(blob_name))
+        if pages_per_shard:
+            return analyze_sharded(url=url, model_id=model_id, page_count=page_count,
+                                   pages_per_shard=pages_per_shard, workers=workers)
+        return analyze_invoice_with_sdk(url, model_id)
+    if pages_per_shard:
+        return analyze_sharded(document=storage.read(blob_name), model_id=model_id, page_count=page_count,
+                               pages_per_shard=pages_per_shard, workers=workers)
+    return analyze_invoice_bytes_with_sdk(storage.read(blob_name), model_id)
+
+
+def analyze_blob(blob_name, file_hash=None, model_id=DEFAULT_MODEL_ID, storage=None, pages_per_shard=0,
+                 workers=None, page_count=None):
+    """
+    Analyzes a document that is already staged in `storage` (default: `get_storage_backend()`), returning its insights.
+    When `file_hash` is given the insights are stored in the analysis cache under it. `pages_per_shard`,
+    `workers` and `page_count` are passed to `analyze_stored`.
+    """
+    insights = extract_invoice_insights(
+        analyze_stored(blob_name, model_id, storage, pages_per_shard, workers, page_count)
+    )
+    if file_hash is not None:
+        get_analysis_cache().set(file_hash, model_id, insights)
+    return insights
+
+
+class _Stage:
+    """
+    A pool of worker threads reading items from `inbound` and passing results to `outbound`.
+    Failed and cached items are passed along untouched, so they reach the results without further work,
+    and items flagged "direct" skip every stage but the analysis.
+    """
+
+    def __init__(self, name, func, workers, inbound, outbound):
+        self.name = name
+        self.func = func
+        self.inbound = inbound
+        self.outbound = outbound
+        self._remaining = workers
+        self._lock = threading.Lock()
+        self._next_workers = 1
+        self.threads = [
+            threading.Thread(target=self._work, name=f"{name}-{index}", daemon=True) for index in range(workers)
+        ]
+
+    def start(self, next_workers):
+        self._next_workers = next_workers
+        for thread in self.threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            item = self.inbound.get()
+            if item is _STOP:
+                break
+            if "error" in item or item.get("status") == "cached" or (item.get("direct") and self.name != "analysis"):
+                self.outbound.put(item)
+                continue
+            try:
+                self.outbound.put(self.func(item))
+            except Exception as e:
+                item.update(status="failed", stage=self.name, error=str(e))
+                self.outbound.put(item)
+
+        # The last worker to finish tells every worker of the next stage to stop
+        with self._lock:
+            self._remaining -= 1
+            last = self._remaining == 0
+        if last:
+            for _ in range(self._next_workers):
+                self.outbound.put(_STOP)
+
+
+def _upload(item, storage):
+    storage.upload(item["file"], skip_if_unchanged=True, name=item["blob_name"])
+    return item
+
+
+def _generate_sas(item, storage):
+    item["blob_url"] = storage.url(item["blob_name"])
+    return item
+
+
+def _analyze(item, storage, scheduler=None, pages_per_shard=0, shard_workers=None):
+    # Long PDFs are split into page ranges analyzed concurrently, then merged
+    page_count = count_pdf_pages(item["file"]) if pages_per_shard else None
+    sharded = bool(page_count and page_count > pages_per_shard)
+    if item.get("direct") or not storage.remote:
+        if item.get("direct"):
+            with open(item["file"], "rb") as file_data:
+                content = file_data.read()
+        else:
+            content = storage.read(item["blob_name"])
+        if sharded:
+            analysis_result = analyze_sharded(document=content, model_id=item["model_id"], page_count=page_count,
+                                              pages_per_shard=pages_per_shard, workers=shard_workers,
+                                              scheduler=scheduler)
+        elif scheduler is not None:
+            analysis_result = scheduler.analyze(document=content, model_id=item["model_id"])
+        else:
+            analysis_result = analyze_invoice_bytes_with_sdk(content, item["model_id"])
+    elif sharded:
+        analysis_result = analyze_sharded(url=item["blob_url"], model_id=item["model_id"], page_count=page_count,
+                                          pages_per_shard=pages_per_shard, workers=shard_workers, scheduler=scheduler)
+    elif scheduler is not None:
+        analysis_result = scheduler.analyze(url=item["blob_url"], model_id=item["model_id"])
+    else:
+        analysis_result = analyze_invoice_with_sdk(item["blob_url"], item["model_id"])
+    item["insights"] = extract_invoice_insights(analysis_result)
+    item["status"] = "analyzed"
+    if item.get("file_hash"):
+        get_analysis_cache().set(item["file_hash"], item["model_id"], item["insights"])
+    return item
+
+
+def run_batch(file_paths, output_path, upload_workers=DEFAULT_UPLOAD_WORKERS, sas_workers=DEFAULT_SAS_WORKERS,
+              analysis_workers=DEFAULT_ANALYSIS_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, model_id=DEFAULT_MODEL_ID,
+              use_cache=True, direct_max_bytes=None, scheduler=None, storage=None, exporter=None,
+              pages_per_shard=None, shard_workers=None, manifest=None):
+    """
+    Uploads, signs and analyzes many documents as overlapping pipeline stages.
+    Each stage has its own worker pool and hands items to the next through a bounded queue, so a
+    slow stage pushes back on the ones before it. Documents up to `direct_max_bytes` (default:
+    `direct_analysis_max_bytes()`) skip the upload and SAS stages and are sent directly for analysis;
+    the others are staged in `storage` (default: `get_storage_backend()`) under their content hash.
+    With a `scheduler` (see modules.analysis_scheduler), analyses go through its rate limit and
+    shared poller instead of one SDK poller per document. Results are appended to `output_path` as
+    JSON Lines in completion order, through a write buffer; the insights of analyzed and cached
+    documents are also passed to `exporter` (see modules.export). PDFs longer than `pages_per_shard`
+    pages (default: `shard_pages()`) are analyzed as `shard_workers` concurrent page ranges (see
+    modules.sharding). With a `manifest` (see modules.manifest), documents that are unchanged since
+    they were last analyzed are skipped and counted as "unchanged", and every finished document is
+    recorded in it along with the position of its result line. Returns a count of documents per
+    final status.
+    """
+    if direct_max_bytes is None:
+        direct_max_bytes = direct_analysis_max_bytes()
+    if pages_per_shard is None:
+        pages_per_shard = shard_pages()
+    storage = storage or get_storage_backend()
+    upload_queue = queue.Queue(maxsize=queue_size)
+    sas_queue = queue.Queue(maxsize=queue_size)
+    analysis_queue = queue.Queue(maxsize=queue_size)
+    results_queue = queue.Queue(maxsize=queue_size)
+
+    stages = [
+        _Stage("upload", functools.partial(_upload, storage=storage), upload_workers, upload_queue, sas_queue),
+        _Stage("sas", functools.partial(_generate_sas, storage=storage), sas_workers, sas_queue, analysis_queue),
+        _Stage("analysis", functools.partial(_analyze, storage=storage, scheduler=scheduler,
+                                             pages_per_shard=pages_per_shard, shard_workers=shard_workers),
+               analysis_workers, analysis_queue, results_queue),
+    ]
+    for stage, next_workers in zip(stages, [sas_workers, analysis_workers, 1]):
+        stage.start(next_workers)
+
+    unchanged = 0
+    if manifest is not None:
+        pending, unchanged = manifest.plan(file_paths, model_id)
+    else:
+        pending = [{"file": file_path} for file_path in file_paths]
+
+    def feed():
+        cache = get_analysis_cache() if use_cache else None
+        for item in pending:
+            file_path = item["file"]
+            item["model_id"] = model_id
+            try:
+                if cache is not None:
+                    if "file_hash" not in item:
+                        item["file_hash"] = hash_file(file_path)
+                    insights = cache.get(item["file_hash"], model_id)
+                    if insights is not None:
+                        item.update(status="cached", insights=insights)
+                if os.path.getsize(file_path) <= direct_max_bytes:
+                    item["direct"] = True
+                elif item.get("status") != "cached":
+                    # Files found in different folders may share a base name, but not their content
+                    item["blob_name"] = content_name(item.get("file_hash") or hash_file(file_path), file_path)
+            except OSError as e:
+                item.update(status="failed", stage="read", error=str(e))
+            upload_queue.put(item)
+        for _ in range(upload_workers):
+            upload_queue.put(_STOP)
+
+    feeder = threading.Thread(target=feed, name="feeder", daemon=True)
+    feeder.start()
+
+    counts = {"unchanged": unchanged} if unchanged else {}
+    with open(output_path, "ab", buffering=DEFAULT_BUFFER_SIZE) as output:
+        while True:
+            item = results_queue.get()
+            if item is _STOP:
+                break
+            offset = output.tell()
+            output.write(dumps_line(item))
+            if manifest is not None:
+                # The result line reaches the file before the manifest says the document is done
+                output.flush()
+                manifest.record(item, output_path, offset)
+            if exporter is not None and "insights" in item:
+                exporter.write(document_name(item["file"], item.get("file_hash")), item["insights"],
+                               file=item["file"], status=item["status"], model_id=item["model_id"])
+            counts[item["status"]] = counts.get(item["status"], 0) + 1
+
+    feeder.join()
+    return counts
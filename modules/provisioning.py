@@ -0,0 +1,107 @@
+import sys
+import threading
+
+_lock = threading.Lock()
+_verified = set()
+_pending = {}
+# One lock per resource, so a slow creation only holds up the callers waiting for that resource
+_key_locks = {}
+
+
+def ensure_once(key, create):
+    """
+    Runs `create()` (which must make sure the resource exists) the first time `key` is seen
+    in this process; later calls return without any network round-trip.
+    """
+    if key in _verified:
+        return
+    with _lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        if key not in _verified:
+            create()
+            with _lock:
+                _verified.add(key)
+
+
+def forget(key):
+    """Drops `key` so the next `ensure_once` verifies the resource again."""
+    with _lock:
+        _verified.discard(key)
+
+
+def reset_provisioning():
+    """Forgets every verified resource (mainly for tests)."""
+    with _lock:
+        _verified.clear()
+        _pending.clear()
+        _key_locks.clear()
+
+
+def is_not_found(error):
+    """Returns True when an SDK or HTTP error means the target resource does not exist."""
+    # An SDK error means the SDK, and its exceptions, are loaded already
+    exceptions = sys.modules.get("azure.core.exceptions")
+    if exceptions is not None and isinstance(error, exceptions.ResourceNotFoundError):
+        return True
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) == 404
+
+
+def run_with_ensured(key, create, operation):
+    """
+    Runs `operation()` once the resource identified by `key` is known to exist.
+    If the write fails with a 404 (the resource was deleted behind our back), the resource is
+    forgotten, re-created and the operation retried once.
+    """
+    ensure_once(key, create)
+    try:
+        return operation()
+    except Exception as error:
+        if not is_not_found(error):
+            raise
+        forget(key)
+        ensure_once(key, create)
+        return operation()
+
+
+async def ensure_once_async(key, create):
+    """
+    Awaits `create()` the first time `key` is seen in this process, like `ensure_once`.
+    Concurrent first callers on the same event loop wait for a single creation.
+    """
+    if key in _verified:
+        return
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    with _lock:
+        task = _pending.get((loop, key))
+        if task is None:
+            task = loop.create_task(create())
+            _pending[(loop, key)] = task
+    try:
+        # Shielded so that one cancelled caller does not cancel the creation for the others
+        await asyncio.shield(task)
+    finally:
+        with _lock:
+            if task.done() and _pending.get((loop, key)) is task:
+                del _pending[(loop, key)]
+    with _lock:
+        _verified.add(key)
+
+
+async def run_with_ensured_async(key, create, operation):
+    """
+    Awaits `operation()` once the resource identified by `key` is known to exist, re-creating the
+    resource and retrying once on a 404, like `run_with_ensured`.
+    """
+    await ensure_once_async(key, create)
+    try:
+        return await operation()
+    except Exception as error:
+        if not is_not_found(error):
+            raise
+        forget(key)
+        await ensure_once_async(key, create)
+        return await operation()
@@ -0,0 +1,204 @@
+from concurrent.futures import ThreadPoolExecutor
+from modules.document_intelligence import DEFAULT_MODEL_ID, analyze_invoice_bytes_with_sdk, analyze_invoice_with_sdk
+from modules.metrics import increment, timed
+from modules.utils import get_optional_env_variable
+
+DEFAULT_SHARD_PAGES = 0
+DEFAULT_SHARD_WORKERS = 4
+# Separates the content of consecutive shards in the merged result
+CONTENT_SEPARATOR = "\n"
+
+_missing_parser_reported = False
+
+
+def shard_pages():
+    """
+    Returns the number of pages analyzed per shard (ANALYSIS_SHARD_PAGES); 0, the default, analyzes
+    every document in a single request.
+    """
+    return int(get_optional_env_variable("ANALYSIS_SHARD_PAGES", DEFAULT_SHARD_PAGES))
+
+
+def shard_workers():
+    """Returns how many shards of a document are analyzed at once (ANALYSIS_SHARD_WORKERS, 4 by default)."""
+    return int(get_optional_env_variable("ANALYSIS_SHARD_WORKERS", DEFAULT_SHARD_WORKERS))
+
+
+def count_pdf_pages(source):
+    """
+    Counts the pages of a PDF given as bytes or as a file path, from the page tree its catalog points
+    to (/Root /Pages /Count), read with PyMuPDF so incremental updates and compressed object streams
+    are followed. Returns None for other formats, for PDFs that cannot be read, or when PyMuPDF is
+    not installed, in which case the document is analyzed in a single request; since pages are only
+    counted to shard documents, a missing PyMuPDF is reported (once per process).
+    """
+    global _missing_parser_reported
+    try:
+        import fitz
+    except ImportError:
+        if not _missing_parser_reported:
+            _missing_parser_reported = True
+            print("Warning: sharding needs 'pymupdf' to count the pages of PDFs; documents are analyzed "
+                  "in a single request. Install it using 'pip install pymupdf'.")
+        return None
+    try:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            document = fitz.open(stream=bytes(source), filetype="pdf")
+        else:
+            document = fitz.open(source, filetype="pdf")
+    except Exception:
+        return None
+    with document:
+        return document.page_count or None
+
+
+def page_ranges(page_count, pages_per_shard):
+    """Splits pages 1 to `page_count` into ranges of `pages_per_shard` pages, in the service's "first-last" form."""
+    return [
+        f"{first}-{min(first + pages_per_shard - 1, page_count)}"
+        for first in range(1, page_count + 1, pages_per_shard)
+    ]
+
+
+def analyze_sharded(url=None, document=None, model_id=DEFAULT_MODEL_ID, page_count=None, pages_per_shard=None,
+                    workers=None, scheduler=None):
+    """
+    Analyzes a document given by `url` or as `document` bytes in shards of `pages_per_shard` pages
+    (default: `shard_pages()`), sent as concurrent requests for page ranges, and merges their results
+    into one AnalyzeResult. `page_count` is counted from `document` when not given; documents that
+    fit in one shard, or whose pages cannot be counted, are analyzed in a single request.
+    Shards go through `scheduler` when given, otherwise through up to `workers` (default:
+    `shard_workers()`) SDK pollers at once.
+    """
+    if (url is None) == (document is None):
+        raise ValueError("Pass either a document URL or the document bytes.")
+    if pages_per_shard is None:
+        pages_per_shard = shard_pages()
+    if page_count is None and document is not None and pages_per_shard:
+        page_count = count_pdf_pages(document)
+
+    ranges = page_ranges(page_count, pages_per_shard) if page_count and pages_per_shard else []
+    if len(ranges) < 2:
+        ranges = [None]
+    increment("analysis_shards", len(ranges))
+
+    if scheduler is not None:
+        futures = [scheduler.submit(url=url, document=document, model_id=model_id, pages=pages) for pages in ranges]
+        results = [future.result() for future in futures]
+    else:
+        def analyze(pages):
+            if url is not None:
+                return analyze_invoice_with_sdk(url, model_id, pages=pages)
+            return analyze_invoice_bytes_with_sdk(document, model_id, pages=pages)
+
+        if len(ranges) == 1:
+            return analyze(ranges[0])
+        with ThreadPoolExecutor(max_workers=workers or shard_workers(), thread_name_prefix="analysis-shard") as pool:
+            results = list(pool.map(analyze, ranges))
+
+    if len(results) == 1:
+        return results[0]
+    return merge_analyze_results(results, ranges)
+
+
+def _shift(value, offset, page_shift):
+    """Moves every span of a result dictionary by `offset` characters and every page number by `page_shift`."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == "span":
+                if item:
+                    item["offset"] += offset
+            elif key == "spans":
+                for span in item or []:
+                    span["offset"] += offset
+            elif key == "page_number":
+                if item is not None:
+                    value[key] = item + page_shift
+            elif key != "polygon" and isinstance(item, (dict, list)):
+                _shift(item, offset, page_shift)
+    elif isinstance(value, list):
+        for item in value:
+            _shift(item, offset, page_shift)
+
+
+def _pages_of(element):
+    return [region["page_number"] for region in element.get("bounding_regions") or []]
+
+
+def _row(table, row_index):
+    return [cell["content"] for cell in sorted(
+        (cell for cell in table["cells"] if cell["row_index"] == row_index), key=lambda cell: cell["column_index"]
+    )]
+
+
+def _continue_table(table, continuation):
+    """Appends the rows of a table carried over from the previous shard, dropping a repeated header row."""
+    skipped = 1 if table["row_count"] and _row(table, 0) == _row(continuation, 0) else 0
+    shift = table["row_count"] - skipped
+    for cell in continuation["cells"]:
+        if cell["row_index"] >= skipped:
+            cell["row_index"] += shift
+            table["cells"].append(cell)
+    table["row_count"] += continuation["row_count"] - skipped
+    table["bounding_regions"] = (table.get("bounding_regions") or []) + (continuation.get("bounding_regions") or [])
+    table["spans"] = (table.get("spans") or []) + (continuation.get("spans") or [])
+
+
+def _merge_documents(documents):
+    """Keeps one document per type, with the most confident value found in any shard for each field."""
+    merged = {}
+    for document in documents:
+        current = merged.get(document.get("doc_type"))
+        if current is None:
+            merged[document.get("doc_type")] = document
+            continue
+        current["bounding_regions"] = (current.get("bounding_regions") or []) + (document.get("bounding_regions") or [])
+        current["spans"] = (current.get("spans") or []) + (document.get("spans") or [])
+        current["confidence"] = min(current.get("confidence") or 0, document.get("confidence") or 0)
+        fields = current.setdefault("fields", {})
+        for name, field in (document.get("fields") or {}).items():
+            known = fields.get(name)
+            if known is None or (field.get("confidence") or 0) > (known.get("confidence") or 0):
+                fields[name] = field
+    return list(merged.values())
+
+
+@timed("merge")
+def merge_analyze_results(results, ranges):
+    """
+    Merges the AnalyzeResults of consecutive page ranges ("first-last") of one document into one:
+    contents are concatenated with their spans moved to match, pages are numbered as in the whole
+    document, a table running from the last page of a shard into the first page of the next is joined
+    back into one, and documents of the same type are reconciled field by field.
+    """
+    from azure.ai.formrecognizer import AnalyzeResult
+
+    merged = None
+    offset = 0
+    previous_last_page = None
+    for result, pages in zip(results, ranges):
+        data = result.to_dict()
+        first_page, last_page = (int(page) for page in pages.split("-"))
+        # Shards are normally numbered as in the whole document; renumber any counted from 1
+        numbers = [page["page_number"] for page in data.get("pages") or []]
+        page_shift = first_page - min(numbers) if numbers and min(numbers) < first_page else 0
+        _shift(data, offset, page_shift)
+
+        if merged is None:
+            merged = data
+        else:
+            merged["content"] = (merged.get("content") or "") + CONTENT_SEPARATOR + (data.get("content") or "")
+            tables = data.get("tables") or []
+            last_table = (merged.get("tables") or [None])[-1]
+            if (last_table is not None and tables and previous_last_page in _pages_of(last_table)
+                    and first_page in _pages_of(tables[0]) and last_table["column_count"] == tables[0]["column_count"]):
+                _continue_table(last_table, tables.pop(0))
+            for key in ("pages", "paragraphs", "tables", "key_value_pairs", "styles", "languages", "documents"):
+                if data.get(key):
+                    merged[key] = (merged.get(key) or []) + data[key]
+        offset = len(merged.get("content") or "") + len(CONTENT_SEPARATOR)
+        previous_last_page = last_page
+
+    if merged.get("documents"):
+        merged["documents"] = _merge_documents(merged["documents"])
+    return AnalyzeResult.from_dict(merged)
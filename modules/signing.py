@@ -0,0 +1,166 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from modules.metrics import increment
+from urllib.parse import quote, urlparse, parse_qs
+import base64
+import hashlib
+import hmac
+import threading
+
+SAS_VERSION = "2021-08-06"
+DEFAULT_REFRESH_MARGIN = timedelta(minutes=30)
+DEFAULT_MAX_SAS_URLS = 10000
+
+_lock = threading.Lock()
+_signers = {}
+_sas_caches = {}
+
+
+class SharedKeySigner:
+    """
+    Signs Shared Key requests and service SAS tokens for one storage account.
+    The account key is decoded once, when the signer is built.
+    """
+
+    def __init__(self, account_name, account_key):
+        self.account_name = account_name
+        self._key = base64.b64decode(account_key)
+
+    def sign(self, string_to_sign):
+        """Returns the base64 HMAC-SHA256 signature of `string_to_sign`."""
+        return base64.b64encode(hmac.new(self._key, string_to_sign.encode("utf-8"), hashlib.sha256).digest()).decode()
+
+    def authorization_header(self, url, method, headers=None):
+        """
+        Generates the Shared Key Authorization header for an HTTP request to Blob Storage or File Share.
+        """
+        if headers is None:
+            headers = {}
+
+        parsed_url = urlparse(url)
+        query = parse_qs(parsed_url.query)
+
+        # Content-Encoding, Content-Language, Content-MD5, Date (x-ms-date is used instead),
+        # If-Modified-Since, If-Match, If-None-Match, If-Unmodified-Since and Range are always empty
+        string_to_sign = (
+            f"{method}\n\n\n{headers.get('Content-Length', '')}\n\n{headers.get('Content-Type', '')}\n\n\n\n\n\n\n"
+        )
+
+        # Canonicalized headers
+        x_ms_headers = {k.lower(): v.strip() for k, v in headers.items() if k.lower().startswith("x-ms-")}
+        string_to_sign += "".join(f"{k}:{v}\n" for k, v in sorted(x_ms_headers.items()))
+
+        # Canonicalized resource
+        string_to_sign += f"/{self.account_name}{parsed_url.path}"
+        if query:
+            string_to_sign += "\n" + "\n".join(f"{k}:{','.join(query[k])}" for k in sorted(query))
+
+        return f"SharedKey {self.account_name}:{self.sign(string_to_sign)}"
+
+    def sas_tokens(self, service, container, names, permission, start, expiry):
+        """
+        Generates service SAS tokens for many blobs ("blob") or files ("file") of one container or share.
+        Everything but the resource name is formatted once, so each token costs a single HMAC.
+        """
+        start_text = start.strftime("%Y-%m-%dT%H:%M:%SZ")
+        expiry_text = expiry.strftime("%Y-%m-%dT%H:%M:%SZ")
+        prefix = f"{permission}\n{start_text}\n{expiry_text}\n/{service}/{self.account_name}/{container}/"
+        if service == "blob":
+            # signedIdentifier, IP, protocol, version, resource, snapshot time, encryption scope, response headers
+            suffix = f"\n\n\n\n{SAS_VERSION}\nb\n\n\n\n\n\n\n"
+            resource = "b"
+        else:
+            # signedIdentifier, IP, protocol, version, response headers
+            suffix = f"\n\n\n\n{SAS_VERSION}\n\n\n\n\n"
+            resource = "f"
+        query = f"st={quote(start_text)}&se={quote(expiry_text)}&sp={permission}&sv={SAS_VERSION}&sr={resource}&sig="
+        return [query + quote(self.sign(prefix + name + suffix)) for name in names]
+
+    def sas_token(self, service, container, name, permission, start, expiry):
+        """Generates the service SAS token of a single blob or file."""
+        return self.sas_tokens(service, container, [name], permission, start, expiry)[0]
+
+
+class SasUrlCache:
+    """
+    Keeps a read-only SAS URL per blob or file of one container or share.
+    Tokens are valid from `start_skew` before until `lifetime` after they are generated and are
+    regenerated once less than `refresh_margin` of their lifetime is left. At most `max_entries` URLs
+    are kept; the least recently used ones, and expired ones, are dropped as new URLs are added.
+    """
+
+    def __init__(self, signer, service, base_url, container, lifetime, start_skew, refresh_margin=DEFAULT_REFRESH_MARGIN,
+                 clock=None, max_entries=DEFAULT_MAX_SAS_URLS):
+        self.signer = signer
+        self.service = service
+        self.base_url = base_url
+        self.container = container
+        self.lifetime = lifetime
+        self.start_skew = start_skew
+        self.refresh_margin = refresh_margin
+        self._clock = clock or (lambda: datetime.now(timezone.utc))
+        self.max_entries = max_entries
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def urls(self, names):
+        """Returns the SAS URLs of `names`, signing only those that are missing or about to expire."""
+        now = self._clock()
+        with self._lock:
+            cached = [self._urls.get(name) for name in names]
+            for name, entry in zip(names, cached):
+                if entry is not None:
+                    self._urls.move_to_end(name)
+        stale = [name for name, entry in zip(names, cached) if entry is None or entry[1] - self.refresh_margin <= now]
+        increment("cache_hits", len(names) - len(stale), cache="sas")
+        increment("cache_misses", len(stale), cache="sas")
+        if stale:
+            expiry = now + self.lifetime
+            tokens = self.signer.sas_tokens(self.service, self.container, stale, "r", now - self.start_skew, expiry)
+            fresh = {
+                name: (f"{self.base_url}/{self.container}/{name}?{token}", expiry) for name, token in zip(stale, tokens)
+            }
+            with self._lock:
+                self._urls.update(fresh)
+                for name in fresh:
+                    self._urls.move_to_end(name)
+                # Entries are in least recently used order, which is also roughly expiry order
+                while self._urls and (len(self._urls) > self.max_entries or next(iter(self._urls.values()))[1] <= now):
+                    self._urls.popitem(last=False)
+            cached = [fresh[name] if name in fresh else entry for name, entry in zip(names, cached)]
+        return [entry[0] for entry in cached]
+
+    def url(self, name):
+        return self.urls([name])[0]
+
+    def clear(self):
+        with self._lock:
+            self._urls.clear()
+
+
+def get_signer(account_name, account_key):
+    """Returns the shared signer of a storage account, decoding its key on first use."""
+    key = (account_name, account_key)
+    with _lock:
+        signer = _signers.get(key)
+        if signer is None:
+            signer = _signers[key] = SharedKeySigner(account_name, account_key)
+        return signer
+
+
+def get_sas_cache(service, account_name, account_key, base_url, container, lifetime, start_skew):
+    """Returns the shared SAS URL cache of a container ("blob") or share ("file")."""
+    key = (service, account_name, account_key, base_url, container, lifetime, start_skew)
+    signer = get_signer(account_name, account_key)
+    with _lock:
+        cache = _sas_caches.get(key)
+        if cache is None:
+            cache = _sas_caches[key] = SasUrlCache(signer, service, base_url, container, lifetime, start_skew)
+        return cache
+
+
+def reset_signing():
+    """Forgets every signer and cached SAS URL (mainly for tests)."""
+    with _lock:
+        _signers.clear()
+        _sas_caches.clear()
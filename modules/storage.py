@@ -0,0 +1,369 @@
+from datetime import datetime, timezone
+from modules import azure_blob, azure_file
+from modules.clients import get_client, get_http_session
+from modules.metrics import timed
+from modules.provisioning import ensure_once
+from modules.signing import get_signer
+from modules.utils import compute_md5, get_env_variable, get_optional_env_variable
+import abc
+import base64
+import hashlib
+import os
+import pathlib
+import tempfile
+import threading
+
+DEFAULT_STORAGE_BACKEND = "blob"
+DEFAULT_LOCAL_STORAGE_PATH = ".storage"
+
+_lock = threading.Lock()
+_backends = {}
+
+
+def _consume_stream(chunks, write):
+    """Passes every chunk to `write` while hashing it; returns (size, sha256 hex, base64 MD5)."""
+    sha256, md5 = hashlib.sha256(), hashlib.md5()
+    size = 0
+    for chunk in chunks:
+        sha256.update(chunk)
+        md5.update(chunk)
+        size += len(chunk)
+        write(chunk)
+    return size, sha256.hexdigest(), base64.b64encode(md5.digest()).decode()
+
+
+def content_name(file_hash, file_name=""):
+    """
+    Names a staged document after its sha256 `file_hash`, keeping the extension of `file_name`, so that
+    files sharing a base name in different folders never overwrite each other once staged.
+    """
+    return file_hash + os.path.splitext(file_name)[1].lower()
+
+
+class StorageBackend(abc.ABC):
+    """
+    Where documents are staged before they are analyzed; documents are named by their file's base name
+    unless a `name` is given. Subclasses implement every abstract method, or cannot be instantiated.
+    Document Intelligence fetches documents from `remote` backends by URL; documents in the other
+    backends are read back with `read` and sent in the analysis request.
+    """
+
+    remote = True
+
+    @abc.abstractmethod
+    def upload(self, file_path, skip_if_unchanged=False, name=None):
+        """
+        Stores a local file as `name` (default: its base name); returns False when `skip_if_unchanged`
+        found the same content already stored.
+        """
+
+    @abc.abstractmethod
+    def upload_stream(self, chunks, name):
+        """Stores an iterable of byte chunks; returns a dict with the blob name, size, sha256 and content_md5."""
+
+    @abc.abstractmethod
+    def exists(self, name):
+        """Returns True when a document named `name` is stored."""
+
+    @abc.abstractmethod
+    def urls(self, names):
+        """Returns a URL for each of `names`."""
+
+    def url(self, name):
+        return self.urls([name])[0]
+
+    @abc.abstractmethod
+    def read(self, name):
+        """Returns the stored bytes of a document."""
+
+    @abc.abstractmethod
+    def delete(self, name):
+        """Deletes a document; returns False when there was nothing to delete."""
+
+    @abc.abstractmethod
+    def ensure(self):
+        """Prepares the backend (e.g. creates its container) ahead of the first upload."""
+
+
+class BlobSdkBackend(StorageBackend):
+    """Azure Blob Storage through the Azure SDK."""
+
+    def upload(self, file_path, skip_if_unchanged=False, name=None):
+        return azure_blob.upload_blob_with_sdk(file_path, skip_if_unchanged=skip_if_unchanged, blob_name=name)
+
+    def upload_stream(self, chunks, name):
+        return azure_blob.upload_blob_from_stream(chunks, name)
+
+    def urls(self, names):
+        return azure_blob.generate_blob_urls(names)
+
+    def _blob_client(self, name):
+        account_name = get_env_variable("AZURE_STORAGE_ACCOUNT_NAME")
+        blob_service_client = get_client(
+            azure_blob.BlobServiceClient,
+            account_url=azure_blob._account_url(account_name),
+            credential=get_env_variable("AZURE_STORAGE_ACCOUNT_KEY")
+        )
+        return blob_service_client.get_blob_client(
+            container=get_env_variable("AZURE_STORAGE_BLOB_CONTAINER_NAME"), blob=os.path.basename(name)
+        )
+
+    def exists(self, name):
+        return self._blob_client(name).exists()
+
+    def read(self, name):
+        return self._blob_client(name).download_blob().readall()
+
+    def delete(self, name):
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            self._blob_client(name).delete_blob()
+        except ResourceNotFoundError:
+            return False
+        return True
+
+    def ensure(self):
+        azure_blob.ensure_container()
+
+
+class BlobHttpBackend(BlobSdkBackend):
+    """Azure Blob Storage through signed REST requests; files larger than one block are uploaded in blocks."""
+
+    def upload(self, file_path, skip_if_unchanged=False, name=None):
+        if os.path.exists(file_path) and os.path.getsize(file_path) > azure_blob.DEFAULT_BLOCK_SIZE:
+            return azure_blob.upload_blob_in_blocks(file_path, skip_if_unchanged=skip_if_unchanged, blob_name=name)
+        return azure_blob.upload_blob_with_http(file_path, skip_if_unchanged=skip_if_unchanged, blob_name=name)
+
+    def _request(self, method, name):
+        account_name = get_env_variable("AZURE_STORAGE_ACCOUNT_NAME")
+        account_key = get_env_variable("AZURE_STORAGE_ACCOUNT_KEY")
+        container_name = get_env_variable("AZURE_STORAGE_BLOB_CONTAINER_NAME")
+        blob_url = f"{azure_blob._account_url(account_name)}/{container_name}/{os.path.basename(name)}"
+        headers = {
+            "x-ms-version": "2020-08-04",
+            "x-ms-date": datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT"),  # UTC
+        }
+        headers["Authorization"] = get_signer(account_name, account_key).authorization_header(blob_url, method, headers)
+        return get_http_session().request(method, blob_url, headers=headers)
+
+    def exists(self, name):
+        response = self._request("HEAD", name)
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+
+    def read(self, name):
+        response = self._request("GET", name)
+        response.raise_for_status()
+        return response.content
+
+    def delete(self, name):
+        response = self._request("DELETE", name)
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+
+    def ensure(self):
+        account_name = get_env_variable("AZURE_STORAGE_ACCOUNT_NAME")
+        account_key = get_env_variable("AZURE_STORAGE_ACCOUNT_KEY")
+        container_name = get_env_variable("AZURE_STORAGE_BLOB_CONTAINER_NAME")
+        ensure_once(
+            azure_blob._container_key(account_name, container_name),
+            lambda: azure_blob._create_container_with_http(account_name, account_key, container_name),
+        )
+
+
+class FileShareBackend(StorageBackend):
+    """Azure File Share, uploading with the Azure SDK or, with `use_http`, with concurrent range writes."""
+
+    def __init__(self, use_http=False):
+        self.use_http = use_http
+
+    def upload(self, file_path, skip_if_unchanged=False, name=None):
+        if self.use_http:
+            return azure_file.upload_file_with_http(file_path, skip_if_unchanged=skip_if_unchanged, file_name=name)
+        return azure_file.upload_file_with_sdk(file_path, skip_if_unchanged=skip_if_unchanged, file_name=name)
+
+    def upload_stream(self, chunks, name):
+        # A file's size is fixed when it is created, so the stream is spooled to a temporary file first
+        name = os.path.basename(name)
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, name)
+            with open(file_path, "wb") as file_data:
+                size, sha256, content_md5 = _consume_stream(chunks, file_data.write)
+            self.upload(file_path)
+        return {"blob_name": name, "size": size, "sha256": sha256, "content_md5": content_md5}
+
+    def urls(self, names):
+        return azure_file.generate_file_urls(names)
+
+    def _file_client(self, name):
+        account_name = get_env_variable("AZURE_STORAGE_ACCOUNT_NAME")
+        share_service_client = get_client(
+            azure_file.ShareServiceClient,
+            account_url=azure_file._account_url(account_name),
+            credential=get_env_variable("AZURE_STORAGE_ACCOUNT_KEY")
+        )
+        share_client = share_service_client.get_share_client(get_env_variable("AZURE_STORAGE_SHARE_NAME"))
+        return share_client.get_file_client(os.path.basename(name))
+
+    def exists(self, name):
+        return self._file_client(name).exists()
+
+    def read(self, name):
+        return self._file_client(name).download_file().readall()
+
+    def delete(self, name):
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            self._file_client(name).delete_file()
+        except ResourceNotFoundError:
+            return False
+        return True
+
+    def ensure(self):
+        azure_file.ensure_share()
+
+
+class LocalFileBackend(StorageBackend):
+    """A directory on the local disk; files are replaced atomically so readers never see partial writes."""
+
+    remote = False
+
+    def __init__(self, root=DEFAULT_LOCAL_STORAGE_PATH):
+        self.root = os.path.abspath(root)
+
+    def _path(self, name):
+        return os.path.join(self.root, os.path.basename(name))
+
+    @timed("upload")
+    def _write(self, name, chunks):
+        self.ensure()
+        descriptor, temp_path = tempfile.mkstemp(dir=self.root, prefix=".upload-")
+        try:
+            with os.fdopen(descriptor, "wb") as file_data:
+                result = _consume_stream(chunks, file_data.write)
+            os.replace(temp_path, self._path(name))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return result
+
+    def upload(self, file_path, skip_if_unchanged=False, name=None):
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+        name = name or file_path
+        target = self._path(name)
+        if skip_if_unchanged and os.path.exists(target) and compute_md5(target) == compute_md5(file_path):
+            return False
+        with open(file_path, "rb") as file_data:
+            self._write(name, iter(lambda: file_data.read(1024 * 1024), b""))
+        return True
+
+    def upload_stream(self, chunks, name):
+        size, sha256, content_md5 = self._write(name, chunks)
+        return {"blob_name": os.path.basename(name), "size": size, "sha256": sha256, "content_md5": content_md5}
+
+    def exists(self, name):
+        return os.path.isfile(self._path(name))
+
+    def urls(self, names):
+        return [pathlib.Path(self._path(name)).as_uri() for name in names]
+
+    def read(self, name):
+        with open(self._path(name), "rb") as file_data:
+            return file_data.read()
+
+    def delete(self, name):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def ensure(self):
+        os.makedirs(self.root, exist_ok=True)
+
+
+class InMemoryBackend(StorageBackend):
+    """Keeps documents in a dictionary, for tests and offline load tests."""
+
+    remote = False
+
+    def __init__(self):
+        self.documents = {}
+        self._lock = threading.Lock()
+
+    @timed("upload")
+    def upload(self, file_path, skip_if_unchanged=False, name=None):
+        with open(file_path, "rb") as file_data:
+            content = file_data.read()
+        name = os.path.basename(name or file_path)
+        with self._lock:
+            if skip_if_unchanged and self.documents.get(name) == content:
+                return False
+            self.documents[name] = content
+        return True
+
+    @timed("upload")
+    def upload_stream(self, chunks, name):
+        parts = []
+        size, sha256, content_md5 = _consume_stream(chunks, parts.append)
+        name = os.path.basename(name)
+        with self._lock:
+            self.documents[name] = b"".join(parts)
+        return {"blob_name": name, "size": size, "sha256": sha256, "content_md5": content_md5}
+
+    def exists(self, name):
+        with self._lock:
+            return os.path.basename(name) in self.documents
+
+    def urls(self, names):
+        return [f"memory://{os.path.basename(name)}" for name in names]
+
+    def ensure(self):
+        pass  # Nothing to prepare
+
+    def read(self, name):
+        with self._lock:
+            return self.documents[os.path.basename(name)]
+
+    def delete(self, name):
+        with self._lock:
+            return self.documents.pop(os.path.basename(name), None) is not None
+
+
+_BACKEND_FACTORIES = {
+    "blob": BlobSdkBackend,
+    "blob-http": BlobHttpBackend,
+    "file": FileShareBackend,
+    "file-http": lambda: FileShareBackend(use_http=True),
+    "local": lambda: LocalFileBackend(get_optional_env_variable("STORAGE_LOCAL_PATH", DEFAULT_LOCAL_STORAGE_PATH)),
+    "memory": InMemoryBackend,
+}
+STORAGE_BACKENDS = tuple(_BACKEND_FACTORIES)
+
+
+def get_storage_backend(name=None):
+    """
+    Returns the process-wide storage backend called `name`, or the one selected by STORAGE_BACKEND:
+    "blob" (default), "blob-http", "file", "file-http", "local" (at STORAGE_LOCAL_PATH) or "memory".
+    """
+    name = (name or get_optional_env_variable("STORAGE_BACKEND", DEFAULT_STORAGE_BACKEND)).lower()
+    if name not in _BACKEND_FACTORIES:
+        raise ValueError(f"Unknown storage backend: {name}")
+    with _lock:
+        backend = _backends.get(name)
+        if backend is None:
+            backend = _backends[name] = _BACKEND_FACTORIES[name]()
+        return backend
+
+
+def reset_storage_backends():
+    """Forgets the shared backends, including the contents of the in-memory one (mainly for tests)."""
+    with _lock:
+        _backends.clear()
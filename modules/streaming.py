@@ -0,0 +1,63 @@
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+import itertools
+
+DEFAULT_READ_SIZE = 64 * 1024
+
+
+def open_multipart_file(stream, content_type, field_name="file", read_size=DEFAULT_READ_SIZE):
+    """
+    Reads a multipart/form-data body from `stream` up to the start of the `field_name` file part.
+    Returns `(filename, chunks)`, where `chunks` yields the file's bytes as they are read from the
+    stream, so the file is never buffered in memory or spooled to disk. Returns `(None, None)`
+    when the body has no such file part.
+    """
+    mimetype, options = parse_options_header(content_type)
+    boundary = options.get("boundary")
+    if mimetype != "multipart/form-data" or not boundary:
+        raise ValueError("Expected a multipart/form-data body with a boundary.")
+
+    decoder = MultipartDecoder(boundary.encode("latin-1"))
+
+    def events():
+        while True:
+            data = stream.read(read_size)
+            # An empty read ends the body; the decoder flushes what is left
+            decoder.receive_data(data or None)
+            event = decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                yield event
+                event = decoder.next_event()
+            if isinstance(event, Epilogue) or not data:
+                return
+
+    event_iter = events()
+    for event in event_iter:
+        if isinstance(event, File) and event.name == field_name:
+            def chunks():
+                for data_event in event_iter:
+                    if isinstance(data_event, Data):
+                        if data_event.data:
+                            yield data_event.data
+                        if not data_event.more_data:
+                            return
+
+            return event.filename, chunks()
+    return None, None
+
+
+def read_if_small(chunks, max_bytes):
+    """
+    Reads `chunks` until more than `max_bytes` have arrived.
+    Returns `(content, None)` when the whole stream fits, or `(None, chunks)` with an iterator that
+    yields the bytes already read followed by the rest of the stream.
+    """
+    chunks = iter(chunks)
+    buffered = []
+    size = 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        size += len(chunk)
+        if size > max_bytes:
+            return None, itertools.chain(buffered, chunks)
+    return b"".join(buffered), None
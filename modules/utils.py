@@ -1,12 +1,76 @@
+import hashlib
+import importlib
 import os
-from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
+_environment_loaded = False
+
+
+def load_environment():
+    """Loads environment variables from the .env file, once, when the first one is read."""
+    global _environment_loaded
+    if not _environment_loaded:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        _environment_loaded = True
+
 
 def get_env_variable(key):
     """Fetches the value of an environment variable."""
+    load_environment()
     value = os.getenv(key)
     if not value:
         raise EnvironmentError(f"Environment variable {key} is missing.")
     return value
+
+
+def get_optional_env_variable(key, default=None):
+    """Fetches the value of an optional environment variable, falling back to `default`."""
+    load_environment()
+    return os.getenv(key) or default
+
+
+class LazyImport:
+    """
+    Stands in for `attribute` of `module`, importing the module the first time the attribute is called
+    or one of its own attributes is read, so that importing the code referring to it stays cheap.
+    Exception classes and isinstance checks need the real class: import those where they are used.
+    """
+
+    __slots__ = ("module", "attribute", "_target")
+
+    def __init__(self, module, attribute):
+        self.module = module
+        self.attribute = attribute
+        self._target = None
+
+    def resolve(self):
+        """Imports the module if needed and returns the attribute itself."""
+        if self._target is None:
+            self._target = getattr(importlib.import_module(self.module), self.attribute)
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __repr__(self):
+        return f"<lazy {self.module}.{self.attribute}>"
+
+
+def read_file_range(file_path, offset, length):
+    """Reads `length` bytes starting at `offset` without loading the rest of the file."""
+    with open(file_path, "rb") as file_data:
+        file_data.seek(offset)
+        return file_data.read(length)
+
+
+def compute_md5(file_path, chunk_size=1024 * 1024):
+    """Computes the MD5 digest of a file incrementally, `chunk_size` bytes at a time."""
+    digest = hashlib.md5()
+    with open(file_path, "rb") as file_data:
+        for chunk in iter(lambda: file_data.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.digest()
@@ -0,0 +1,50 @@
+import pytest
+from unittest.mock import patch
+from modules.analysis_cache import AnalysisCache
+from modules.clients import reset_clients
+from modules.metrics import enable_metrics, reset_metrics
+from modules.provisioning import reset_provisioning
+from modules.signing import reset_signing
+from modules.storage import reset_storage_backends
+
+
+@pytest.fixture(autouse=True)
+def reset_process_state():
+    """
+    Clears the process-wide client registry, verified containers/shares, signing caches, storage
+    backends and metrics around every test.
+    """
+    reset_clients()
+    reset_provisioning()
+    reset_signing()
+    reset_storage_backends()
+    enable_metrics(False)
+    reset_metrics()
+    yield
+    reset_clients()
+    reset_provisioning()
+    reset_signing()
+    reset_storage_backends()
+    enable_metrics(False)
+    reset_metrics()
+
+
+@pytest.fixture
+def documents(tmp_path):
+    """Six small PDF files with different contents under `drop/`."""
+    folder = tmp_path / "drop"
+    folder.mkdir()
+    paths = []
+    for index in range(6):
+        path = folder / f"invoice_{index}.pdf"
+        path.write_bytes(f"%PDF invoice {index}".encode())
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """A fresh analysis cache, used by the pipeline in place of the configured one."""
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite"))
+    with patch("modules.pipeline.get_analysis_cache", return_value=cache):
+        yield cache
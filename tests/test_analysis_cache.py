@@ -0,0 +1,62 @@
+import hashlib
+import pytest
+from unittest.mock import patch
+from modules.analysis_cache import AnalysisCache, hash_file
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "cache" / "analysis.sqlite")
+
+
+def test_hash_file(tmp_path):
+    """
+    Test that `hash_file` returns the SHA-256 of the file contents.
+    """
+    file_path = tmp_path / "invoice.pdf"
+    file_path.write_bytes(b"invoice contents" * 1000)
+
+    assert hash_file(str(file_path), chunk_size=64) == hashlib.sha256(b"invoice contents" * 1000).hexdigest()
+    print("Hash file test passed!")
+
+
+def test_cache_persists_across_instances(cache_path):
+    """
+    Test that insights stored by one cache instance are found by a new one through the disk layer.
+    """
+    insights = {"standard_fields": {"Total": {"value": "10.00", "confidence": 0.9, "bounding_box": [[1, 2]]}}}
+    AnalysisCache(cache_path).set("abc", "prebuilt-document", insights)
+
+    cache = AnalysisCache(cache_path)
+    assert cache.get("abc", "prebuilt-document") == insights
+    assert cache.get("abc", "prebuilt-invoice") is None
+    print("Cache persistence test passed!")
+
+
+def test_cache_memory_layer_evicts_least_recently_used(cache_path):
+    """
+    Test that the in-memory layer keeps at most `max_entries` entries, evicting the least recently used.
+    """
+    cache = AnalysisCache(cache_path, max_entries=2)
+    cache.set("a", "m", 1)
+    cache.set("b", "m", 2)
+    cache.get("a", "m")
+    cache.set("c", "m", 3)
+
+    assert list(cache._memory) == [("a", "m"), ("c", "m")]
+    assert cache.get("b", "m") == 2  # Still served from disk
+    print("Cache LRU eviction test passed!")
+
+
+def test_cache_expires_entries(cache_path):
+    """
+    Test that entries older than the TTL are treated as misses.
+    """
+    cache = AnalysisCache(cache_path, ttl_seconds=60)
+    with patch("modules.analysis_cache.time.time", return_value=1000.0):
+        cache.set("a", "m", {"value": 1})
+    with patch("modules.analysis_cache.time.time", return_value=1030.0):
+        assert cache.get("a", "m") == {"value": 1}
+    with patch("modules.analysis_cache.time.time", return_value=1100.0):
+        assert cache.get("a", "m") is None
+    print("Cache TTL test passed!")
@@ -0,0 +1,145 @@
+import pytest
+import requests
+import time
+from modules.analysis_scheduler import AnalysisScheduler, SchedulerFullError, TokenBucket
+
+
+@pytest.fixture
+def di_stub():
+    """
+    Runs the local Document Intelligence stand-in.
+    """
+    from benchmarks.stubs import DocumentIntelligenceStubHandler, StubServer
+
+    with StubServer(DocumentIntelligenceStubHandler) as server:
+        yield server
+
+
+class FlakySession:
+    """Drops the first connections of each method, then sends requests through a real session."""
+
+    def __init__(self, **drops):
+        self.drops = drops
+        self._session = requests.Session()
+
+    def _send(self, method, url, **kwargs):
+        if self.drops.get(method):
+            self.drops[method] -= 1
+            raise requests.ConnectionError("Connection reset by peer")
+        return getattr(self._session, method)(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._send("post", url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self._send("get", url, **kwargs)
+
+
+def scheduler_for(server, **options):
+    options.setdefault("min_poll_interval", 0.01)
+    options.setdefault("max_poll_interval", 0.05)
+    return AnalysisScheduler(endpoint=server.url, key="test-key", **options)
+
+
+def test_scheduler_tracks_many_operations(di_stub):
+    """
+    Test that concurrent analyses complete with their own results while the in-flight budget is respected.
+    """
+    di_stub.httpd.analysis_polls = 3
+    with scheduler_for(di_stub, max_in_flight=3, rate=1000, burst=1000) as scheduler:
+        futures = [scheduler.submit(url=f"https://blob/invoice_{index}.pdf") for index in range(10)]
+        futures.append(scheduler.submit(document=b"%PDF direct"))
+        results = [future.result(timeout=10) for future in futures]
+
+    assert [result.content for result in results[:10]] == [f"https://blob/invoice_{index}.pdf" for index in range(10)]
+    assert results[10].content == "%PDF direct"
+    assert results[0].pages[0].page_number == 1
+    assert di_stub.peak_running <= 3
+    print("Scheduler many operations test passed!")
+
+
+def test_scheduler_honours_retry_after(di_stub):
+    """
+    Test that a 429 on submission pauses submissions for the Retry-After delay before retrying.
+    """
+    di_stub.fail(":analyze", times=1, status=429, headers={"Retry-After": "0.3"})
+    with scheduler_for(di_stub) as scheduler:
+        started = time.monotonic()
+        result = scheduler.analyze(url="https://blob/invoice.pdf")
+        elapsed = time.monotonic() - started
+
+    assert result.content == "https://blob/invoice.pdf"
+    assert elapsed >= 0.3
+    assert scheduler.throttled == 1
+    assert sum(":analyze" in path for method, path in di_stub.requests) == 2
+    print("Scheduler Retry-After test passed!")
+
+
+def test_scheduler_pushes_back_when_full(di_stub):
+    """
+    Test that a submission waits for an in-flight slot and gives up after its timeout.
+    """
+    di_stub.httpd.analysis_polls = 5
+    with scheduler_for(di_stub, max_in_flight=1) as scheduler:
+        first = scheduler.submit(url="https://blob/first.pdf")
+        with pytest.raises(SchedulerFullError):
+            scheduler.submit(url="https://blob/second.pdf", timeout=0.05)
+        assert first.result(timeout=10).content == "https://blob/first.pdf"
+        assert scheduler.submit(url="https://blob/third.pdf", timeout=5).result(timeout=10) is not None
+    print("Scheduler backpressure test passed!")
+
+
+def test_scheduler_gives_up_on_failing_and_endless_operations(di_stub):
+    """
+    Test that polls failing with retryable statuses are retried up to max_retries times in a row, and
+    that an operation still running after operation_timeout fails instead of being polled forever.
+    """
+    di_stub.fail("/analyzeResults/", times=2, status=503)
+    with scheduler_for(di_stub, max_retries=2, retry_backoff=0.01) as scheduler:
+        assert scheduler.analyze(url="https://blob/recovers.pdf").content == "https://blob/recovers.pdf"
+
+        di_stub.fail("/analyzeResults/", times=3, status=503)
+        with pytest.raises(requests.HTTPError):
+            scheduler.analyze(url="https://blob/unavailable.pdf")
+
+    di_stub.httpd.analysis_polls = 1000
+    with scheduler_for(di_stub, operation_timeout=0.1) as scheduler:
+        with pytest.raises(TimeoutError):
+            scheduler.submit(url="https://blob/endless.pdf").result(timeout=10)
+    print("Scheduler retry limit test passed!")
+
+
+def test_scheduler_retries_connection_errors_on_submit_and_poll(di_stub):
+    """
+    Test that dropped connections are retried on submission and while polling, like retryable statuses.
+    """
+    session = FlakySession(post=2, get=2)
+    with scheduler_for(di_stub, session=session, max_retries=2, retry_backoff=0.01) as scheduler:
+        assert scheduler.analyze(url="https://blob/invoice.pdf").content == "https://blob/invoice.pdf"
+        session.drops["post"] = 3
+        with pytest.raises(requests.ConnectionError):
+            scheduler.analyze(url="https://blob/unreachable.pdf")
+    assert session.drops == {"post": 0, "get": 0}
+    print("Scheduler connection error test passed!")
+
+
+def test_token_bucket_limits_rate():
+    """
+    Test that the bucket allows a burst, then one acquisition per 1/rate seconds, and stops during a pause.
+    """
+    now = [0.0]
+    waits = []
+
+    def sleep(seconds):
+        waits.append(round(seconds, 6))
+        now[0] += seconds
+
+    bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0], sleep=sleep)
+    for _ in range(4):
+        bucket.acquire()
+    assert waits == [0.5, 0.5]
+
+    bucket.pause(3)
+    bucket.acquire()
+    assert now[0] == pytest.approx(4.5)  # 3 seconds paused, then half a second for a new token
+    print("Token bucket test passed!")
@@ -0,0 +1,96 @@
+import asyncio
+import pytest
+import threading
+from unittest.mock import patch, MagicMock
+from modules.async_api import analyze_document, close_async_clients, upload_blob
+from modules.utils import compute_md5
+
+
+def test_upload_blob_async(monkeypatch, tmp_path):
+    """
+    Test that concurrent async uploads share one client and reach the Blob stand-in.
+    """
+    from benchmarks.stubs import StubServer
+
+    paths = []
+    for index in range(5):
+        path = tmp_path / f"invoice_{index}.pdf"
+        path.write_bytes(f"%PDF {index}".encode())
+        paths.append(str(path))
+
+    async def scenario():
+        try:
+            return await asyncio.gather(*(upload_blob(path, timeout=10) for path in paths))
+        finally:
+            await close_async_clients()
+
+    with StubServer() as server:
+        monkeypatch.setenv("AZURE_STORAGE_BLOB_ENDPOINT", f"{server.url}/acct")
+        monkeypatch.setenv("AZURE_STORAGE_BLOB_CONTAINER_NAME", "invoices")
+        assert asyncio.run(scenario()) == [True] * 5
+
+    assert server.blobs["invoices/invoice_3.pdf"] == b"%PDF 3"
+    assert sum("restype=container" in path for method, path in server.requests if method == "PUT") == 1
+    print("Async upload blob test passed!")
+
+
+def test_upload_blob_async_reads_off_the_event_loop(monkeypatch, tmp_path):
+    """
+    Test that the file is hashed and read in worker threads, not on the event loop's thread.
+    """
+    from benchmarks.stubs import StubServer
+
+    path = tmp_path / "invoice.pdf"
+    path.write_bytes(b"%PDF " + bytes(range(256)) * 4096)
+    hashing_threads = []
+
+    def hash_in_thread(file_path):
+        hashing_threads.append(threading.current_thread())
+        return compute_md5(file_path)
+
+    async def scenario():
+        try:
+            return [await upload_blob(str(path), skip_if_unchanged=True, timeout=10) for _ in range(2)]
+        finally:
+            await close_async_clients()
+
+    with StubServer() as server, patch("modules.async_api.compute_md5", side_effect=hash_in_thread):
+        monkeypatch.setenv("AZURE_STORAGE_BLOB_ENDPOINT", f"{server.url}/acct")
+        monkeypatch.setenv("AZURE_STORAGE_BLOB_CONTAINER_NAME", "invoices")
+        assert asyncio.run(scenario()) == [True, False]
+
+    assert server.blobs["invoices/invoice.pdf"] == path.read_bytes()
+    assert len(hashing_threads) == 2 and threading.main_thread() not in hashing_threads
+    print("Async upload off-loop test passed!")
+
+
+@patch("modules.async_api.DocumentAnalysisClient")
+def test_analyze_document_async(mock_document_client):
+    """
+    Test that `analyze_document` awaits the poller result and honours the timeout.
+    """
+    async def result(delay):
+        await asyncio.sleep(delay)
+        return "analysis"
+
+    delays = iter([0, 5])
+
+    async def begin_analyze(model_id, document_url):
+        poller = MagicMock()
+        poller.result.side_effect = lambda: result(next(delays))
+        return poller
+
+    mock_document_client.return_value.begin_analyze_document_from_url.side_effect = begin_analyze
+    mock_document_client.return_value.close.side_effect = lambda: asyncio.sleep(0)
+
+    async def scenario():
+        try:
+            assert await analyze_document("https://blob/invoice.pdf?sas") == "analysis"
+            with pytest.raises(asyncio.TimeoutError):
+                await analyze_document("https://blob/invoice.pdf?sas", timeout=0.05)
+        finally:
+            await close_async_clients()
+
+    asyncio.run(scenario())
+    assert mock_document_client.call_count == 1
+    print("Async analyze document test passed!")
@@ -1,6 +1,11 @@
+import base64
+import hashlib
 import pytest
 from unittest.mock import patch, MagicMock, ANY
-from modules.azure_blob import upload_blob_with_sdk, upload_blob_with_http, generate_blob_url
+from urllib.parse import quote
+from modules.azure_blob import (
+    upload_blob_with_sdk, upload_blob_with_http, upload_blob_in_blocks, upload_blob_from_stream, generate_blob_url
+)
 
 @patch("modules.azure_blob.BlobServiceClient")
 def test_upload_blob_with_sdk(mock_blob_service_client):
@@ -19,13 +24,37 @@ def test_upload_blob_with_sdk(mock_blob_service_client):
     print("Upload blob with SDK test passed!")
 
 
-@patch("modules.azure_blob.requests.put")
-def test_upload_blob_with_http(mock_put):
+@patch("modules.azure_blob.BlobServiceClient")
+def test_upload_blob_with_sdk_skips_unchanged(mock_blob_service_client, tmp_path):
+    """
+    Test that `skip_if_unchanged` compares the blob's Content-MD5 and skips a matching upload.
+    """
+    file_path = tmp_path / "Invoice1.pdf"
+    file_path.write_bytes(b"%PDF invoice")
+    mock_blob_client = MagicMock()
+    mock_blob_service_client.return_value.get_blob_client.return_value = mock_blob_client
+    mock_blob_client.get_blob_properties.return_value.content_settings.content_md5 = bytearray(
+        hashlib.md5(b"%PDF invoice").digest()
+    )
+
+    assert upload_blob_with_sdk(str(file_path), skip_if_unchanged=True) is False
+    mock_blob_client.upload_blob.assert_not_called()
+
+    file_path.write_bytes(b"%PDF another invoice")
+    assert upload_blob_with_sdk(str(file_path), skip_if_unchanged=True) is True
+    content_settings = mock_blob_client.upload_blob.call_args.kwargs["content_settings"]
+    assert bytes(content_settings.content_md5) == hashlib.md5(b"%PDF another invoice").digest()
+    print("Upload blob with SDK skip unchanged test passed!")
+
+
+@patch("modules.azure_blob.get_http_session")
+def test_upload_blob_with_http(mock_get_http_session):
     """
     Test that `upload_blob_with_http` uploads a file successfully using HTTP.
     """
     mock_response = MagicMock()
     mock_response.status_code = 201
+    mock_put = mock_get_http_session.return_value.put
     mock_put.return_value = mock_response
 
     with patch("os.path.exists", return_value=True):
@@ -46,3 +75,103 @@ def test_generate_blob_url(mock_blob_service_client):
     print("Generate blob URL test passed!")
 
 
+
+
+@pytest.fixture
+def blob_stub(monkeypatch, tmp_path):
+    """
+    Runs the local Blob REST stand-in and points the Blob helpers at it.
+    """
+    from benchmarks.stubs import StubServer
+
+    with StubServer() as server:
+        monkeypatch.setenv("AZURE_STORAGE_BLOB_ENDPOINT", f"{server.url}/acct")
+        monkeypatch.setenv("AZURE_STORAGE_BLOB_CONTAINER_NAME", "invoices")
+        monkeypatch.setattr("modules.azure_blob.RETRY_BACKOFF_SECONDS", 0)
+        yield server
+
+
+def test_upload_blob_in_blocks(blob_stub, tmp_path):
+    """
+    Test that `upload_blob_in_blocks` stages every block and commits them in order.
+    """
+    file_path = tmp_path / "large.pdf"
+    content = bytes(range(256)) * 1000  # 256,000 bytes -> 4 blocks of 64 KiB
+    file_path.write_bytes(content)
+    progress = []
+
+    upload_blob_in_blocks(str(file_path), block_size=64 * 1024, max_concurrency=3,
+                          progress_callback=lambda uploaded, total: progress.append((uploaded, total)))
+
+    assert blob_stub.blobs["invoices/large.pdf"] == content
+    put_blocks = [path for method, path in blob_stub.requests if "comp=block&" in path]
+    assert len(put_blocks) == 4
+    assert progress[-1] == (len(content), len(content))
+    print("Upload blob in blocks test passed!")
+
+
+def test_upload_blob_in_blocks_retries_only_failed_block(blob_stub, tmp_path):
+    """
+    Test that a failing block is retried on its own while the other blocks are sent once.
+    """
+    file_path = tmp_path / "retry.pdf"
+    content = b"x" * 3000
+    file_path.write_bytes(content)
+    second_block_id = quote(base64.b64encode(b"00000001").decode(), safe="")
+    blob_stub.fail(f"blockid={second_block_id}", times=2, status=503)
+
+    upload_blob_in_blocks(str(file_path), block_size=1000, max_concurrency=2)
+
+    block_requests = [path for method, path in blob_stub.requests if "comp=block&" in path]
+    assert len(block_requests) == 5  # 3 blocks + 2 retries of the second block
+    assert sum(second_block_id in path for path in block_requests) == 3
+    assert blob_stub.blobs["invoices/retry.pdf"] == content
+    print("Upload blob in blocks retry test passed!")
+
+
+def test_upload_blob_from_stream(blob_stub):
+    """
+    Test that a stream of uneven chunks is re-blocked, committed in order and hashed on the fly.
+    """
+    content = bytes(range(256)) * 100  # 25,600 bytes -> 7 blocks of 4,000 bytes
+    chunks = (content[offset:offset + 1500] for offset in range(0, len(content), 1500))
+
+    blob = upload_blob_from_stream(chunks, "streamed.pdf", block_size=4000, max_concurrency=2)
+
+    assert blob_stub.blobs["invoices/streamed.pdf"] == content
+    assert blob["size"] == len(content)
+    assert blob["sha256"] == hashlib.sha256(content).hexdigest()
+    assert blob["content_md5"] == base64.b64encode(hashlib.md5(content).digest()).decode()
+    assert blob_stub.httpd.content_md5["invoices/streamed.pdf"] == blob["content_md5"]
+    assert len([path for method, path in blob_stub.requests if "comp=block&" in path]) == 7
+    print("Upload blob from stream test passed!")
+
+
+def test_upload_blob_with_http_skips_unchanged(blob_stub, tmp_path):
+    """
+    Test that `skip_if_unchanged` costs a single HEAD request when the blob is already up to date.
+    """
+    file_path = tmp_path / "same.pdf"
+    file_path.write_bytes(b"%PDF unchanged")
+
+    assert upload_blob_with_http(str(file_path), skip_if_unchanged=True) is True
+    request_count = len(blob_stub.requests)
+    assert upload_blob_with_http(str(file_path), skip_if_unchanged=True) is False
+    assert blob_stub.requests[request_count:] == [("HEAD", "/acct/invoices/same.pdf")]
+
+    assert upload_blob_in_blocks(str(file_path), block_size=4, skip_if_unchanged=True) is False
+    print("Upload blob with HTTP skip unchanged test passed!")
+
+
+def test_upload_blob_with_http_creates_container_once(blob_stub, tmp_path):
+    """
+    Test that the container-create request is only sent by the first upload of the process.
+    """
+    for name in ("first.pdf", "second.pdf"):
+        (tmp_path / name).write_bytes(b"%PDF " + name.encode())
+        upload_blob_with_http(str(tmp_path / name))
+
+    container_requests = [path for method, path in blob_stub.requests if "restype=container" in path]
+    assert len(container_requests) == 1
+    assert blob_stub.blobs["invoices/second.pdf"] == b"%PDF second.pdf"
+    print("Upload blob with HTTP container once test passed!")
@@ -1,6 +1,6 @@
 import pytest
 from unittest.mock import patch, MagicMock
-from modules.azure_file import upload_file_with_sdk, upload_file_with_http, generate_file_url
+from modules.azure_file import upload_file_with_sdk, upload_file_with_http, generate_file_url, MAX_RANGE_SIZE
 
 
 @patch("modules.azure_file.ShareServiceClient")
@@ -18,13 +18,14 @@ def test_upload_file_with_sdk(mock_share_service_client):
     print("Upload file with SDK test passed!")
 
 
-@patch("modules.azure_file.requests.put")
-def test_upload_file_with_http(mock_put):
+@patch("modules.azure_file.get_http_session")
+def test_upload_file_with_http(mock_get_http_session):
     """
     Test that `upload_file_with_http` uploads a file successfully using HTTP.
     """
     mock_response = MagicMock()
     mock_response.status_code = 201
+    mock_put = mock_get_http_session.return_value.put
     mock_put.return_value = mock_response
 
     with patch("os.path.exists", return_value=True):
@@ -49,15 +50,69 @@ def test_upload_file_with_http(mock_put):
     print("Upload file with HTTP test passed!")
 
 
-@patch("modules.azure_file.generate_file_sas")
-def test_generate_file_url(mock_generate_file_sas):
+def test_generate_file_url():
     """
     Test that `generate_file_url` generates a valid SAS URL.
     """
-    mock_generate_file_sas.return_value = "mock_sas_token"
-
     with patch("os.path.basename", return_value="Invoice1.pdf"):
         result = generate_file_url("./resources/Invoice1.pdf")
 
-    assert "mock_sas_token" in result
+    assert "/Invoice1.pdf?" in result
+    assert "sr=f" in result and "sp=r" in result and "sig=" in result
     print("Generate file URL test passed!")
+
+
+def test_upload_file_with_http_writes_ranges_concurrently(monkeypatch, tmp_path, capsys):
+    """
+    Test that `upload_file_with_http` splits the contents into bounded ranges that reassemble the file.
+    """
+    from benchmarks.stubs import StubServer, FileStubHandler
+
+    file_path = tmp_path / "scan.pdf"
+    content = bytes(range(256)) * 40  # 10,240 bytes -> 10 ranges of 1 KiB
+    file_path.write_bytes(content)
+
+    with StubServer(FileStubHandler) as server:
+        monkeypatch.setenv("AZURE_STORAGE_FILE_ENDPOINT", f"{server.url}/acct")
+        monkeypatch.setenv("AZURE_STORAGE_SHARE_NAME", "documents")
+        uploaded = upload_file_with_http(str(file_path), range_size=1024, max_concurrency=4)
+
+    assert bytes(server.files["documents/scan.pdf"]) == content
+    assert len(server.range_writes) == 10
+    assert all(end - start + 1 <= 1024 for _, start, end in server.range_writes)
+    assert uploaded is True
+    assert "MiB/s" in capsys.readouterr().out
+    print("Upload file with HTTP range writes test passed!")
+
+
+def test_upload_file_with_http_rejects_oversized_ranges():
+    """
+    Test that range sizes above the service's 4 MiB limit are rejected up front.
+    """
+    with patch("os.path.exists", return_value=True):
+        with pytest.raises(ValueError):
+            upload_file_with_http("./resources/Invoice1.pdf", range_size=MAX_RANGE_SIZE + 1)
+    print("Oversized range test passed!")
+
+
+def test_upload_file_with_http_skips_unchanged(monkeypatch, tmp_path):
+    """
+    Test that `skip_if_unchanged` avoids re-uploading a file whose Content-MD5 already matches.
+    """
+    from benchmarks.stubs import StubServer, FileStubHandler
+
+    file_path = tmp_path / "same.pdf"
+    file_path.write_bytes(b"%PDF unchanged")
+
+    with StubServer(FileStubHandler) as server:
+        monkeypatch.setenv("AZURE_STORAGE_FILE_ENDPOINT", f"{server.url}/acct")
+        assert upload_file_with_http(str(file_path), skip_if_unchanged=True) is True
+        request_count = len(server.requests)
+        assert upload_file_with_http(str(file_path), skip_if_unchanged=True) is False
+
+        file_path.write_bytes(b"%PDF changed")
+        assert upload_file_with_http(str(file_path), skip_if_unchanged=True) is True
+
+    assert server.requests[request_count][0] == "HEAD"
+    assert len(server.requests) == request_count + 1 + 3  # One HEAD when skipped, then HEAD, create file, one range
+    print("Upload file with HTTP skip unchanged test passed!")
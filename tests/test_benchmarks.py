@@ -0,0 +1,60 @@
+import requests
+from benchmarks import bench_startup
+from benchmarks.bench_end_to_end import compare_results, percentile, summarize
+from benchmarks.stubs import StubServer
+
+
+def test_stub_injects_latency_and_throttling():
+    """
+    Test that the stand-ins delay every request and answer the configured share of them with 429.
+    """
+    with StubServer(latency=0.01, throttle_rate=1.0, retry_after=2) as server:
+        response = requests.get(f"{server.url}/acct/invoices/invoice.pdf")
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "2"
+        assert response.elapsed.total_seconds() >= 0.01
+    with StubServer(error_rate=0.5, seed=1) as server:
+        statuses = [requests.get(f"{server.url}/acct/invoices/missing.pdf").status_code for _ in range(40)]
+    assert set(statuses) == {404, 500}
+    assert server.failures_served == {500: statuses.count(500)}
+    print("Stub fault injection test passed!")
+
+
+def test_percentiles_and_regression_comparison():
+    """
+    Test the nearest-rank percentiles and that slower or less productive runs are flagged as regressions.
+    """
+    assert percentile(list(range(1, 101)), 0.95) == 95
+    assert percentile([], 0.5) is None
+
+    previous = {"results": [summarize("analyze_file", 4, [0.1] * 10, 0, 1.0)]}
+    same = {"results": [summarize("analyze_file", 4, [0.105] * 10, 0, 1.0)]}
+    slower = {"results": [summarize("analyze_file", 4, [0.2] * 10, 0, 2.0)]}
+    assert compare_results(previous, same)[0][-1] is False
+    scenario, concurrency, p95_change, throughput_change, regressed = compare_results(previous, slower)[0]
+    assert (scenario, concurrency, regressed) == ("analyze_file", 4, True)
+    assert round(p95_change) == 100 and round(throughput_change) == -50
+    print("Benchmark comparison test passed!")
+
+
+def test_startup_importtime_parsing_and_comparison():
+    """
+    Test that the `-X importtime` report is parsed into per-module rows and that a slower cold start is flagged.
+    """
+    report = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |   _io\n"
+        "import time:      3000 |       3000 |     azure.core\n"
+        "import time:       500 |       3500 |   azure\n"
+        "import time:      1000 |       4620 | main\n"
+    )
+    rows = bench_startup.parse_importtime(report)
+    assert rows[0] == ("_io", 120, 120, 1)
+    assert rows[-1] == ("main", 1000, 4620, 0)
+    assert bench_startup.slowest_packages(rows, 2) == [("azure", 3.5), ("main", 1.0)]
+
+    previous = {"results": [{"entry_point": "main", "median_ms": 80.0}]}
+    slower = {"results": [{"entry_point": "main", "median_ms": 100.0}]}
+    assert bench_startup.compare_results(previous, slower) == [("main", 25.0, True)]
+    assert bench_startup.compare_results(previous, slower, threshold=30)[0][-1] is False
+    print("Startup benchmark parsing test passed!")
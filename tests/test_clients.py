@@ -0,0 +1,56 @@
+import pytest
+import threading
+from unittest.mock import MagicMock
+from azure.core.credentials import AzureKeyCredential
+from modules.clients import get_client, get_http_session, configure_pool
+
+
+def test_get_client_reuses_instance_per_configuration():
+    """
+    Test that `get_client` builds one client per configuration and reuses it afterwards.
+    """
+    client_class = MagicMock(side_effect=lambda **kwargs: MagicMock())
+
+    first = get_client(client_class, endpoint="https://a", credential=AzureKeyCredential("key"))
+    second = get_client(client_class, endpoint="https://a", credential=AzureKeyCredential("key"))
+    other = get_client(client_class, endpoint="https://b", credential=AzureKeyCredential("key"))
+
+    assert first is second
+    assert first is not other
+    assert client_class.call_count == 2
+    transport = client_class.call_args.kwargs["transport"]
+    assert transport.session is get_http_session()
+    print("Client registry reuse test passed!")
+
+
+def test_get_client_is_thread_safe():
+    """
+    Test that concurrent callers share a single client instance.
+    """
+    client_class = MagicMock(side_effect=lambda **kwargs: object())
+    results = []
+
+    def worker():
+        results.append(get_client(client_class, account_url="https://acct", credential="key"))
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert client_class.call_count == 1
+    assert all(result is results[0] for result in results)
+    print("Client registry thread safety test passed!")
+
+
+def test_configure_pool_sets_adapter_sizes():
+    """
+    Test that `configure_pool` rebuilds the shared session with the requested pool sizes.
+    """
+    configure_pool(pool_connections=3, pool_maxsize=7)
+    adapter = get_http_session().get_adapter("https://example.com")
+
+    assert adapter._pool_connections == 3
+    assert adapter._pool_maxsize == 7
+    print("Configure pool test passed!")
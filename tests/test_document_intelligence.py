@@ -1,7 +1,9 @@
 import pytest
 from unittest.mock import patch, MagicMock, ANY
 from azure.ai.formrecognizer import AnalyzeResult
-from modules.document_intelligence import analyze_invoice_with_sdk, extract_invoice_insights
+from modules.document_intelligence import (
+    analyze_invoice_bytes_with_sdk, analyze_invoice_with_sdk, build_table_grid, extract_invoice_insights
+)
 from modules.azure_blob import upload_blob_with_sdk, generate_blob_url
 
 @patch("modules.document_intelligence.DocumentAnalysisClient")
@@ -37,6 +39,21 @@ def test_analyze_invoice_with_sdk(mock_blob_service_client, mock_document_client
     print("Analyze Invoice with SDK test passed!")
 
 
+@patch("modules.document_intelligence.DocumentAnalysisClient")
+def test_analyze_invoice_bytes_with_sdk(mock_document_client):
+    """
+    Test that document bytes are sent with `begin_analyze_document` instead of a URL.
+    """
+    mock_client_instance = mock_document_client.return_value
+    mock_client_instance.begin_analyze_document.return_value.result.return_value = AnalyzeResult()
+
+    result = analyze_invoice_bytes_with_sdk(b"%PDF invoice")
+    assert result is not None
+    mock_client_instance.begin_analyze_document.assert_called_once_with("prebuilt-document", b"%PDF invoice")
+    mock_client_instance.begin_analyze_document_from_url.assert_not_called()
+    print("Analyze Invoice bytes with SDK test passed!")
+
+
 def test_extract_invoice_insights():
     """
     Test the `extract_invoice_insights` function with a mock analysis result.
@@ -54,3 +71,128 @@ def test_extract_invoice_insights():
     assert insights["standard_fields"]["Key1"]["value"] == "Value1"
     assert insights["standard_fields"]["Key2"]["confidence"] == 0.8
     print("Extract Invoice Insights test passed!")
+
+
+def test_build_table_grid_handles_spans_and_columnar_output():
+    """
+    Test that `build_table_grid` fills spanned positions and can emit one list per column.
+    """
+    table = MagicMock(row_count=3, column_count=3, cells=[
+        MagicMock(row_index=0, column_index=0, row_span=1, column_span=2, content="Header"),
+        MagicMock(row_index=0, column_index=2, row_span=3, column_span=1, content="Side"),
+        MagicMock(row_index=1, column_index=0, row_span=1, column_span=1, content="a"),
+        MagicMock(row_index=2, column_index=1, row_span=1, column_span=1, content="b"),
+    ])
+
+    assert build_table_grid(table) == [
+        ["Header", "Header", "Side"],
+        ["a", "", "Side"],
+        ["", "b", "Side"],
+    ]
+    assert build_table_grid(table, columnar=True) == [
+        ["Header", "a", ""],
+        ["Header", "", "b"],
+        ["Side", "Side", "Side"],
+    ]
+    print("Build table grid test passed!")
+
+
+def test_extract_invoice_insights_tables():
+    """
+    Test that tables are reconstructed using the table's declared column count.
+    """
+    mock_analysis_result = MagicMock(key_value_pairs=[], documents=[], figures=[], barcodes=[])
+    mock_analysis_result.tables = [MagicMock(row_count=2, column_count=3, cells=[
+        MagicMock(row_index=0, column_index=0, row_span=None, column_span=None, content="Item"),
+        MagicMock(row_index=1, column_index=1, row_span=None, column_span=None, content="10"),
+    ])]
+
+    insights = extract_invoice_insights(mock_analysis_result, columnar_tables=True)
+    assert insights["tables"][0]["data"] == [["Item", "", ""], ["", "10", ""]]
+    assert insights["tables"][0]["columns"] == [["Item", ""], ["", "10"], ["", ""]]
+    print("Extract Invoice Insights tables test passed!")
+
+
+def test_compact_insights_match_the_dictionary_format(tmp_path):
+    """
+    Test that the compact insights build the same sections as the nested dictionaries, lazily and
+    through both key and attribute access, and that they are cached in their dictionary form.
+    """
+    from azure.ai.formrecognizer import Point
+    from azure.ai.formrecognizer._generated.v2023_07_31.models import AnalyzeResult as GeneratedAnalyzeResult
+    from modules.analysis_cache import AnalysisCache
+
+    def element(text, polygon=(1.0, 2.0, 3.0, 2.0, 3.0, 4.0, 1.0, 4.0)):
+        return {"content": text, "spans": [], "boundingRegions": [{"pageNumber": 1, "polygon": list(polygon)}]}
+
+    analysis_result = AnalyzeResult._from_generated(GeneratedAnalyzeResult.deserialize({
+        "apiVersion": "2023-07-31", "modelId": "prebuilt-document", "content": "",
+        "pages": [{"pageNumber": 1, "spans": []}],
+        "keyValuePairs": [
+            {"key": element("Invoice"), "value": element("INV-1"), "confidence": 0.9},
+            {"key": element("Total"), "confidence": 0.5},
+        ],
+        "tables": [{"rowCount": 2, "columnCount": 2, "spans": [], "cells": [
+            {"rowIndex": 0, "columnIndex": 0, "columnSpan": 2, "content": "Header", "spans": []},
+            {"rowIndex": 1, "columnIndex": 1, "content": "10", "spans": []},
+        ]}],
+        "documents": [{"docType": "invoice", "spans": [], "confidence": 1.0, "fields": {
+            "VendorName": {"type": "string", "content": "Contoso", "confidence": 0.7, "spans": [],
+                           "boundingRegions": [{"pageNumber": 1, "polygon": [0, 0, 1, 0, 1, 1, 0, 1]}]},
+        }}],
+    }))
+
+    insights = extract_invoice_insights(analysis_result, columnar_tables=True)
+    box = [Point(x=1.0, y=2.0), Point(x=3.0, y=2.0), Point(x=3.0, y=4.0), Point(x=1.0, y=4.0)]
+    assert insights.to_dict() == {
+        "standard_fields": {
+            "Invoice": {"value": "INV-1", "confidence": 0.9, "bounding_box": box},
+            "Total": {"value": "No value", "confidence": 0.5, "bounding_box": box},
+        },
+        "custom_fields": {"VendorName": {"value": "Contoso", "confidence": 0.7, "bounding_box": [
+            Point(x=0.0, y=0.0), Point(x=1.0, y=0.0), Point(x=1.0, y=1.0), Point(x=0.0, y=1.0)
+        ]}},
+        "tables": [{"row_count": 2, "column_count": 2, "data": [["Header", "Header"], ["", "10"]],
+                    "columns": [["Header", ""], ["Header", "10"]]}],
+        "images": [],
+        "barcodes": [],
+    }
+    assert insights.standard_fields == insights["standard_fields"]
+    assert "tables" in insights and insights.get("query_fields", {}) == {}
+
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite"))
+    cache.set("hash", "prebuilt-document", insights)
+    assert cache.get("hash", "prebuilt-document")["standard_fields"]["Invoice"]["bounding_box"][0] == [1.0, 2.0]
+    print("Compact insights test passed!")
+
+
+def test_compact_insight_sections_are_built_once_and_keep_missing_confidences():
+    """
+    Test that each section of the compact insights is built on its first access and reused after it,
+    and that missing and integer confidences come back unchanged rather than as 0.0.
+    """
+    import json
+    from azure.ai.formrecognizer._generated.v2023_07_31.models import AnalyzeResult as GeneratedAnalyzeResult
+    from modules.insights import json_default
+
+    analysis_result = AnalyzeResult._from_generated(GeneratedAnalyzeResult.deserialize({
+        "apiVersion": "2023-07-31", "modelId": "prebuilt-invoice", "content": "",
+        "pages": [{"pageNumber": 1, "spans": []}],
+        "keyValuePairs": [{"key": {"content": "Invoice", "spans": []}, "confidence": 0.9}],
+        "documents": [{"docType": "invoice", "spans": [], "confidence": 1.0, "fields": {
+            "VendorName": {"type": "string", "content": "Contoso", "spans": []},
+            "Total": {"type": "string", "content": "10", "confidence": 0.5, "spans": []},
+        }}],
+    }))
+
+    insights = extract_invoice_insights(analysis_result)
+
+    assert insights.custom_fields is insights.custom_fields
+    assert insights["tables"] is insights.tables
+    assert insights.to_dict()["standard_fields"] is insights.standard_fields
+    assert insights.custom_fields["VendorName"]["confidence"] is None
+    assert insights.custom_fields["Total"]["confidence"] == 0.5
+    assert insights.standard_fields["Invoice"]["confidence"] == 0.9
+    line = json.loads(json.dumps(insights.to_dict(), default=json_default))
+    assert line["custom_fields"]["VendorName"]["confidence"] is None
+    print("Compact insight sections test passed!")
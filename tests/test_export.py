@@ -0,0 +1,74 @@
+import csv
+import json
+import pytest
+from modules import export
+from modules.export import InsightsExporter, append_jsonl, document_name
+
+
+INSIGHTS = {
+    "standard_fields": {"Total": {"value": "10.00", "confidence": 0.9}},
+    "custom_fields": {"Reference": {"value": "R-1", "confidence": 0.7}},
+    "tables": [{"row_count": 2, "column_count": 2, "data": [["Item", "Price"], ["Pen", "1.50"]]}],
+    "images": [],
+    "barcodes": [],
+}
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8") as input_file:
+        return [json.loads(line) for line in input_file]
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_exporter_appends_jsonl_and_writes_each_table_once(tmp_path, monkeypatch, use_orjson):
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(export, "orjson", None)
+    name = document_name("/data/invoice 1.pdf", "0123456789abcdef")
+    assert name == "invoice 1.pdf-0123456789ab"
+
+    with InsightsExporter(str(tmp_path)) as exporter:
+        exporter.write(name, INSIGHTS, status="analyzed")
+    table_path = tmp_path / "tables" / "invoice_1.pdf-0123456789ab-table-1.csv"
+    table_path.write_text("kept\n")
+
+    # A second run appends its line and leaves the tables already exported alone
+    with InsightsExporter(str(tmp_path)) as exporter:
+        exporter.write(name, INSIGHTS)
+
+    lines = read_lines(tmp_path / "insights.jsonl")
+    assert [line["document"] for line in lines] == [name, name]
+    assert lines[0]["status"] == "analyzed"
+    assert lines[0]["insights"]["standard_fields"]["Total"]["value"] == "10.00"
+    assert table_path.read_text() == "kept\n"
+
+
+def test_exporter_writes_table_csv_and_streams_events(tmp_path):
+    with InsightsExporter(str(tmp_path)) as exporter:
+        exporter.write("doc", INSIGHTS)
+    with open(tmp_path / "tables" / "doc-table-1.csv", newline="", encoding="utf-8") as table_file:
+        assert list(csv.reader(table_file)) == [["Item", "Price"], ["Pen", "1.50"]]
+
+    events = ({"event": "table_row", "row": [index]} for index in range(3))
+    assert append_jsonl(str(tmp_path / "events.jsonl"), events, buffer_size=16) == 3
+    assert append_jsonl(str(tmp_path / "events.jsonl"), iter([{"event": "barcode"}])) == 1
+    assert len(read_lines(tmp_path / "events.jsonl")) == 4
+
+
+def test_columnar_export(tmp_path, monkeypatch):
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        with pytest.raises(ImportError, match="pyarrow"):
+            InsightsExporter(str(tmp_path), columnar=True)
+        return
+
+    with InsightsExporter(str(tmp_path), columnar=True, columnar_batch_rows=1) as exporter:
+        exporter.write("a", INSIGHTS)
+        exporter.write("b", INSIGHTS)
+    (part,) = (tmp_path / "fields").iterdir()
+    table = pyarrow.parquet.read_table(str(part))
+    assert table.column("document").to_pylist() == ["a", "a", "b", "b"]
+    assert table.column("section").to_pylist()[:2] == ["standard_fields", "custom_fields"]
+    assert table.column("confidence").to_pylist()[:2] == [0.9, 0.7]
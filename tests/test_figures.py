@@ -0,0 +1,46 @@
+import pytest
+from modules.figures import crop_figures
+
+fitz = pytest.importorskip("fitz")
+numpy = pytest.importorskip("numpy")
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    """A two-page PDF (8 x 8 inches) with a red square on page 1 and a blue one on page 2."""
+    document = fitz.open()
+    for color in ((1, 0, 0), (0, 0, 1)):
+        page = document.new_page(width=576, height=576)
+        page.draw_rect(fitz.Rect(72, 72, 216, 216), color=color, fill=color)
+    path = tmp_path / "catalog.pdf"
+    document.save(str(path))
+    document.close()
+    return str(path)
+
+
+def square(x0, y0, x1, y1):
+    return [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+
+
+def test_crop_figures_cuts_each_polygon_from_its_page(catalog):
+    figures = [
+        (1, square(1, 1, 3, 3)),
+        (2, square(1.5, 1.5, 2.5, 2.5)),
+        (2, square(7, 7, 9, 9)),  # Runs off the page: cut at its edge
+        (None, square(1, 1, 2, 2)),
+        (1, None),
+    ]
+
+    crops = crop_figures(catalog, figures, dpi=72)
+
+    assert crops[3] is None and crops[4] is None
+    first, second, edge = (fitz.Pixmap(crop) for crop in crops[:3])
+    assert (first.width, first.height) == (144, 144)
+    assert first.pixel(72, 72) == (255, 0, 0)
+    assert (second.width, second.height) == (72, 72)
+    assert second.pixel(36, 36) == (0, 0, 255)
+    assert (edge.width, edge.height) == (72, 72)
+    assert edge.pixel(36, 36) == (255, 255, 255)
+
+    with open(catalog, "rb") as document:
+        assert crop_figures(document.read(), figures[:1], dpi=72)[0] == crops[0]
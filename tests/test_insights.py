@@ -0,0 +1,79 @@
+import json
+from azure.ai.formrecognizer import AnalyzeResult
+from azure.ai.formrecognizer._generated.v2023_07_31.models import AnalyzeResult as GeneratedAnalyzeResult
+from modules.document_intelligence import extract_invoice_insights
+from modules.insights import iter_insight_events, json_default
+
+
+def element(text, page):
+    return {"content": text, "spans": [], "boundingRegions": [{"pageNumber": page, "polygon": [0, 0, 1, 0, 1, 1, 0, 1]}]}
+
+
+def make_two_page_result():
+    return AnalyzeResult._from_generated(GeneratedAnalyzeResult.deserialize({
+        "apiVersion": "2023-07-31", "modelId": "prebuilt-document", "content": "",
+        "pages": [
+            {"pageNumber": 1, "spans": []},
+            {"pageNumber": 2, "spans": [], "barcodes": [
+                {"kind": "QRCode", "value": "https://example.com", "confidence": 0.8, "span": {"offset": 0, "length": 0}}
+            ]},
+        ],
+        "keyValuePairs": [
+            {"key": element("Total", 2), "value": element("10.00", 2), "confidence": 0.9},
+            {"key": element("Invoice", 1), "value": element("INV-1", 1), "confidence": 0.8},
+        ],
+        "tables": [{"rowCount": 2, "columnCount": 2, "spans": [], **element("", 1), "cells": [
+            {"rowIndex": 0, "columnIndex": 0, "columnSpan": 2, **element("Header", 1)},
+            {"rowIndex": 1, "columnIndex": 1, **element("10", 2)},
+        ]}],
+    }))
+
+
+def test_insight_events_are_yielded_page_by_page():
+    """
+    Test that insight events are tagged with their page and yielded in page order, tables followed by
+    their rows, and that every event serializes to a JSON line.
+    """
+    events = list(iter_insight_events(make_two_page_result()))
+
+    assert [(event["event"], event["page"]) for event in events] == [
+        ("standard_field", 1), ("table", 1), ("table_row", 1), ("table_row", 2),
+        ("standard_field", 2), ("barcode", 2),
+    ]
+    assert events[0]["key"] == "Invoice" and events[0]["value"] == "INV-1"
+    assert events[2]["cells"] == ["Header", "Header"] and events[3]["cells"] == ["", "10"]
+    assert events[5]["type"] == "QRCode" and events[5]["value"] == "https://example.com"
+    line = json.loads(json.dumps(events[0], default=json_default))
+    assert line["bounding_box"] == [[0, 0], [1, 0], [1, 1], [0, 1]]
+    print("Insight events test passed!")
+
+
+def test_collected_insight_events_match_the_insights_dictionary():
+    """
+    Test that collecting the insight events into sections gives back what `to_dict()` holds, page-level
+    barcodes included, with the rows of each table making up its data.
+    """
+    analysis_result = make_two_page_result()
+    collected = {"standard_fields": {}, "custom_fields": {}, "tables": [], "images": [], "barcodes": []}
+    for event in iter_insight_events(analysis_result):
+        kind = event.pop("event")
+        page = event.pop("page")
+        if kind == "standard_field":
+            collected["standard_fields"][event.pop("key")] = event
+        elif kind == "custom_field":
+            collected["custom_fields"][event.pop("name")] = event
+        elif kind == "table":
+            collected["tables"].append({"row_count": event["row_count"], "column_count": event["column_count"],
+                                        "data": []})
+        elif kind == "table_row":
+            collected["tables"][event["table"]]["data"].append(event["cells"])
+        elif kind == "image":
+            collected["images"].append({**event, "page": page})
+        else:
+            collected["barcodes"].append(event)
+
+    insights = extract_invoice_insights(analysis_result).to_dict()
+
+    assert collected == insights
+    assert insights["barcodes"] == [{"type": "QRCode", "value": "https://example.com", "confidence": 0.8}]
+    print("Collected insight events test passed!")
@@ -0,0 +1,203 @@
+import pytest
+import threading
+import time
+from modules.jobs import DONE, FAILED, QUEUED, RUNNING, InMemoryJobStore, JobQueue, QueueFullError, SQLiteJobStore
+
+
+def test_job_queue_runs_jobs_and_records_failures():
+    """
+    Test that submitted jobs return an id immediately and end up done or failed in the store.
+    """
+    def handler(payload):
+        if payload["file_path"] == "broken.pdf":
+            raise RuntimeError("Analysis failed")
+        return {"standard_fields": {"File": {"value": payload["file_path"]}}}
+
+    job_queue = JobQueue(handler, InMemoryJobStore(), workers=2).start()
+    ok_id = job_queue.submit({"file_path": "invoice.pdf"})
+    failed_id = job_queue.submit({"file_path": "broken.pdf"})
+    job_queue.join()
+
+    assert job_queue.get(ok_id)["status"] == DONE
+    assert job_queue.get(ok_id)["result"]["standard_fields"]["File"]["value"] == "invoice.pdf"
+    assert job_queue.get(failed_id)["status"] == FAILED
+    assert job_queue.get(failed_id)["error"] == "Analysis failed"
+    print("Job queue test passed!")
+
+
+def test_job_queue_rejects_jobs_when_full():
+    """
+    Test that the queue pushes back once `max_pending` jobs are waiting.
+    """
+    started, release = threading.Event(), threading.Event()
+
+    def handler(payload):
+        started.set()
+        release.wait()
+
+    job_queue = JobQueue(handler, InMemoryJobStore(), workers=1, max_pending=1).start()
+    job_queue.submit({"file_path": "running.pdf"})
+    started.wait()
+    job_queue.submit({"file_path": "waiting.pdf"})
+
+    with pytest.raises(QueueFullError):
+        job_queue.submit({"file_path": "rejected.pdf"})
+    release.set()
+    job_queue.join()
+    print("Job queue full test passed!")
+
+
+def test_sqlite_job_store_resumes_unfinished_jobs(tmp_path):
+    """
+    Test that jobs left queued in the SQLite store are processed by the next queue.
+    """
+    path = str(tmp_path / "jobs.sqlite")
+    store = SQLiteJobStore(path)
+    store.create("left-over", {"file_path": "invoice.pdf"})
+    assert store.get("left-over")["status"] == QUEUED
+
+    job_queue = JobQueue(lambda payload: {"done": payload["file_path"]}, SQLiteJobStore(path), workers=1)
+    assert SQLiteJobStore(path).get("left-over")["status"] == QUEUED  # Nothing runs before start()
+    job_queue.start().join()
+
+    job = SQLiteJobStore(path).get("left-over")
+    assert job["status"] == DONE
+    assert job["result"] == {"done": "invoice.pdf"}
+    print("SQLite job store resume test passed!")
+
+
+def test_queues_sharing_a_store_run_each_job_once(tmp_path):
+    """
+    Test that when several processes resume the same SQLite store, each job is claimed and run by
+    only one of them, and that a job whose worker died is run again once its lease expires.
+    """
+    path = str(tmp_path / "jobs.sqlite")
+    store = SQLiteJobStore(path)
+    for index in range(20):
+        store.create(f"job-{index}", {"index": index})
+    store.create("abandoned", {"index": "abandoned"})
+    assert store.claim("abandoned", "dead-worker", lease_seconds=-1)
+    runs = []
+    lock = threading.Lock()
+
+    def handler(payload):
+        with lock:
+            runs.append(payload["index"])
+
+    queues = [JobQueue(handler, SQLiteJobStore(path), workers=3) for _ in range(3)]
+    for job_queue in queues:
+        job_queue.start()
+    for job_queue in queues:
+        job_queue.join()
+
+    assert sorted(runs, key=str) == sorted(list(range(20)) + ["abandoned"], key=str)
+    assert all(store.get(f"job-{index}")["status"] == DONE for index in range(20))
+    assert not store.claim("job-0", "late-worker", lease_seconds=60)
+    print("Shared job store test passed!")
+
+
+@pytest.mark.parametrize("store_factory", [InMemoryJobStore, lambda: SQLiteJobStore(":memory:")])
+def test_finished_jobs_expire_after_their_ttl(store_factory):
+    """
+    Test that finished jobs are deleted once they are older than the TTL, and unfinished ones are kept.
+    """
+    store = store_factory()
+    for job_id in ("old-done", "old-failed", "new-done", "running"):
+        store.create(job_id, {})
+    store.update("old-done", DONE, result={})
+    store.update("old-failed", FAILED, error="boom")
+    assert store.claim("running", "worker", lease_seconds=60)
+    time.sleep(0.01)
+    cutoff = time.time()
+    time.sleep(0.01)
+    store.update("new-done", DONE, result={})
+
+    assert store.purge(cutoff) == 2
+    assert store.get("old-done") is None and store.get("old-failed") is None
+    assert store.get("new-done")["status"] == DONE and store.get("running")["status"] == RUNNING
+
+    job_queue = JobQueue(lambda payload: payload, store, workers=1, ttl_seconds=0).start()
+    job_queue.submit({})
+    assert store.get("new-done") is None
+    print("Job TTL test passed!")
+
+
+@pytest.mark.parametrize("store_factory", [InMemoryJobStore, lambda: SQLiteJobStore(":memory:")])
+def test_transient_payload_fields_are_dropped_when_jobs_finish(store_factory):
+    """
+    Test that a document sent along with a job is kept only until the job finishes, done or failed.
+    """
+    def handler(payload):
+        if payload["filename"] == "broken.pdf":
+            raise RuntimeError("Analysis failed")
+        return {"size": len(payload["content"])}
+
+    store = store_factory()
+    job_queue = JobQueue(handler, store, workers=1, transient_fields=("content",))
+    ok_id = job_queue.submit({"filename": "invoice.pdf", "content": "JVBERi0x"})
+    failed_id = job_queue.submit({"filename": "broken.pdf", "content": "JVBERi0y"})
+    assert store.get(ok_id)["payload"]["content"] == "JVBERi0x"
+    job_queue.start().join()
+
+    assert store.get(ok_id)["result"] == {"size": 8}
+    assert store.get(ok_id)["payload"] == {"filename": "invoice.pdf"}
+    assert store.get(failed_id)["status"] == FAILED
+    assert store.get(failed_id)["payload"] == {"filename": "broken.pdf"}
+    print("Transient payload test passed!")
+
+
+def test_running_queue_picks_up_jobs_left_by_dead_workers(tmp_path):
+    """
+    Test that a queue already running takes over, without a restart, a job whose worker died after
+    claiming it and a job left queued by a process that is gone, once their lease has passed.
+    """
+    path = str(tmp_path / "jobs.sqlite")
+    store = SQLiteJobStore(path)
+    runs = []
+    job_queue = JobQueue(lambda payload: runs.append(payload["name"]), SQLiteJobStore(path), workers=1,
+                         lease_seconds=0.05).start()
+
+    store.create("abandoned", {"name": "abandoned"})
+    assert store.claim("abandoned", "dead-worker", lease_seconds=0.05)
+    store.create("orphaned", {"name": "orphaned"})
+    time.sleep(0.1)
+    job_queue.submit({"name": "new"})
+    job_queue.join()
+
+    assert sorted(runs) == ["abandoned", "new", "orphaned"]
+    assert store.get("abandoned")["status"] == DONE and store.get("orphaned")["status"] == DONE
+    print("Abandoned job recovery test passed!")
+
+
+def test_store_errors_do_not_stop_the_workers():
+    """
+    Test that a worker survives job store errors while claiming or recording a job, leaving the job
+    claimed for its lease to expire, and goes on to run the next jobs.
+    """
+    class FlakyStore(InMemoryJobStore):
+        def __init__(self):
+            super().__init__()
+            self.failures = {"claim": 1, "update": 2}
+
+        def _fail(self, method):
+            if self.failures[method]:
+                self.failures[method] -= 1
+                raise RuntimeError("database is locked")
+
+        def claim(self, job_id, worker_id, lease_seconds):
+            self._fail("claim")
+            return super().claim(job_id, worker_id, lease_seconds)
+
+        def update(self, job_id, status, result=None, error=None, payload=None):
+            self._fail("update")
+            super().update(job_id, status, result, error, payload)
+
+    store = FlakyStore()
+    job_queue = JobQueue(lambda payload: payload, store, workers=1).start()
+    job_ids = [job_queue.submit({"index": index}) for index in range(3)]
+    job_queue.join()
+
+    assert store.get(job_ids[0])["status"] == QUEUED
+    assert store.get(job_ids[1])["status"] == RUNNING and store.get(job_ids[1])["lease_until"] > time.time()
+    assert store.get(job_ids[2])["status"] == DONE
+    print("Job store error test passed!")
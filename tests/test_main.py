@@ -0,0 +1,74 @@
+import os
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import patch
+from main import RENDER_POOL_MIN_ITEMS, _render_image_placeholder, content_addressed_path, render_outputs, save_barcode, save_images
+
+
+def test_identical_values_are_rendered_once(tmp_path):
+    """
+    Test that values repeated in one run share a content-addressed file that is rendered only once,
+    and that different values get different files.
+    """
+    rendered = []
+
+    def render(value, path):
+        rendered.append(value)
+        return _render_image_placeholder(value, path)
+
+    jobs = [(value, content_addressed_path(str(tmp_path), "image", value)) for value in ("a", "b", "a", "a")]
+
+    assert jobs[0][1] == jobs[2][1] != jobs[1][1]
+    assert render_outputs(render, jobs, workers=1) == [jobs[0][1], jobs[1][1]]
+    assert rendered == ["a", "b"]
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(path) for path in (jobs[0][1], jobs[1][1]))
+    print("Render once test passed!")
+
+
+def test_files_from_an_earlier_run_are_reused(tmp_path, capsys):
+    """
+    Test that barcodes and images already rendered by an earlier run are not rendered again, and
+    that only the new ones are.
+    """
+    pytest.importorskip("barcode")
+    barcodes_dir, images_dir = str(tmp_path / "barcodes"), str(tmp_path / "images")
+    image = {"caption": "Logo", "page": 1, "bounding_box": [[0, 0], [1, 0], [1, 1], [0, 1]]}
+
+    save_barcode([{"value": "INV-1"}, {"value": "INV-1"}], output_dir=barcodes_dir, workers=1)
+    save_images([image, dict(image)], output_dir=images_dir, workers=1, document_id="hash")
+    first_run = capsys.readouterr().out
+    assert len(os.listdir(barcodes_dir)) == 1 and len(os.listdir(images_dir)) == 1
+    assert "already rendered" not in first_run
+
+    with patch("main._render_barcode") as render_barcode, patch("main._render_image_placeholder") as render_image:
+        render_barcode.side_effect = lambda value, path: path
+        save_barcode([{"value": "INV-1"}, {"value": "INV-2"}], output_dir=barcodes_dir, workers=1)
+        save_images([image], output_dir=images_dir, workers=1, document_id="hash")
+
+    assert [call.args[0] for call in render_barcode.call_args_list] == ["INV-2"]
+    render_image.assert_not_called()
+    second_run = capsys.readouterr().out
+    assert second_run.count("Barcode already rendered:") == 1 and "Image already rendered:" in second_run
+    print("Earlier run reuse test passed!")
+
+
+def test_process_pool_writes_the_same_files_as_serial_rendering(tmp_path):
+    """
+    Test that rendering in the process pool writes the same files, with the same contents, as
+    rendering them one by one in this process.
+    """
+    values = [f"Figure {index}" for index in range(RENDER_POOL_MIN_ITEMS + 4)] * 2
+    outputs = {}
+    for workers in (1, 2):
+        output_dir = tmp_path / f"workers_{workers}"
+        output_dir.mkdir()
+        jobs = [(value, content_addressed_path(str(output_dir), "image", value)) for value in values]
+        with patch("main.ProcessPoolExecutor", wraps=ProcessPoolExecutor) as pool:
+            rendered = render_outputs(_render_image_placeholder, jobs, workers=workers)
+        assert pool.called == (workers > 1)
+        assert len(rendered) == RENDER_POOL_MIN_ITEMS + 4
+        outputs[workers] = {name: (output_dir / name).read_bytes() for name in os.listdir(output_dir)}
+
+    assert outputs[1] == outputs[2]
+    assert not any(name.endswith(".tmp") for name in outputs[2])
+    print("Render pool test passed!")
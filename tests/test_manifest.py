@@ -0,0 +1,50 @@
+import json
+import os
+from unittest.mock import patch
+from modules.analysis_cache import hash_file
+from modules.manifest import BatchManifest
+from modules.pipeline import run_batch
+
+
+@patch("modules.pipeline.hash_file", wraps=hash_file)
+@patch("modules.pipeline.extract_invoice_insights")
+@patch("modules.pipeline.analyze_invoice_bytes_with_sdk")
+def test_manifest_resumes_with_new_changed_and_failed_documents(mock_analyze, mock_extract, mock_hash, documents,
+                                                                cache, tmp_path):
+    """
+    Test that a run with a manifest only processes documents that are new, changed or failed since
+    the previous run, without hashing unchanged ones again.
+    """
+    def analyze(content, model_id):
+        if b"invoice 3" in content:
+            raise RuntimeError("500 Server Error")
+
+    mock_analyze.side_effect = analyze
+    mock_extract.return_value = {"standard_fields": {}}
+    manifest_path = str(tmp_path / "manifest.sqlite")
+    output = tmp_path / "results.jsonl"
+
+    manifest = BatchManifest(manifest_path)
+    counts = run_batch(documents, str(output), direct_max_bytes=1000, manifest=manifest)
+    manifest.close()
+
+    assert counts == {"analyzed": 5, "failed": 1}
+    manifest = BatchManifest(manifest_path)
+    entry = manifest.get(documents[0])
+    assert entry["status"] == "analyzed" and entry["size"] == os.path.getsize(documents[0])
+    assert entry["file_hash"] == hash_file(documents[0]) and entry["blob_name"] is None
+    with open(output, "rb") as results:
+        results.seek(entry["output_offset"])
+        assert json.loads(results.readline())["file"] == documents[0]
+
+    # The failed document is retried with its recorded hash; only the changed one is hashed again
+    mock_analyze.side_effect = None
+    mock_hash.reset_mock()
+    with open(documents[1], "ab") as changed:
+        changed.write(b" amended")
+    counts = run_batch(documents, str(output), direct_max_bytes=1000, manifest=manifest)
+
+    assert counts == {"unchanged": 4, "analyzed": 2}
+    assert [call.args[0] for call in mock_hash.call_args_list] == [documents[1]]
+    assert manifest.counts() == {"analyzed": 6}
+    assert len(output.read_text().splitlines()) == 8
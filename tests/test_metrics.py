@@ -0,0 +1,54 @@
+from modules.analysis_cache import AnalysisCache
+from modules.azure_blob import generate_blob_urls, upload_blob_in_blocks
+from modules.metrics import enable_metrics, render_prometheus, snapshot, span, summary_rows
+
+
+def test_disabled_metrics_record_nothing(tmp_path):
+    """
+    Test that spans and counters are no-ops while metrics are disabled.
+    """
+    with span("upload") as first, span("analysis_poll") as second:
+        pass
+    assert first is second
+    AnalysisCache(str(tmp_path / "cache.sqlite")).get("missing", "prebuilt-document")
+    assert snapshot() == {"stages": {}, "counters": {}}
+    print("Disabled metrics test passed!")
+
+
+def test_stage_timings_and_counters(monkeypatch, tmp_path):
+    """
+    Test that uploads, SAS generation and cache lookups are timed and counted, including retried
+    block writes and the bytes sent, and exported in the Prometheus text format.
+    """
+    from benchmarks.stubs import StubServer
+
+    enable_metrics()
+    file_path = tmp_path / "large.pdf"
+    file_path.write_bytes(b"x" * 100_000)
+    with StubServer() as server:
+        monkeypatch.setenv("AZURE_STORAGE_BLOB_ENDPOINT", f"{server.url}/acct")
+        monkeypatch.setenv("AZURE_STORAGE_BLOB_CONTAINER_NAME", "invoices")
+        monkeypatch.setattr("modules.azure_blob.RETRY_BACKOFF_SECONDS", 0)
+        server.fail("comp=block&", times=1, status=503)
+        upload_blob_in_blocks(str(file_path), block_size=64 * 1024)
+    generate_blob_urls(["large.pdf"])
+    generate_blob_urls(["large.pdf"])
+    AnalysisCache(str(tmp_path / "cache.sqlite")).get("missing", "prebuilt-document")
+
+    recorded = snapshot()
+    assert recorded["stages"]["upload"]["count"] == 1
+    assert recorded["stages"]["sas"]["count"] == 2
+    counters = recorded["counters"]
+    assert counters[("retries", (("operation", "blob_put"),))] == 1
+    assert counters[("retryable_responses", (("status", "503"),))] == 1
+    assert counters[("bytes_sent", ())] >= 100_000
+    assert counters[("cache_hits", (("cache", "sas"),))] == 1
+    assert counters[("cache_misses", (("cache", "analysis"),))] == 1
+
+    exported = render_prometheus()
+    assert 'docanalyzer_stage_duration_seconds_count{stage="upload"} 1' in exported
+    assert 'docanalyzer_retries_total{operation="blob_put"} 1' in exported
+    stage_rows, counter_rows = summary_rows()
+    assert [row[0] for row in stage_rows] == ["sas", "upload"]
+    assert ["cache_hits cache=sas", 1] in counter_rows
+    print("Stage timings and counters test passed!")
@@ -0,0 +1,139 @@
+import json
+from unittest.mock import patch, MagicMock
+from modules.analysis_cache import hash_file
+from modules.pipeline import analyze_file, collect_files, process_file, run_batch
+from modules.storage import InMemoryBackend, content_name
+
+
+def test_collect_files(documents, tmp_path):
+    """
+    Test that directories and glob patterns expand to a sorted list without duplicates.
+    """
+    folder = str(tmp_path / "drop")
+    assert collect_files([folder, f"{folder}/invoice_1.*"]) == sorted(documents)
+    print("Collect files test passed!")
+
+
+@patch("modules.pipeline.extract_invoice_insights")
+@patch("modules.pipeline.analyze_invoice_with_sdk")
+@patch("modules.azure_blob.generate_blob_urls")
+@patch("modules.azure_blob.upload_blob_with_sdk")
+def test_run_batch_writes_every_document(mock_upload, mock_generate_url, mock_analyze, mock_extract,
+                                         documents, cache, tmp_path):
+    """
+    Test that every document reaches the JSON Lines output, including failures, and that cached
+    documents skip upload and analysis.
+    """
+    mock_generate_url.side_effect = lambda names: [f"https://blob/{name}?sas" for name in names]
+    failing = content_name(hash_file(documents[3]), documents[3])
+
+    def analyze(url, model_id):
+        if failing in url:
+            raise RuntimeError("429 Too Many Requests")
+        return MagicMock()
+
+    mock_analyze.side_effect = analyze
+    mock_extract.return_value = {"standard_fields": {"Total": {"value": "1.00"}}}
+
+    first_run = tmp_path / "first.jsonl"
+    counts = run_batch(documents, str(first_run), upload_workers=2, sas_workers=1, analysis_workers=3, queue_size=2,
+                       direct_max_bytes=0)
+
+    results = [json.loads(line) for line in first_run.read_text().splitlines()]
+    assert counts == {"analyzed": 5, "failed": 1}
+    assert sorted(result["file"] for result in results) == documents
+    failed = [result for result in results if result["status"] == "failed"]
+    assert failed[0]["stage"] == "analysis" and "429" in failed[0]["error"]
+
+    mock_upload.reset_mock()
+    mock_analyze.side_effect = None
+    second_run = tmp_path / "second.jsonl"
+    counts = run_batch(documents, str(second_run), direct_max_bytes=0)
+
+    assert counts == {"cached": 5, "analyzed": 1}
+    assert mock_upload.call_count == 1
+    print("Run batch test passed!")
+
+
+@patch("modules.pipeline.extract_invoice_insights")
+@patch("modules.pipeline.analyze_invoice_bytes_with_sdk")
+@patch("modules.pipeline.analyze_invoice_with_sdk")
+@patch("modules.azure_blob.generate_blob_urls")
+@patch("modules.azure_blob.upload_blob_with_sdk")
+def test_small_documents_are_sent_directly(mock_upload, mock_generate_url, mock_analyze_url, mock_analyze_bytes,
+                                           mock_extract, documents, cache, tmp_path):
+    """
+    Test that documents under the size threshold skip the upload and SAS steps, and larger ones don't.
+    """
+    mock_extract.return_value = {"standard_fields": {}}
+    large = tmp_path / "large.pdf"
+    large.write_bytes(b"%PDF" + b"x" * 1000)
+
+    counts = run_batch(documents + [str(large)], str(tmp_path / "results.jsonl"), direct_max_bytes=100)
+
+    assert counts == {"analyzed": 7}
+    assert mock_analyze_bytes.call_count == 6
+    assert mock_analyze_bytes.call_args_list[0].args[0].startswith(b"%PDF invoice")
+    mock_upload.assert_called_once_with(str(large), skip_if_unchanged=True,
+                                        blob_name=content_name(hash_file(str(large)), str(large)))
+    assert mock_analyze_url.call_count == 1
+
+    mock_upload.reset_mock()
+    large.write_bytes(b"%PDF" + b"y" * 1000)
+    analyze_file(str(large), direct_max_bytes=2000)
+    mock_upload.assert_not_called()
+    assert mock_analyze_bytes.call_count == 7
+    print("Direct analysis test passed!")
+
+
+@patch("modules.pipeline.extract_invoice_insights", side_effect=lambda result: {"content": result})
+@patch("modules.pipeline.analyze_invoice_bytes_with_sdk", side_effect=lambda content, model_id: content.decode())
+def test_same_named_files_in_different_folders_are_staged_apart(mock_analyze, mock_extract, cache, tmp_path):
+    """
+    Test that files with the same base name in different folders are staged under their own names,
+    so each is analyzed (and cached) with its own content.
+    """
+    paths = []
+    for folder in ("a", "b"):
+        (tmp_path / folder).mkdir()
+        path = tmp_path / folder / "invoice.pdf"
+        path.write_bytes(f"%PDF from {folder}".encode())
+        paths.append(str(path))
+    storage = InMemoryBackend()
+    output = tmp_path / "results.jsonl"
+
+    counts = run_batch(collect_files([str(tmp_path / "a"), str(tmp_path / "b")]), str(output), direct_max_bytes=0,
+                       storage=storage)
+
+    assert counts == {"analyzed": 2}
+    results = {result["file"]: result for result in map(json.loads, output.read_text().splitlines())}
+    for path, folder in zip(paths, ("a", "b")):
+        assert results[path]["insights"] == {"content": f"%PDF from {folder}"}
+        assert results[path]["blob_name"] == content_name(hash_file(path), path)
+        assert cache.get(hash_file(path), results[path]["model_id"]) == {"content": f"%PDF from {folder}"}
+    assert len(storage.documents) == 2
+    print("Same-named files test passed!")
+
+
+@patch("modules.pipeline.extract_invoice_insights", return_value={"standard_fields": {}})
+@patch("modules.pipeline.analyze_invoice_bytes_with_sdk")
+def test_process_file_reports_how_the_document_was_analyzed(mock_analyze, mock_extract, documents, cache):
+    """
+    Test that process_file tells a staged analysis (with its blob name) from a cached one, which
+    uploads nothing.
+    """
+    storage = InMemoryBackend()
+
+    result = process_file(documents[0], direct_max_bytes=0, storage=storage, pages_per_shard=0)
+
+    assert result["status"] == "analyzed" and result["analysis_result"] is mock_analyze.return_value
+    assert result["blob_name"] == content_name(hash_file(documents[0]), documents[0])
+    assert list(storage.documents) == [result["blob_name"]]
+
+    storage.documents.clear()
+    result = process_file(documents[0], direct_max_bytes=0, storage=storage)
+
+    assert result["status"] == "cached" and "blob_name" not in result and "analysis_result" not in result
+    assert result["insights"] == {"standard_fields": {}}
+    assert storage.documents == {} and mock_analyze.call_count == 1
+    print("Process file test passed!")
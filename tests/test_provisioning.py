@@ -0,0 +1,72 @@
+import pytest
+import threading
+from unittest.mock import MagicMock
+from azure.core.exceptions import ResourceNotFoundError
+from modules.provisioning import ensure_once, forget, run_with_ensured
+
+
+def test_ensure_once_creates_resource_once():
+    """
+    Test that `ensure_once` only runs the creation step the first time a resource is seen.
+    """
+    create = MagicMock()
+
+    ensure_once(("container", "https://acct", "invoices"), create)
+    ensure_once(("container", "https://acct", "invoices"), create)
+    assert create.call_count == 1
+
+    forget(("container", "https://acct", "invoices"))
+    ensure_once(("container", "https://acct", "invoices"), create)
+    assert create.call_count == 2
+    print("Ensure once test passed!")
+
+
+def test_slow_creation_only_holds_up_its_own_resource():
+    """
+    Test that while one resource is being created, other resources can be ensured and forgotten
+    without waiting for it, and concurrent callers for the same resource create it once.
+    """
+    started, release = threading.Event(), threading.Event()
+    slow_create = MagicMock(side_effect=lambda: (started.set(), release.wait()))
+    slow_key = ("container", "https://acct", "slow")
+    callers = [threading.Thread(target=ensure_once, args=(slow_key, slow_create)) for _ in range(2)]
+    callers[0].start()
+    started.wait()
+    callers[1].start()
+
+    other_create = MagicMock()
+    ensure_once(("container", "https://acct", "invoices"), other_create)
+    forget(slow_key)
+    assert other_create.call_count == 1 and not release.is_set()
+
+    release.set()
+    for caller in callers:
+        caller.join()
+    assert slow_create.call_count == 1
+    print("Per-resource lock test passed!")
+
+
+def test_run_with_ensured_recreates_after_not_found():
+    """
+    Test that a 404 on write forgets the resource, re-creates it and retries the write once.
+    """
+    create = MagicMock()
+    operation = MagicMock(side_effect=[ResourceNotFoundError("ContainerNotFound"), "uploaded"])
+
+    assert run_with_ensured(("container", "https://acct", "invoices"), create, operation) == "uploaded"
+    assert create.call_count == 2
+    assert operation.call_count == 2
+    print("Run with ensured test passed!")
+
+
+def test_run_with_ensured_propagates_other_errors():
+    """
+    Test that errors other than 404 are raised without re-creating the resource.
+    """
+    create = MagicMock()
+    operation = MagicMock(side_effect=ValueError("boom"))
+
+    with pytest.raises(ValueError):
+        run_with_ensured(("share", "https://acct", "documents"), create, operation)
+    assert create.call_count == 1
+    print("Run with ensured error test passed!")
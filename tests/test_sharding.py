@@ -0,0 +1,113 @@
+from azure.ai.formrecognizer import AnalyzeResult
+from azure.ai.formrecognizer._generated.v2023_07_31.models import AnalyzeResult as GeneratedAnalyzeResult
+import pytest
+import sys
+from unittest.mock import patch
+from modules.insights import InvoiceInsights
+from modules.sharding import analyze_sharded, count_pdf_pages, page_ranges
+
+
+def region(page):
+    return [{"pageNumber": page, "polygon": [0, 0, 1, 0, 1, 1, 0, 1]}]
+
+
+def cell(row, column, text, page):
+    return {"rowIndex": row, "columnIndex": column, "content": text, "boundingRegions": region(page), "spans": []}
+
+
+def shard_result(first_page, last_page, content, table_rows, field_value, field_confidence):
+    """A shard's result: one table on its boundary page and one invoice field."""
+    page = first_page if first_page > 1 else last_page
+    return AnalyzeResult._from_generated(GeneratedAnalyzeResult.deserialize({
+        "apiVersion": "2023-07-31", "modelId": "prebuilt-invoice", "content": content,
+        "pages": [{"pageNumber": number, "spans": [{"offset": 0, "length": len(content)}]}
+                  for number in range(first_page, last_page + 1)],
+        "keyValuePairs": [{"key": {"content": f"Page {first_page}", "boundingRegions": region(first_page),
+                                   "spans": [{"offset": 0, "length": 4}]},
+                           "confidence": 0.9}],
+        "tables": [{"rowCount": len(table_rows), "columnCount": 2, "boundingRegions": region(page), "spans": [],
+                    "cells": [cell(row, column, text, page)
+                              for row, values in enumerate(table_rows) for column, text in enumerate(values)]}],
+        "documents": [{"docType": "invoice", "confidence": 0.8, "spans": [],
+                       "fields": {"InvoiceTotal": {"type": "string", "valueString": field_value,
+                                                   "content": field_value, "confidence": field_confidence}}}],
+    }))
+
+
+def test_page_counting_and_ranges(tmp_path):
+    """
+    Test that pages are counted from the page tree, not from the page objects in the file, so a PDF
+    updated incrementally or saved with compressed object streams gets its real page count, and that
+    the pages are split into ranges of the shard size.
+    """
+    fitz = pytest.importorskip("fitz")
+    document = fitz.open()
+    for _ in range(3):
+        document.new_page()
+    path = tmp_path / "document.pdf"
+    document.save(str(path))
+    compressed = document.tobytes(use_objstms=1, deflate=True)
+    document.close()
+
+    # Deleting a page in an incremental update leaves its object in the file
+    with fitz.open(str(path)) as updated:
+        updated.delete_page(0)
+        updated.saveIncr()
+
+    assert count_pdf_pages(str(path)) == 2
+    assert count_pdf_pages(path.read_bytes()) == 2
+    assert count_pdf_pages(compressed) == 3
+    assert count_pdf_pages(b"\x89PNG") is None
+    assert page_ranges(7, 3) == ["1-3", "4-6", "7-7"]
+    print("Page counting test passed!")
+
+
+def test_pages_are_not_counted_without_pymupdf(monkeypatch, capsys):
+    """
+    Test that without PyMuPDF the page count is unknown, so documents are analyzed in a single
+    request, and that the missing dependency is reported once.
+    """
+    monkeypatch.setattr("modules.sharding._missing_parser_reported", False)
+    with patch.dict(sys.modules, {"fitz": None}):
+        assert count_pdf_pages(b"%PDF-1.4\n<< /Type /Pages /Count 2 >>") is None
+        assert count_pdf_pages(b"%PDF-1.4\n<< /Type /Pages /Count 3 >>") is None
+    assert capsys.readouterr().out.count("needs 'pymupdf'") == 1
+    print("Page counting without PyMuPDF test passed!")
+
+
+@patch("modules.sharding.analyze_invoice_bytes_with_sdk")
+def test_sharded_analysis_merges_results(mock_analyze):
+    """
+    Test that the shards of a document are analyzed as page ranges and merged into one result, with
+    their pages, offsets, tables running across the boundary and most confident fields joined back.
+    """
+    shards = {
+        "1-2": shard_result(1, 2, "first shard", [["Item", "Price"], ["Pen", "1"]], "10.00", 0.4),
+        "3-4": shard_result(3, 4, "second shard", [["Item", "Price"], ["Ink", "2"]], "12.00", 0.9),
+    }
+    mock_analyze.side_effect = lambda document, model_id, pages: shards[pages]
+
+    result = analyze_sharded(document=b"%PDF", page_count=4, pages_per_shard=2, workers=2)
+
+    assert sorted(call.kwargs["pages"] for call in mock_analyze.call_args_list) == ["1-2", "3-4"]
+    assert result.content == "first shard\nsecond shard"
+    assert [page.page_number for page in result.pages] == [1, 2, 3, 4]
+    # Spans of the second shard point into the merged content
+    assert result.pages[2].spans[0].offset == len("first shard\n")
+    second_key = result.key_value_pairs[1].key
+    assert result.content[second_key.spans[0].offset:][:4] == "seco"
+
+    insights = InvoiceInsights.from_analysis_result(result)
+    # The table running across the shard boundary is joined, without its repeated header
+    assert [table["data"] for table in insights.tables] == [[["Item", "Price"], ["Pen", "1"], ["Ink", "2"]]]
+    assert list(insights.standard_fields) == ["Page 1", "Page 3"]
+    assert insights.custom_fields["InvoiceTotal"]["value"] == "12.00"
+    print("Sharded analysis test passed!")
+
+
+@patch("modules.sharding.analyze_invoice_with_sdk")
+def test_short_documents_are_not_sharded(mock_analyze):
+    """Test that a document fitting in one shard is analyzed in a single request, without a page range."""
+    analyze_sharded(url="https://example.com/a.pdf", page_count=3, pages_per_shard=5)
+    mock_analyze.assert_called_once_with("https://example.com/a.pdf", "prebuilt-document", pages=None)
+    print("Short document test passed!")
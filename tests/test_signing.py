@@ -0,0 +1,73 @@
+import base64
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+from azure.storage.fileshare import FileSasPermissions, generate_file_sas
+from modules.signing import SasUrlCache, SharedKeySigner
+
+ACCOUNT_KEY = base64.b64encode(b"test-account-key").decode()
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+EXPIRY = START + timedelta(hours=10)
+
+
+def test_sas_tokens_match_the_sdk():
+    """
+    Test that the signer's blob and file SAS tokens are identical to the ones generated by the Azure SDK.
+    """
+    sdk_blob_token = generate_blob_sas(
+        "acct", "invoices", "Invoice 1.pdf", account_key=ACCOUNT_KEY, permission=BlobSasPermissions(read=True),
+        start=START, expiry=EXPIRY, resource="b"
+    )
+    sdk_file_token = generate_file_sas(
+        "acct", "documents", ["Invoice 1.pdf"], account_key=ACCOUNT_KEY, permission=FileSasPermissions(read=True),
+        start=START, expiry=EXPIRY
+    )
+    sdk_version = dict(part.split("=") for part in sdk_blob_token.split("&"))["sv"]
+
+    signer = SharedKeySigner("acct", ACCOUNT_KEY)
+    with patch("modules.signing.SAS_VERSION", sdk_version):
+        assert signer.sas_token("blob", "invoices", "Invoice 1.pdf", "r", START, EXPIRY) == sdk_blob_token
+        assert signer.sas_token("file", "documents", "Invoice 1.pdf", "r", START, EXPIRY) == sdk_file_token
+    print("SAS tokens test passed!")
+
+
+def test_sas_url_cache_refreshes_before_expiry():
+    """
+    Test that cached URLs are reused, only missing ones are signed, and URLs are renewed near their expiry.
+    """
+    now = [START]
+    signer = SharedKeySigner("acct", ACCOUNT_KEY)
+    cache = SasUrlCache(signer, "blob", "https://acct.blob.core.windows.net", "invoices", timedelta(hours=10),
+                        timedelta(hours=1), refresh_margin=timedelta(minutes=30), clock=lambda: now[0])
+
+    with patch.object(signer, "sas_tokens", wraps=signer.sas_tokens) as sas_tokens:
+        first = cache.urls(["a.pdf", "b.pdf"])
+        assert first[0].startswith("https://acct.blob.core.windows.net/invoices/a.pdf?st=")
+
+        now[0] = START + timedelta(hours=9)
+        assert cache.urls(["a.pdf", "b.pdf", "c.pdf"])[:2] == first
+        assert sas_tokens.call_args_list[-1].args[2] == ["c.pdf"]
+
+        now[0] = START + timedelta(hours=9, minutes=45)
+        assert cache.url("a.pdf") != first[0]
+        assert sas_tokens.call_count == 3
+    print("SAS URL cache test passed!")
+
+
+def test_sas_url_cache_is_bounded():
+    """
+    Test that the cache keeps at most `max_entries` URLs, dropping the least recently used and expired ones.
+    """
+    now = [START]
+    cache = SasUrlCache(SharedKeySigner("acct", ACCOUNT_KEY), "blob", "https://acct.blob.core.windows.net",
+                        "invoices", timedelta(hours=1), timedelta(0), clock=lambda: now[0], max_entries=3)
+
+    cache.urls(["a.pdf", "b.pdf", "c.pdf"])
+    cache.url("a.pdf")
+    cache.url("d.pdf")
+    assert list(cache._urls) == ["c.pdf", "a.pdf", "d.pdf"]
+
+    now[0] = START + timedelta(hours=2)
+    cache.url("e.pdf")
+    assert list(cache._urls) == ["e.pdf"]
+    print("Bounded SAS URL cache test passed!")
@@ -0,0 +1,100 @@
+import pytest
+from unittest.mock import patch
+from modules.analysis_cache import AnalysisCache, hash_file
+from modules.pipeline import run_batch
+from modules.storage import (
+    BlobHttpBackend, BlobSdkBackend, FileShareBackend, InMemoryBackend, LocalFileBackend, StorageBackend, content_name,
+    get_storage_backend,
+)
+
+
+def check_backend(backend, tmp_path):
+    """Runs one document through every operation of a storage backend."""
+    file_path = tmp_path / "invoice.pdf"
+    file_path.write_bytes(b"%PDF invoice")
+
+    assert backend.exists("invoice.pdf") is False
+    assert backend.upload(str(file_path)) is True
+    assert backend.upload(str(file_path), skip_if_unchanged=True) is False
+    assert backend.exists("invoice.pdf") is True
+    assert backend.read("invoice.pdf") == b"%PDF invoice"
+    assert "invoice.pdf" in backend.url("invoice.pdf")
+
+    streamed = backend.upload_stream(iter([b"%PDF ", b"streamed"]), "streamed.pdf")
+    assert streamed["size"] == 13
+    assert backend.read("streamed.pdf") == b"%PDF streamed"
+
+    assert backend.delete("invoice.pdf") is True
+    assert backend.delete("invoice.pdf") is False
+    assert backend.exists("invoice.pdf") is False
+
+
+def test_local_and_in_memory_backends(tmp_path):
+    """
+    Test that the offline backends upload, report, read and delete documents.
+    """
+    local = LocalFileBackend(str(tmp_path / "storage"))
+    check_backend(local, tmp_path)
+    assert local.url("streamed.pdf").startswith("file://")
+    check_backend(InMemoryBackend(), tmp_path)
+    print("Local and in-memory backend test passed!")
+
+
+def test_incomplete_backends_cannot_be_instantiated():
+    """
+    Test that a backend missing one of the storage operations fails when it is created, not when the
+    operation is first called, and that every configured backend implements them all.
+    """
+    class UploadOnly(StorageBackend):
+        def upload(self, file_path, skip_if_unchanged=False, name=None):
+            return True
+
+    with pytest.raises(TypeError, match="abstract"):
+        UploadOnly()
+    backends = (BlobSdkBackend, BlobHttpBackend, FileShareBackend, LocalFileBackend, InMemoryBackend)
+    assert all(not backend.__abstractmethods__ for backend in backends)
+    print("Abstract storage backend test passed!")
+
+
+def test_blob_http_backend(monkeypatch, tmp_path):
+    """
+    Test the Blob HTTP backend against the local Blob stand-in.
+    """
+    from benchmarks.stubs import StubServer
+
+    with StubServer() as server:
+        monkeypatch.setenv("AZURE_STORAGE_BLOB_ENDPOINT", f"{server.url}/acct")
+        monkeypatch.setenv("AZURE_STORAGE_BLOB_CONTAINER_NAME", "invoices")
+        check_backend(BlobHttpBackend(), tmp_path)
+    assert list(server.blobs) == ["invoices/streamed.pdf"]
+    print("Blob HTTP backend test passed!")
+
+
+@patch("modules.pipeline.extract_invoice_insights")
+@patch("modules.pipeline.analyze_invoice_bytes_with_sdk")
+@patch("modules.pipeline.analyze_invoice_with_sdk")
+def test_pipeline_runs_on_the_configured_backend(mock_analyze_url, mock_analyze_bytes, mock_extract,
+                                                  monkeypatch, tmp_path):
+    """
+    Test that STORAGE_BACKEND selects where the batch pipeline stages documents, and that documents
+    in a local backend are sent to the service as bytes.
+    """
+    monkeypatch.setenv("STORAGE_BACKEND", "memory")
+    mock_extract.return_value = {"standard_fields": {}}
+    paths = []
+    for index in range(3):
+        path = tmp_path / f"invoice_{index}.pdf"
+        path.write_bytes(f"%PDF {index}".encode())
+        paths.append(str(path))
+
+    with patch("modules.pipeline.get_analysis_cache", return_value=AnalysisCache(str(tmp_path / "cache.sqlite"))):
+        counts = run_batch(paths, str(tmp_path / "results.jsonl"), direct_max_bytes=0)
+
+    assert counts == {"analyzed": 3}
+    assert sorted(get_storage_backend().documents) == sorted(content_name(hash_file(path), path) for path in paths)
+    assert sorted(call.args[0] for call in mock_analyze_bytes.call_args_list) == [b"%PDF 0", b"%PDF 1", b"%PDF 2"]
+    mock_analyze_url.assert_not_called()
+
+    with pytest.raises(ValueError):
+        get_storage_backend("ftp")
+    print("Pipeline storage backend test passed!")
@@ -0,0 +1,52 @@
+import io
+import pytest
+from modules.streaming import open_multipart_file, read_if_small
+
+BOUNDARY = "----docanalyzer"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def multipart_body(content, filename="invoice.pdf", field_name="file"):
+    return (
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"note\"\r\n\r\nhello\r\n"
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"{field_name}\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: application/pdf\r\n\r\n"
+    ).encode() + content + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def test_open_multipart_file_streams_chunks():
+    """
+    Test that the file part is yielded in small chunks that add up to the uploaded bytes.
+    """
+    content = bytes(range(256)) * 64
+    filename, chunks = open_multipart_file(io.BytesIO(multipart_body(content)), CONTENT_TYPE, read_size=1024)
+
+    parts = list(chunks)
+    assert filename == "invoice.pdf"
+    assert b"".join(parts) == content
+    assert max(len(part) for part in parts) <= 1024
+    print("Open multipart file test passed!")
+
+
+def test_open_multipart_file_without_file_part():
+    """
+    Test that a body without the file field returns no file, and a non-multipart body is rejected.
+    """
+    body = multipart_body(b"%PDF", field_name="other")
+    assert open_multipart_file(io.BytesIO(body), CONTENT_TYPE) == (None, None)
+
+    with pytest.raises(ValueError):
+        open_multipart_file(io.BytesIO(b"{}"), "application/json")
+    print("Open multipart file without file part test passed!")
+
+
+def test_read_if_small():
+    """
+    Test that a small stream is returned whole and a large one is replayed from the start.
+    """
+    assert read_if_small(iter([b"ab", b"cd"]), 4) == (b"abcd", None)
+
+    content, chunks = read_if_small(iter([b"ab", b"cd", b"ef"]), 3)
+    assert content is None
+    assert b"".join(chunks) == b"abcdef"
+    print("Read if small test passed!")
@@ -0,0 +1,130 @@
+import hashlib
+import io
+import json
+import pytest
+from unittest.mock import patch
+from azure.ai.formrecognizer import AnalyzeResult
+from azure.ai.formrecognizer._generated.v2023_07_31.models import AnalyzeResult as GeneratedAnalyzeResult
+from modules.analysis_cache import AnalysisCache
+from modules.document_intelligence import DEFAULT_MODEL_ID
+from modules.jobs import DONE, InMemoryJobStore, JobQueue
+from modules.storage import InMemoryBackend
+
+
+def insights_for(content):
+    return {"standard_fields": {"Content": {"value": content, "confidence": 1.0}}, "custom_fields": {},
+            "tables": [], "barcodes": [], "images": []}
+
+
+@pytest.fixture
+def web(monkeypatch, tmp_path):
+    """The web app with in-memory storage and jobs, a fresh cache, and documents over 8 bytes staged."""
+    import web.app as web_app
+
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite"))
+    monkeypatch.setattr(web_app, "storage", InMemoryBackend())
+    monkeypatch.setattr(web_app, "job_queue", JobQueue(web_app.process_document, InMemoryJobStore(), workers=2))
+    with patch("web.app.get_analysis_cache", return_value=cache), \
+            patch("modules.pipeline.get_analysis_cache", return_value=cache), \
+            patch("web.app.direct_analysis_max_bytes", return_value=8), \
+            patch("modules.pipeline.extract_invoice_insights", side_effect=insights_for), \
+            patch("modules.pipeline.analyze_invoice_bytes_with_sdk", side_effect=lambda content, model_id: content):
+        web_app.app.config["TESTING"] = True
+        yield web_app, cache
+
+
+def upload(client, content, filename="invoice.pdf", path="/"):
+    return client.post(path, data={"file": (io.BytesIO(content), filename)}, content_type="multipart/form-data")
+
+
+def one_field_result(content):
+    return AnalyzeResult._from_generated(GeneratedAnalyzeResult.deserialize({
+        "apiVersion": "2023-07-31", "modelId": "prebuilt-document", "content": "",
+        "pages": [{"pageNumber": 1, "spans": []}],
+        "keyValuePairs": [{"key": {"content": "Content", "spans": [], "boundingRegions": [
+            {"pageNumber": 1, "polygon": [0, 0, 1, 0, 1, 1, 0, 1]}
+        ]}, "value": {"content": content.decode(), "spans": []}, "confidence": 1.0}],
+    }))
+
+
+def test_uploads_with_the_same_name_are_staged_apart(web):
+    """
+    Test that two uploads sharing a file name are staged under different blobs, so each job analyzes
+    its own document, and that the staged blobs are deleted once analyzed.
+    """
+    web_app, _ = web
+    client = web_app.app.test_client()
+
+    job_ids = [upload(client, content).headers["Location"].rsplit("/", 1)[-1]
+               for content in (b"%PDF first upload", b"%PDF second upload")]
+    payloads = [web_app.job_queue.get(job_id)["payload"] for job_id in job_ids]
+    assert payloads[0]["blob_name"] != payloads[1]["blob_name"]
+    assert all(payload["blob_name"].endswith(".pdf") for payload in payloads)
+
+    web_app.job_queue.start().join()
+
+    for job_id, content in zip(job_ids, (b"%PDF first upload", b"%PDF second upload")):
+        job = web_app.job_queue.get(job_id)
+        assert job["status"] == DONE and job["result"] == insights_for(content)
+    assert web_app.storage.documents == {}
+    print("Same-named uploads test passed!")
+
+
+def test_cached_upload_is_not_queued_and_its_blob_is_deleted(web):
+    """
+    Test that an upload analyzed before is answered from the cache, without a job, and that the blob
+    staged while its hash was computed is removed.
+    """
+    web_app, cache = web
+    client = web_app.app.test_client()
+    content = b"%PDF analyzed before"
+    cache.set(hashlib.sha256(content).hexdigest(), DEFAULT_MODEL_ID, insights_for("cached"))
+
+    response = upload(client, content)
+
+    assert response.status_code == 200 and b"Content:</strong> cached" in response.data
+    assert web_app.storage.documents == {}
+    assert web_app.job_queue.store.unfinished() == []
+    print("Cached upload test passed!")
+
+
+def test_stream_reports_progress_before_the_insights(web):
+    """
+    Test that the streaming endpoint reports the upload and the analysis before the insight events,
+    for documents sent directly and for documents staged in storage.
+    """
+    web_app, _ = web
+    client = web_app.app.test_client()
+
+    analyze = patch("modules.pipeline.analyze_invoice_bytes_with_sdk",
+                    side_effect=lambda content, model_id: one_field_result(content))
+    with patch("web.app.analyze_invoice_bytes_with_sdk", side_effect=one_field_result), analyze:
+        for content in (b"%PDF", b"%PDF staged in storage"):
+            response = upload(client, content, path="/analyze/stream")
+            events = [json.loads(line) for line in response.data.decode().splitlines()]
+
+            assert response.mimetype == "application/x-ndjson"
+            assert [event["event"] for event in events] == ["uploaded", "analyzing", "standard_field"]
+            assert events[0]["size"] == len(content)
+            assert events[2]["key"] == "Content" and events[2]["value"] == content.decode()
+    assert web_app.storage.documents == {}
+    print("Streaming progress test passed!")
+
+
+def test_stream_reports_a_failed_analysis_as_an_event(web):
+    """
+    Test that an analysis failing after the response started ends the stream with an error event, and
+    that the staged blob is still deleted.
+    """
+    web_app, _ = web
+    client = web_app.app.test_client()
+
+    with patch("modules.pipeline.analyze_invoice_bytes_with_sdk", side_effect=RuntimeError("service unavailable")):
+        response = upload(client, b"%PDF staged in storage", path="/analyze/stream")
+        events = [json.loads(line) for line in response.data.decode().splitlines()]
+
+    assert [event["event"] for event in events] == ["uploaded", "analyzing", "error"]
+    assert "service unavailable" in events[-1]["error"]
+    assert web_app.storage.documents == {}
+    assert upload(client, b"", filename="", path="/analyze/stream").status_code == 400
+    print("Streaming failure test passed!")
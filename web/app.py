@@ -1,54 +1,213 @@
-from flask import Flask, request, render_template, redirect, url_for, flash
-from modules.azure_blob import upload_blob_with_sdk, generate_blob_url
-from modules.document_intelligence import analyze_invoice_with_sdk, extract_invoice_insights
+from flask import (
+    Flask, Response, request, render_template, redirect, url_for, flash, jsonify, abort, stream_with_context
+)
+from modules.analysis_cache import get_analysis_cache
+from modules.document_intelligence import DEFAULT_MODEL_ID, analyze_invoice_bytes_with_sdk, direct_analysis_max_bytes
+from modules.export import document_name, get_exporter
+from modules.insights import iter_insight_events, json_default
+from modules.jobs import (
+    DONE, FAILED, DEFAULT_JOB_TTL_SECONDS, DEFAULT_JOB_WORKERS, JobQueue, QueueFullError, get_job_store
+)
+from modules.metrics import metrics_enabled, render_prometheus
+from modules.pipeline import analyze_blob, analyze_bytes, analyze_stored
+from modules.storage import get_storage_backend
+from modules.streaming import open_multipart_file, read_if_small
+from modules.utils import get_optional_env_variable
+import base64
+import hashlib
+import json
 import os
+import uuid
 
 app = Flask(__name__)
 app.secret_key = "supersecretkey"  # Para mensagens flash
 
-UPLOAD_FOLDER = "resources"
-app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+# O backend de armazenamento vem da configuração (STORAGE_BACKEND)
+storage = get_storage_backend()
+
+
+def staging_name(filename):
+    """
+    Names an upload's blob uniquely, keeping the file's extension: the name the client sent is shared
+    by unrelated uploads, and the content hash is only known once the upload is over.
+    """
+    return f"upload-{uuid.uuid4().hex}{os.path.splitext(filename)[1].lower()}"
+
+
+def process_document(payload):
+    """
+    Job handler: analyzes the uploaded blob, or the document sent along with the job, returning its insights.
+    With EXPORT_DIR set, the insights are also appended to the exports there.
+    """
+    if "content" in payload:
+        insights = analyze_bytes(base64.b64decode(payload["content"]), payload.get("file_hash"))
+    else:
+        try:
+            insights = analyze_blob(payload["blob_name"], payload.get("file_hash"), storage=storage)
+        finally:
+            # O blob só existia para esta análise
+            storage.delete(payload["blob_name"])
+
+    exporter = get_exporter()
+    if exporter is not None:
+        exporter.write(document_name(payload["filename"], payload.get("file_hash")), insights,
+                       file=payload["filename"], model_id=DEFAULT_MODEL_ID)
+        exporter.flush()
+    return insights
+
+
+# Os documentos são processados em segundo plano por um pool limitado de workers,
+# iniciados por create_app() (e não na importação do módulo)
+job_queue = JobQueue(
+    process_document,
+    store=get_job_store(),
+    workers=int(get_optional_env_variable("JOB_WORKERS", DEFAULT_JOB_WORKERS)),
+    ttl_seconds=float(get_optional_env_variable("JOB_TTL_SECONDS", DEFAULT_JOB_TTL_SECONDS)),
+    # Os bytes de documentos pequenos só são necessários até a análise terminar
+    transient_fields=("content",),
+)
+
+
+def create_app():
+    """
+    Starts the job workers and returns the app, e.g. `gunicorn "web.app:create_app()"`. With JOB_STORE=sqlite,
+    several worker processes can share the job store: each job is claimed by exactly one of them.
+    """
+    job_queue.start()
+    return app
 
-# Garante que a pasta de uploads existe
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 @app.route("/", methods=["GET", "POST"])
 def upload_file():
     if request.method == "POST":
-        if "file" not in request.files:
+        try:
+            filename, chunks = open_multipart_file(request.stream, request.content_type)
+        except ValueError:
+            filename, chunks = None, None
+        if filename is None:
             flash("No file part in the request.")
             return redirect(request.url)
 
-        file = request.files["file"]
-        if file.filename == "":
+        if filename == "":
             flash("No selected file.")
             return redirect(request.url)
 
-        file_path = os.path.join(app.config["UPLOAD_FOLDER"], file.filename)
-        file.save(file_path)
+        # Documentos pequenos são enviados direto para a análise, sem passar pelo Blob
+        content, chunks = read_if_small(chunks, direct_analysis_max_bytes())
+        if content is not None:
+            file_hash = hashlib.sha256(content).hexdigest()
+            job = {"content": base64.b64encode(content).decode("ascii"), "filename": filename, "file_hash": file_hash}
+        else:
+            try:
+                # O arquivo vai direto do corpo da requisição para o armazenamento, com um nome único
+                blob = storage.upload_stream(chunks, staging_name(filename))
+            except Exception as e:
+                flash(f"Error uploading file: {e}")
+                return redirect(request.url)
+            file_hash = blob["sha256"]
+            job = {"blob_name": blob["blob_name"], "filename": filename, "file_hash": file_hash}
+
+        # O hash do conteúdo permite reaproveitar análises anteriores; ele só é conhecido depois
+        # do upload, então o blob de um documento já analisado é apagado em seguida
+        insights = get_analysis_cache().get(file_hash, DEFAULT_MODEL_ID)
+        if insights is not None:
+            if "blob_name" in job:
+                storage.delete(job["blob_name"])
+            return render_template("results.html", insights=insights)
 
         try:
-            # Passo 1: Upload do arquivo para o Azure Blob Storage
-            upload_blob_with_sdk(file_path)
+            # Enfileira a análise e responde imediatamente com o id do job
+            job_id = job_queue.submit(job)
+        except QueueFullError as e:
+            flash(str(e))
+            return redirect(request.url)
+        return redirect(url_for("job_page", job_id=job_id))
 
-            # Passo 2: Gerar URL do Blob
-            blob_url = generate_blob_url(file.filename)
+    return render_template("index.html")
 
-            # Passo 3: Analisar o documento com Azure Document Intelligence
-            analysis_result = analyze_invoice_with_sdk(blob_url)
 
-            # Passo 4: Extrair insights do resultado
-            insights = extract_invoice_insights(analysis_result)
+@app.route("/analyze/stream", methods=["POST"])
+def analyze_stream():
+    """
+    Analyzes the uploaded document and streams its progress and insights as JSON Lines, one event per
+    line. The response starts right away: an "uploaded" event (with the document's size) once the
+    upload is received, "analyzing" while the analysis runs, then the insights page by page (see
+    modules.insights.iter_insight_events). Since the status is sent before the analysis is over, a
+    failure is reported as a final "error" event. The analysis cache is not used, since cached
+    insights carry no page numbers.
+    """
+    try:
+        filename, chunks = open_multipart_file(request.stream, request.content_type)
+    except ValueError:
+        filename, chunks = None, None
+    if not filename:
+        return jsonify({"error": "No file in the request."}), 400
 
-            # Passo 5: Renderizar os resultados na página de resultados
-            return render_template("results.html", insights=insights)
+    def event_line(event):
+        return json.dumps(event, default=json_default) + "\n"
 
+    def generate():
+        blob_name = None
+        try:
+            content, rest = read_if_small(chunks, direct_analysis_max_bytes())
+            if content is None:
+                blob = storage.upload_stream(rest, staging_name(filename))
+                blob_name = blob["blob_name"]
+            yield event_line({"event": "uploaded", "size": len(content) if content is not None else blob["size"]})
+            yield event_line({"event": "analyzing"})
+            if content is not None:
+                analysis_result = analyze_invoice_bytes_with_sdk(content)
+            else:
+                analysis_result = analyze_stored(blob_name, storage=storage)
         except Exception as e:
-            flash(f"Error processing file: {e}")
-            return redirect(request.url)
+            yield event_line({"event": "error", "error": f"Error analyzing file: {e}"})
+            return
+        finally:
+            if blob_name is not None:
+                storage.delete(blob_name)
 
-    return render_template("index.html")
+        # Cada evento é enviado assim que é extraído, sem montar o resultado inteiro
+        for event in iter_insight_events(analysis_result):
+            yield event_line(event)
+
+    # O corpo da requisição é lido dentro do gerador, depois que a resposta começou
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@app.route("/jobs/<job_id>")
+def job_page(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    if job["status"] == DONE:
+        return render_template("results.html", insights=job["result"])
+    if job["status"] == FAILED:
+        flash(f"Error processing file: {job['error']}")
+        return redirect(url_for("upload_file"))
+    # Ainda na fila ou em processamento: a página consulta o status até terminar
+    return render_template("job.html", job=job)
+
+
+@app.route("/jobs/<job_id>/status")
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify({"id": job["id"], "status": job["status"], "error": job["error"]})
+
+
+@app.route("/metrics")
+def metrics():
+    # Formato texto do Prometheus; a coleta é ligada com METRICS_ENABLED=1
+    if not metrics_enabled():
+        abort(404)
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    # Verifica o container uma única vez, antes do primeiro upload
+    try:
+        storage.ensure()
+    except Exception as e:
+        print(f"Warning: could not prepare the storage backend at startup: {e}")
+    create_app().run(debug=True)